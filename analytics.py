@@ -0,0 +1,261 @@
+"""Collection analytics over the payment ledger with NumPy.
+
+A `Ledger` holds one academic year as arrays: students x 12 months of
+payments, plus each student's class, monthly fee and opening balance. The
+report is computed from those arrays with vectorized operations, with no
+per-student Python loop. It covers:
+- expected vs collected per class and month, and the collection rate
+- aging of outstanding dues
+- a projection of the current month's collection
+
+Only the first load reads every payment of the year. Later refreshes read
+the payments and tombstones whose change-tracking version (see
+`migrations.add_change_tracking`) is newer than the loaded one, so a
+dashboard that follows a payment costs milliseconds instead of a full
+reload. A change to students or to balances carried between years
+(`years.bump_generation`) re-reads the roster and keeps the loaded payments.
+"""
+import sqlite3
+import threading
+
+import numpy as np
+
+MONTHS = 12
+LOOKUP_CHUNK = 500
+CELL = np.dtype([('student_id', np.int64), ('month_index', np.int64), ('amount', np.int64)])
+AGING_BUCKETS = ('current_month', 'one_month', 'two_months', 'three_months_plus', 'previous_year')
+
+
+def _meta(conn, key):
+    row = conn.execute("SELECT value FROM sync_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+class Ledger:
+    """Payments of one academic year as a students x months matrix."""
+
+    def __init__(self, db_path, year):
+        self.db_path = db_path
+        self.year = year
+        self.clock = None
+        self.epoch = None
+        self.device_id = None
+        self.lock = threading.Lock()
+        self.ids = np.zeros(0, dtype=np.int64)
+
+    def refresh(self):
+        """Bring the arrays up to date with the database; the caller holds `lock`."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("BEGIN")  # one snapshot for every read below
+            clock = _meta(conn, 'clock')
+            epoch = _meta(conn, 'ledger_epoch')
+            device_id = _meta(conn, 'device_id')
+            if (clock, epoch, device_id) == (self.clock, self.epoch, self.device_id):
+                return
+            if device_id != self.device_id:
+                # First load, or the database file was replaced (sync snapshot): versions are unrelated.
+                self.ids = np.zeros(0, dtype=np.int64)
+                self._load_roster(conn)
+            else:
+                if epoch != self.epoch or self._roster_changed(conn, self.clock):
+                    self._load_roster(conn)
+                self._apply(conn, self.clock)
+            self.clock, self.epoch, self.device_id = clock, epoch, device_id
+        finally:
+            conn.close()
+
+    def _roster_changed(self, conn, since):
+        return conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM student WHERE version > ?) "
+            "OR EXISTS (SELECT 1 FROM sync_tombstone WHERE entity = 'student' AND version > ?)", (since, since)
+        ).fetchone()[0]
+
+    def _load_roster(self, conn):
+        """(Re)read students, fees and opening balances, keeping the payments of students already loaded."""
+        # Only students with a balance row for the year: those enrolled while it was open.
+        students = conn.execute(
+            "SELECT s.id, s.class_name, b.total_expected / 12, b.opening_balance "
+            "FROM student s JOIN student_balance b ON b.student_id = s.id AND b.year = ? ORDER BY s.id",
+            (self.year,)
+        ).fetchall()
+        ids, class_names, fees, openings = zip(*students) if students else ((), (), (), ())
+        ids = np.array(ids, dtype=np.int64)
+        paid = np.zeros((len(ids), MONTHS), dtype=np.int64)
+        new_ids = ids
+        if len(self.ids) and len(ids):
+            rows = np.searchsorted(self.ids, ids)
+            known = (rows < len(self.ids)) & (self.ids[np.minimum(rows, len(self.ids) - 1)] == ids)
+            paid[known] = self.paid[rows[known]]
+            new_ids = ids[~known]
+        self.ids, self.paid = ids, paid
+        self.class_names, self.class_codes = np.unique(np.array(class_names, dtype=object), return_inverse=True)
+        self.class_codes = self.class_codes.reshape(-1)
+        self.fees = np.array(fees, dtype=np.int64)
+        self.openings = np.array(openings, dtype=np.int64)
+        # Students who just joined this year's roster may already have older payments
+        # (a year that was just opened has advance payments); read theirs.
+        if len(new_ids) > max(LOOKUP_CHUNK, len(ids) // 4):
+            self._load_payments(conn)
+        elif len(new_ids):
+            for start in range(0, len(new_ids), LOOKUP_CHUNK):
+                chunk = new_ids[start:start + LOOKUP_CHUNK].tolist()
+                self._set(self._cells(conn.execute(
+                    f"SELECT student_id, month_index, amount FROM payment "
+                    f"WHERE year = ? AND student_id IN ({', '.join('?' * len(chunk))})", [self.year] + chunk)))
+
+    def _load_payments(self, conn):
+        self.paid[:] = 0
+        self._set(self._cells(conn.execute(
+            "SELECT student_id, month_index, amount FROM payment WHERE year = ?", (self.year,))))
+
+    def _apply(self, conn, since):
+        # A tombstone for a cell that has a row again is stale: clear first, then set.
+        self._set(self._cells(conn.execute(
+            "SELECT s.id, t.month_index, 0 FROM sync_tombstone t JOIN student s ON s.uid = t.uid "
+            "WHERE t.entity = 'payment' AND t.year = ? AND t.version > ?", (self.year, since))))
+        self._set(self._cells(conn.execute(
+            "SELECT student_id, month_index, amount FROM payment WHERE year = ? AND version > ?",
+            (self.year, since))))
+
+    @staticmethod
+    def _cells(cursor):
+        return np.fromiter(cursor, dtype=CELL)
+
+    def _set(self, cells):
+        if not len(cells) or not len(self.ids):
+            return
+        rows = np.searchsorted(self.ids, cells['student_id'])
+        known = (rows < len(self.ids)) & (self.ids[np.minimum(rows, len(self.ids) - 1)] == cells['student_id'])
+        self.paid[rows[known], cells['month_index'][known]] = cells['amount'][known]
+
+
+class LedgerStore:
+    """Keeps one refreshed `Ledger` per academic year for the database at `db_path`."""
+
+    def __init__(self, db_path, max_years=3):
+        self.db_path = db_path
+        self.max_years = max_years
+        self._ledgers = {}
+        self._lock = threading.Lock()
+
+    def ledger(self, year):
+        with self._lock:
+            ledger = self._ledgers.pop(year, None) or Ledger(self.db_path, year)
+            self._ledgers[year] = ledger  # most recently used last
+            while len(self._ledgers) > self.max_years:
+                self._ledgers.pop(next(iter(self._ledgers)))
+        return ledger
+
+    def report(self, year, month):
+        ledger = self.ledger(year)
+        with ledger.lock:
+            ledger.refresh()
+            return report(ledger, month)
+
+    def dues_by_class(self, year, month):
+        ledger = self.ledger(year)
+        with ledger.lock:
+            ledger.refresh()
+            return dues_by_class(ledger, month)
+
+    def warm(self, year):
+        """Load `year` on a background thread so the first dashboard does not pay for the full read."""
+        def load():
+            ledger = self.ledger(year)
+            with ledger.lock:
+                ledger.refresh()
+        threading.Thread(target=load, name=f'ledger-{year}', daemon=True).start()
+
+
+def _rate(collected, expected):
+    return round(float(collected) / float(expected), 4) if expected else None
+
+
+def _by_class(ledger, values):
+    """Sum rows of `values` (per student) into one row per class."""
+    out = np.zeros((len(ledger.class_names),) + values.shape[1:], dtype=values.dtype)
+    np.add.at(out, ledger.class_codes, values)
+    return out
+
+
+def dues_by_class(ledger, month):
+    """{class_name: (dues up to `month`, students owing)}, the `outstanding` figures of `report`."""
+    outstanding = np.maximum(0, ledger.openings + ledger.fees * (month + 1) - ledger.paid[:, :month + 1].sum(axis=1))
+    totals = _by_class(ledger, outstanding)
+    defaulters = np.bincount(ledger.class_codes[outstanding > 0], minlength=len(ledger.class_names))
+    return {name: (int(totals[i]), int(defaulters[i])) for i, name in enumerate(ledger.class_names)}
+
+
+def report(ledger, month):
+    """The collection report for `ledger` as of `month` (0-11), as JSON-ready dicts."""
+    m = month
+    fees, openings, paid = ledger.fees, ledger.openings, ledger.paid
+    month_numbers = np.arange(1, MONTHS + 1)
+
+    # Same carry-forward as app.build_months_map, for every student and month at once.
+    cum_expected = openings[:, None] + fees[:, None] * month_numbers
+    cum_paid = np.cumsum(paid, axis=1)
+    expected_to_date = cum_expected[:, m]
+    paid_to_date = cum_paid[:, m]
+    outstanding = np.maximum(0, expected_to_date - paid_to_date)
+
+    # Aging: payments settle the oldest charge first, the opening balance before
+    # January. Columns are the opening balance, then months 0..m.
+    charges_to_date = np.concatenate([openings[:, None], cum_expected[:, :m + 1]], axis=1)
+    unsettled = np.diff(np.maximum(0, charges_to_date - paid_to_date[:, None]), axis=1, prepend=0)
+    age = m - np.arange(-1, m + 1)  # months since each charge fell due
+    bucket_of = np.where(age > m, 4, np.minimum(age, 3))  # column 0 (opening) is previous_year
+    buckets = np.zeros((m + 2, len(AGING_BUCKETS)), dtype=np.int64)
+    buckets[np.arange(m + 2), bucket_of] = 1
+    aging = unsettled @ buckets
+
+    # Projection for month m: students who have not paid it in full pay the rest
+    # at the share of the fee they paid in the earlier months of the year.
+    this_month = paid[:, m]
+    remaining = np.maximum(0, fees - this_month)
+    if m:
+        shares = np.minimum(1.0, paid[:, :m] / np.maximum(fees, 1)[:, None])
+        history = np.where(fees > 0, shares.mean(axis=1), 0.0)
+    else:
+        history = np.ones(len(fees))
+    projected = this_month + remaining * history
+
+    per_student = np.column_stack([openings, expected_to_date, paid_to_date, outstanding, this_month, projected])
+    class_totals = _by_class(ledger, per_student.astype(np.float64))
+    class_months_collected = _by_class(ledger, paid)
+    class_fees = _by_class(ledger, fees)
+    class_aging = _by_class(ledger, aging)
+    class_students = np.bincount(ledger.class_codes, minlength=len(ledger.class_names))
+    class_defaulters = np.bincount(ledger.class_codes, weights=outstanding > 0, minlength=len(ledger.class_names))
+
+    def summary(totals, fee_total, collected_by_month, aging_row, students, defaulters):
+        opening, expected, collected, due, month_collected, month_projected = totals
+        return {
+            'students': int(students),
+            'defaulters': int(defaulters),
+            'opening_balance': int(opening),
+            'expected_to_date': int(expected),
+            'collected_to_date': int(collected),
+            'collection_rate': _rate(collected, expected),
+            'outstanding': int(due),
+            'aging': dict(zip(AGING_BUCKETS, (int(v) for v in aging_row))),
+            'month': {
+                'expected': int(fee_total),
+                'collected': int(month_collected),
+                'projected': int(round(month_projected)),
+            },
+            'months': [
+                {'month_index': i, 'expected': int(fee_total), 'collected': int(c), 'collection_rate': _rate(c, fee_total)}
+                for i, c in enumerate(collected_by_month)
+            ],
+        }
+
+    school = summary(per_student.astype(np.float64).sum(axis=0), fees.sum(), paid.sum(axis=0), aging.sum(axis=0),
+                     len(fees), np.count_nonzero(outstanding))
+    classes = [
+        dict(class_name=name, **summary(class_totals[i], class_fees[i], class_months_collected[i], class_aging[i],
+                                        class_students[i], class_defaulters[i]))
+        for i, name in enumerate(ledger.class_names)
+    ]
+    return {'year': ledger.year, 'month_index': m, 'school': school, 'classes': classes}
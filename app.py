@@ -1,15 +1,48 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template
+from flask import (Flask, request, jsonify, render_template, abort, stream_with_context,
+                   stream_template, has_request_context)
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_cors import CORS
-from datetime import datetime
+from collections import namedtuple
+from datetime import date, datetime
+import atexit
+import functools
+import gzip
+import hashlib
+import json
 import os
+import uuid
+import analytics
+import assets
+import bulk_io
+import cache
+import metrics
+import migrations
+import notifications
+import student_search
+import years
 
-app = Flask(__name__, static_folder='static', template_folder='templates')
+# No built-in static route: send_static serves fingerprinted files from `asset_index`.
+app = Flask(__name__, static_folder=None, template_folder='templates')
 CORS(app)
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(BASE_DIR, 'school_fee.db')
+# SCHOOL_FEE_DB points the app at another database file (e.g. the benchmarks' generated one).
+DB_PATH = os.environ.get('SCHOOL_FEE_DB') or os.path.join(BASE_DIR, 'school_fee.db')
+ARCHIVE_PATH = years.archive_path(DB_PATH)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + DB_PATH
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# With several desks writing at once, a writer waits this long for the lock instead of failing.
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 15000))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000},
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+    'max_overflow': 20,
+}
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+GZIP_TYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/csv', 'text/plain',
+              'text/css', 'text/javascript', 'application/javascript')
 
 db = SQLAlchemy(app)
 
@@ -28,81 +61,574 @@ class Student(db.Model):
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id', ondelete='CASCADE'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)  # academic year, see years.py
     month_index = db.Column(db.Integer, nullable=False)  # 0-11
     amount = db.Column(db.Integer, nullable=False, default=0)
     paid_on = db.Column(db.DateTime, default=datetime.utcnow)
 
     student = db.relationship('Student', backref=db.backref('payments', lazy=True))
 
+    __table_args__ = (
+        db.Index('uq_payment_student_year_month', 'student_id', 'year', 'month_index', unique=True),
+    )
+
+class StudentBalance(db.Model):
+    # Maintained by triggers (see migrations.add_academic_years) and years.py; never written from here.
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    opening_balance = db.Column(db.Integer, nullable=False, default=0)
+    total_expected = db.Column(db.Integer, nullable=False, default=0)
+    total_paid = db.Column(db.Integer, nullable=False, default=0)
+    carry_forward_due = db.Column(db.Integer, nullable=False, default=0)
+    last_paid_month = db.Column(db.Integer, nullable=True)
+
+STUDENT_FIELDS = ('id', 'class_name', 'student_name', 'father_name', 'parent_phone', 'monthly_fee')
+STUDENT_SORTS = ('id', 'student_name', 'class_name')
+MAX_PAGE_SIZE = 1000
+
+def student_to_dict(s):
+    return {f: getattr(s, f) for f in STUDENT_FIELDS}
+
+def build_months_map(base_monthly, payments, opening_balance=0):
+    months_map = {m: {'paid': False, 'amount': 0, 'payment_id': None, 'paid_on': None} for m in range(12)}
+    for p in payments:
+        months_map[p.month_index] = {
+            'paid': p.amount > 0,
+            'amount': p.amount,
+            'payment_id': p.id,
+            'paid_on': p.paid_on.isoformat() if p.paid_on else None
+        }
+
+    # Dues brought forward from the previous academic year count from January.
+    cumulative_expected = opening_balance
+    cumulative_paid = 0
+    for idx in range(12):
+        cumulative_expected += base_monthly
+        cumulative_paid += months_map[idx]['amount']
+        due = max(0, cumulative_expected - cumulative_paid)
+        months_map[idx]['expected_this_month'] = base_monthly
+        months_map[idx]['carry_forward_due'] = due
+    return months_map
+
+def compute_etag(*parts):
+    # Hash the raw row tuples so a validator can be checked before any dicts or JSON are built.
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def conditional_response(etag, build):
+    """Answer 304 when the client already holds `etag`, otherwise call `build()` for the body."""
+    if request.if_none_match.contains_weak(etag):  # compress_response weakens the ETag
+        response = app.response_class(status=304)
+    else:
+        response = build()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+response_cache = cache.ResponseCache()
+
+def data_generation():
+    # The change-tracking clock (migrations.add_change_tracking) is bumped by triggers on
+    # every student and payment write, whether it comes from this app, an import, the
+    # Kivy app or a sync, so it serves as the cache generation for all of them.
+    return db.session.execute(db.text("SELECT value FROM sync_meta WHERE key = 'clock'")).scalar()
+
+def cached_response(view):
+    """Serve a read-only view from `response_cache` until the data generation or the month changes.
+
+    Dues and analytics count the months elapsed up to today (elapsed_month), so a
+    new month outdates them even when nothing was written. Only complete 200
+    responses are stored; streamed bodies and errors always run the view. Hits
+    still honour If-None-Match through the stored ETag.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        generation = (data_generation(), date.today().strftime('%Y-%m'))
+        key = (request.path, tuple(sorted(request.args.items(multi=True))), request.headers.get('Accept'))
+        entry = response_cache.get(generation, key)
+        if entry is not None:
+            body, headers = entry
+            response = app.response_class(body, headers=headers)
+            response.headers['X-Cache'] = 'HIT'
+            return response.make_conditional(request)
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            body = response.get_data()
+            response_cache.put(generation, key, (body, list(response.headers)), len(body))
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # SQLite leaves foreign keys (and so ON DELETE CASCADE) off unless asked per connection.
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+    dbapi_connection.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    # WAL lets reads run while another desk writes; NORMAL only syncs at checkpoints,
+    # which is still safe against corruption in WAL mode.
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+    dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+    # Transactions are begun by begin_transaction() instead of the sqlite3 module.
+    dbapi_connection.isolation_level = None
+
+def begin_transaction(conn):
+    # A deferred transaction that reads and then writes fails at once with "database is
+    # locked" if another desk committed in between; the busy timeout does not help there.
+    # Requests that may write take the write lock up front instead.
+    writes = has_request_context() and request.method not in ('GET', 'HEAD', 'OPTIONS')
+    conn.exec_driver_sql('BEGIN IMMEDIATE' if writes else 'BEGIN')
+
+@app.after_request
+def compress_response(response):
+    """Gzip text responses of at least GZIP_MIN_SIZE bytes for clients that accept it.
+
+    Streamed responses, files and bodies already encoded (see asset_response) pass through unchanged.
+    """
+    if response.mimetype not in GZIP_TYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or not request.accept_encodings.quality('gzip')
+            or (response.content_length or 0) < GZIP_MIN_SIZE):
+        return response
+    response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    # The bytes differ from the identity encoding, so the validator becomes weak.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
 def ensure_schema():
-    db.create_all()
+    raw = db.engine.raw_connection()
     try:
-        with db.engine.begin() as conn:
-            cols = [row[1] for row in conn.execute("PRAGMA table_info('student')").fetchall()]
-            if 'father_name' not in cols:
-                conn.execute("ALTER TABLE student ADD COLUMN father_name VARCHAR(100)")
-    except Exception:
-        db.session.rollback()
+        migrations.migrate(raw.driver_connection)
+    finally:
+        raw.close()
+
+def is_truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def delete_students_where(condition, dry_run=False):
+    """Delete every student matching `condition` together with their payments.
+
+    Runs one set-based DELETE in the session's transaction without loading
+    any rows. With `dry_run` only the counts are computed. Returns
+    (deleted_students, deleted_payments); the caller commits.
+    """
+    student_ids = db.select(Student.id).where(condition)
+    counts = db.session.execute(db.select(
+        db.select(db.func.count()).select_from(Student).where(condition).scalar_subquery(),
+        db.select(db.func.count()).select_from(Payment).where(Payment.student_id.in_(student_ids)).scalar_subquery()
+    )).one()
+    if dry_run:
+        return counts[0], counts[1]
+    # Payments go with their students through ON DELETE CASCADE; the student
+    # tombstones written for sync then cover them as well.
+    result = db.session.execute(
+        db.delete(Student).where(condition),
+        execution_options={'synchronize_session': False}
+    )
+    return result.rowcount, counts[1]
+
+def upsert_payments(rows):
+    """Insert or update many (student_id, year, month_index, amount) rows in a single statement.
+
+    Rows without a year go into the open academic year. The caller owns the
+    transaction; nothing is committed here.
+    """
+    if not rows:
+        return
+    now = datetime.utcnow()
+    open_year = current_year()
+    stmt = sqlite_insert(Payment.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['student_id', 'year', 'month_index'],
+        set_={'amount': stmt.excluded.amount, 'paid_on': stmt.excluded.paid_on}
+    )
+    db.session.execute(stmt, [
+        {'student_id': r['student_id'], 'year': r.get('year') or open_year, 'month_index': r['month_index'],
+         'amount': r['amount'], 'paid_on': now}
+        for r in rows
+    ])
+
+def parse_payment_fields(data):
+    """Validate month_index/amount from a request payload; returns (month_index, amount, error)."""
+    try:
+        month_index = int(data.get('month_index'))
+        amount = int(data.get('amount'))
+    except (TypeError, ValueError):
+        return None, None, 'month_index and amount must be integers'
+    if month_index < 0 or month_index > 11:
+        return None, None, 'month_index must be between 0 and 11'
+    if amount < 0:
+        return None, None, 'amount must be >= 0'
+    return month_index, amount, None
+
+def raw_connection():
+    # The sqlite3 connection behind the session, for the plain-sqlite3 helpers in `years`;
+    # timed so their statements show up in the request metrics.
+    return metrics.TimedConnection(db.session.connection().connection.driver_connection)
+
+def current_year():
+    return years.current_year(raw_connection())
+
+def parse_year(value):
+    """Resolve a `year` argument, defaulting to the open year; returns (year, status, error)."""
+    if value is None or value == '':
+        return current_year(), 'open', None
+    try:
+        year = int(value)
+    except (TypeError, ValueError):
+        return None, None, 'year must be an integer'
+    status = years.year_status(raw_connection(), year)
+    if status is None:
+        return None, None, f'unknown academic year {year}'
+    return year, status, None
+
+ArchivedPayment = namedtuple('ArchivedPayment', 'id month_index amount paid_on')
+
+def year_ledger(student, year, status):
+    """(monthly_fee, opening_balance, payments) of one student for an academic year.
+
+    Closed years keep the fee they were charged; archived years are read from the archive file.
+    """
+    if status == 'archived':
+        balance = years.archived_balance(ARCHIVE_PATH, student.id, year)
+        payments = [
+            ArchivedPayment(id, month_index, amount, datetime.fromisoformat(paid_on) if paid_on else None)
+            for id, month_index, amount, paid_on in years.archived_payments(ARCHIVE_PATH, student.id, year)
+        ]
+    else:
+        balance = db.session.get(StudentBalance, (student.id, year))
+        balance = balance and {'total_expected': balance.total_expected, 'opening_balance': balance.opening_balance}
+        payments = Payment.query.filter_by(student_id=student.id, year=year).all()
+    if balance is None or status == 'open':
+        monthly_fee = student.monthly_fee
+    else:
+        monthly_fee = balance['total_expected'] // 12
+    return monthly_fee, balance['opening_balance'] if balance else 0, payments
 
 with app.app_context():
+    event.listen(db.engine, 'connect', set_sqlite_pragmas)
+    event.listen(db.engine, 'begin', begin_transaction)
     ensure_schema()
+    metrics.init_app(app, db.engine, slow_ms=float(os.environ.get('SLOW_REQUEST_MS', 500)))
+
+def cache_metrics():
+    stats = response_cache.stats()
+    for name in ('hits', 'misses', 'evictions', 'invalidations'):
+        yield f'school_fee_cache_{name}_total', 'counter', f'Response cache {name}.', {}, stats[name]
+    yield 'school_fee_cache_entries', 'gauge', 'Responses held in the cache.', {}, stats['entries']
+    yield 'school_fee_cache_bytes', 'gauge', 'Bytes held in the cache.', {}, stats['bytes']
+
+metrics.registry.add_collector(cache_metrics)
+
+asset_index = assets.AssetIndex(os.path.join(BASE_DIR, 'static'), os.path.join(BASE_DIR, 'templates'),
+                                ('index.html', 'print.html')).build()
+app.jinja_env.globals['asset_url'] = asset_index.url
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+def asset_response(asset, cache_control):
+    """Serve an `assets.Asset` from memory in the best encoding the client accepts."""
+    encoding, body = asset.negotiate(request.accept_encodings)
+
+    def build():
+        response = app.response_class(body, mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        return response
+    response = conditional_response(asset.etag(encoding), build)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+@app.before_request
+def refresh_assets():
+    # The development server picks up edited static files and pages without a restart.
+    if app.debug:
+        asset_index.refresh()
 
 @app.route('/')
 def index():
-    return send_from_directory('templates', 'index.html')
+    return asset_response(asset_index.pages['index.html'], 'no-cache')
 
 @app.route('/print/<int:student_id>')
 def print_slip(student_id):
-    return send_from_directory('templates', 'print.html')
+    return asset_response(asset_index.pages['print.html'], 'no-cache')
+
+# One joined pass over the class: this month's payment plus everything paid up to it
+# in the open academic year, on top of the dues brought forward into it.
+CLASS_SLIPS_SQL = db.text(
+    "SELECT s.class_name, s.student_name, s.father_name, "
+    "COALESCE(SUM(CASE WHEN p.month_index = :month THEN p.amount END), 0) AS received, "
+    "MAX(0, COALESCE(b.opening_balance, 0) + (:month + 1) * s.monthly_fee - COALESCE(SUM(p.amount), 0)) AS balance "
+    "FROM student s "
+    "LEFT JOIN student_balance b ON b.student_id = s.id AND b.year = :year "
+    "LEFT JOIN payment p ON p.student_id = s.id AND p.year = :year AND p.month_index <= :month "
+    "WHERE s.class_name = :class_name "
+    "GROUP BY s.id ORDER BY s.student_name, s.id"
+)
+
+@app.route('/print/class/<path:class_name>')
+def print_class_slips(class_name):
+    month = request.args.get('month', request.args.get('month_index'))
+    if month is not None:
+        try:
+            month = int(month)
+        except ValueError:
+            abort(400, 'month must be an integer')
+        if month < 0 or month > 11:
+            abort(400, 'month must be 0..11')
+    # Without a month the monthly row stays blank (month -1 matches no payments).
+    rows = db.session.execute(CLASS_SLIPS_SQL, {
+        'class_name': class_name, 'month': -1 if month is None else month, 'year': current_year()})
+    # Rows are pulled from the cursor while the template renders, so the first
+    # pages go out before the last students are read.
+    return stream_template(
+        'print_class.html',
+        class_name=class_name,
+        month_label=MONTHS[month] if month is not None else '',
+        today=date.today().isoformat(),
+        slips=rows,
+    )
 
 # Admin repair endpoint
 @app.route('/admin/repair', methods=['POST'])
 def admin_repair():
-    ensure_schema()
     class_to_delete = request.args.get('delete_class')
-    deleted = 0
+    dry_run = is_truthy(request.args.get('dry_run'))
+    deleted = payments_deleted = 0
     if class_to_delete:
-        students = Student.query.filter_by(class_name=class_to_delete).all()
-        for s in students:
-            Payment.query.filter_by(student_id=s.id).delete()
-            db.session.delete(s)
-            deleted += 1
+        deleted, payments_deleted = delete_students_where(Student.class_name == class_to_delete, dry_run)
         db.session.commit()
-    return jsonify({'status': 'ok', 'deleted_students': deleted})
+    return jsonify({'status': 'ok', 'dry_run': dry_run, 'deleted_students': deleted, 'deleted_payments': payments_deleted})
 
 @app.route('/api/classes', methods=['GET'])
+@cached_response
 def list_classes():
     classes = db.session.query(Student.class_name).distinct().order_by(Student.class_name).all()
     return jsonify([c[0] for c in classes])
 
 @app.route('/api/classes/<path:class_name>', methods=['DELETE'])
 def delete_class(class_name):
-    students = Student.query.filter_by(class_name=class_name).all()
-    for s in students:
-        Payment.query.filter_by(student_id=s.id).delete()
-        db.session.delete(s)
+    dry_run = is_truthy(request.args.get('dry_run'))
+    deleted, payments_deleted = delete_students_where(Student.class_name == class_name, dry_run)
     db.session.commit()
-    return jsonify({'status': 'ok', 'deleted_students': len(students)})
+    return jsonify({'status': 'ok', 'dry_run': dry_run, 'deleted_students': deleted, 'deleted_payments': payments_deleted})
+
+def elapsed_month(year):
+    """The last month index of `year` that is due: this month for the year in progress, December for past years."""
+    today = date.today()
+    return today.month - 1 if year == today.year else 11 if year < today.year else 0
+
+def dues_to_date(year, status):
+    """SQL expression for what a student owes in `year` up to `elapsed_month(year)`; needs StudentBalance joined.
+
+    Opening balance plus the fees of the months so far, less what was paid towards
+    them, as on the print slips. Closed years are due in full (carry_forward_due).
+    """
+    if status != 'open':
+        return StudentBalance.carry_forward_due
+    month = elapsed_month(year)
+    paid = (
+        db.select(db.func.coalesce(db.func.sum(Payment.amount), 0))
+        .where(Payment.student_id == Student.id, Payment.year == year, Payment.month_index <= month)
+        .scalar_subquery()
+    )
+    return db.func.max(0, StudentBalance.opening_balance + (month + 1) * Student.monthly_fee - paid)
+
+@app.route('/api/classes/<path:class_name>/dues', methods=['GET'])
+@cached_response
+def class_dues(class_name):
+    year, status, error = parse_year(request.args.get('year'))
+    if error:
+        return jsonify({'error': error}), 400
+    if status == 'archived':
+        return jsonify({'error': f'academic year {year} is archived'}), 404
+    due = dues_to_date(year, status).label('due')
+    stmt = (
+        db.select(
+            Student.id, Student.student_name, Student.father_name, Student.parent_phone, Student.monthly_fee,
+            StudentBalance.opening_balance, StudentBalance.total_expected, StudentBalance.total_paid,
+            due, StudentBalance.carry_forward_due, StudentBalance.last_paid_month
+        )
+        .join(StudentBalance, db.and_(StudentBalance.student_id == Student.id, StudentBalance.year == year))
+        .where(Student.class_name == class_name)
+        .order_by(due.desc(), Student.id)
+    )
+    if is_truthy(request.args.get('defaulters')):
+        stmt = stmt.where(due > 0)
+    students = [dict(row._mapping) for row in db.session.execute(stmt)]
+    return jsonify({
+        'class_name': class_name,
+        'year': year,
+        'students': students,
+        'opening_balance': sum(s['opening_balance'] for s in students),
+        'total_expected': sum(s['total_expected'] for s in students),
+        'total_paid': sum(s['total_paid'] for s in students),
+        'total_due': sum(s['due'] for s in students),
+    })
+
+@app.route('/api/dues/summary', methods=['GET'])
+@cached_response
+def dues_summary():
+    year, status, error = parse_year(request.args.get('year'))
+    if error:
+        return jsonify({'error': error}), 400
+    if status == 'archived':
+        return jsonify({'error': f'academic year {year} is archived'}), 404
+    rows = db.session.execute(
+        db.select(
+            Student.class_name,
+            db.func.count().label('students'),
+            db.func.sum(StudentBalance.opening_balance).label('opening_balance'),
+            db.func.sum(StudentBalance.total_expected).label('total_expected'),
+            db.func.sum(StudentBalance.total_paid).label('total_paid')
+        )
+        .join(StudentBalance, db.and_(StudentBalance.student_id == Student.id, StudentBalance.year == year))
+        .group_by(Student.class_name)
+        .order_by(Student.class_name)
+    )
+    # Dues to date need every payment of the year; the analytics arrays already hold them.
+    dues = ledgers.dues_by_class(year, elapsed_month(year) if status == 'open' else 11)
+    summary = []
+    for row in rows:
+        entry = dict(row._mapping)
+        entry['total_due'], entry['defaulters'] = dues.get(row.class_name, (0, 0))
+        summary.append(entry)
+    return jsonify(summary)
+
+# Arrays per academic year, refreshed from the change-tracking versions; see analytics.py.
+ledgers = analytics.LedgerStore(DB_PATH)
+
+@app.route('/api/analytics', methods=['GET'])
+@cached_response
+def collection_analytics():
+    """Expected vs collected per class and month, aging of dues and this month's projected collection."""
+    year, status, error = parse_year(request.args.get('year'))
+    if error:
+        return jsonify({'error': error}), 400
+    if status == 'archived':
+        return jsonify({'error': f'academic year {year} is archived'}), 404
+    month = request.args.get('month', request.args.get('month_index'))
+    if month is None:
+        month = elapsed_month(year)
+    else:
+        try:
+            month = int(month)
+        except ValueError:
+            return jsonify({'error': 'month must be an integer'}), 400
+        if month < 0 or month > 11:
+            return jsonify({'error': 'month must be 0..11'}), 400
+    return jsonify(ledgers.report(year, month))
+
+def parse_student_listing(args):
+    """Build the roster SELECT from query args; returns (stmt, fields, limit) or raises ValueError."""
+    fields = [f for f in (args.get('fields') or '').split(',') if f] or list(STUDENT_FIELDS)
+    unknown = [f for f in fields if f not in STUDENT_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(unknown)}")
+    if 'id' not in fields:
+        fields.insert(0, 'id')  # rows are always addressable and pageable
+    sort = args.get('sort') or 'id'
+    if sort not in STUDENT_SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(STUDENT_SORTS)}")
+    limit = args.get('limit', type=int)
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    after_id = args.get('after_id', type=int)
+
+    stmt = db.select(*[getattr(Student, f) for f in fields])
+    if args.get('class'):
+        stmt = stmt.where(Student.class_name == args['class'])
+    if args.get('name'):
+        stmt = stmt.where(Student.student_name.contains(args['name'], autoescape=True))
+    if args.get('phone'):
+        stmt = stmt.where(Student.parent_phone.contains(args['phone'], autoescape=True))
+
+    sort_col = getattr(Student, sort)
+    if after_id is not None:
+        if sort == 'id':
+            stmt = stmt.where(Student.id > after_id)
+        else:
+            # Keyset on (sort column, id): resume strictly after the anchor row.
+            anchor = db.session.execute(db.select(sort_col).where(Student.id == after_id)).first()
+            if anchor is None:
+                raise ValueError('after_id does not match a student')
+            stmt = stmt.where(db.or_(sort_col > anchor[0], db.and_(sort_col == anchor[0], Student.id > after_id)))
+    stmt = stmt.order_by(sort_col, Student.id) if sort != 'id' else stmt.order_by(Student.id)
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)  # one extra row tells us whether another page exists
+    return stmt, fields, limit
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
 
 @app.route('/api/students', methods=['GET'])
+@cached_response
 def list_students():
-    class_filter = request.args.get('class')
-    query = Student.query
-    if class_filter:
-        query = query.filter(Student.class_name == class_filter)
-    students = query.all()
-    result = []
-    for s in students:
-        result.append({
-            'id': s.id,
-            'class_name': s.class_name,
-            'student_name': s.student_name,
-            'father_name': s.father_name,
-            'parent_phone': s.parent_phone,
-            'monthly_fee': s.monthly_fee
-        })
-    return jsonify(result)
+    try:
+        stmt, fields, limit = parse_student_listing(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if wants_ndjson():
+        def generate():
+            result = db.session.execute(stmt.execution_options(yield_per=500))
+            for i, row in enumerate(result):
+                if limit is not None and i == limit:
+                    break
+                yield json.dumps(dict(zip(fields, row))) + '\n'
+        return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    rows = [tuple(r) for r in db.session.execute(stmt)]
+    next_after_id = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after_id = rows[-1][0]
+    etag = compute_etag(fields, rows)
+    response = conditional_response(etag, lambda: jsonify([dict(zip(fields, r)) for r in rows]))
+    if next_after_id is not None:
+        response.headers['X-Next-After-Id'] = str(next_after_id)
+    return response
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Students whose name, father's name or parent phone matches `q`, best first (see student_search.py)."""
+    limit = request.args.get('limit', student_search.DEFAULT_LIMIT, type=int)
+    if not 0 < limit <= student_search.MAX_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {student_search.MAX_LIMIT}'}), 400
+    rows = student_search.search_students(
+        raw_connection(), request.args.get('q', ''), request.args.get('class') or None, limit)
+    return jsonify([dict(zip(STUDENT_FIELDS, row)) for row in rows])
+
+@app.route('/api/students/<int:student_id>', methods=['GET'])
+@cached_response
+def get_student(student_id):
+    s = Student.query.get_or_404(student_id)
+    include_payments = request.args.get('include') == 'payments'
+    monthly_fee, opening, payments = s.monthly_fee, 0, []
+    if include_payments:
+        year, status, error = parse_year(request.args.get('year'))
+        if error:
+            return jsonify({'error': error}), 400
+        monthly_fee, opening, payments = year_ledger(s, year, status)
+    etag = compute_etag(
+        (s.id, s.class_name, s.student_name, s.father_name, s.parent_phone, s.monthly_fee),
+        include_payments, monthly_fee, opening,
+        sorted((p.id, p.month_index, p.amount, p.paid_on) for p in payments)
+    )
+
+    def build():
+        result = student_to_dict(s)
+        if include_payments:
+            result['year'] = year
+            result['opening_balance'] = opening
+            result['payments'] = build_months_map(monthly_fee, payments, opening)
+        return jsonify(result)
+
+    return conditional_response(etag, build)
 
 @app.route('/api/students', methods=['POST'])
 def create_student():
@@ -138,79 +664,418 @@ def update_student(student_id):
 
 @app.route('/api/students/<int:student_id>', methods=['DELETE'])
 def delete_student(student_id):
-    s = Student.query.get_or_404(student_id)
-    Payment.query.filter_by(student_id=student_id).delete()
-    db.session.delete(s)
+    dry_run = is_truthy(request.args.get('dry_run'))
+    deleted, payments_deleted = delete_students_where(Student.id == student_id, dry_run)
+    if not deleted:
+        db.session.rollback()
+        abort(404)
     db.session.commit()
-    return jsonify({'status': 'ok'})
+    return jsonify({'status': 'ok', 'dry_run': dry_run, 'deleted_students': deleted, 'deleted_payments': payments_deleted})
 
 @app.route('/api/students/<int:student_id>/payments', methods=['GET'])
+@cached_response
 def get_payments(student_id):
     s = Student.query.get_or_404(student_id)
-    payments = Payment.query.filter_by(student_id=student_id).all()
-    base_monthly = s.monthly_fee
-
-    months_map = {m: {'paid': False, 'amount': 0, 'payment_id': None, 'paid_on': None} for m in range(12)}
-    for p in payments:
-        months_map[p.month_index] = {
-            'paid': p.amount > 0,
-            'amount': p.amount,
-            'payment_id': p.id,
-            'paid_on': p.paid_on.isoformat()
-        }
-
-    cumulative_expected = 0
-    cumulative_paid = 0
-    for idx in range(12):
-        cumulative_expected += base_monthly
-        cumulative_paid += months_map[idx]['amount']
-        due = max(0, cumulative_expected - cumulative_paid)
-        months_map[idx]['expected_this_month'] = base_monthly
-        months_map[idx]['carry_forward_due'] = due
-
-    return jsonify(months_map)
+    year, status, error = parse_year(request.args.get('year'))
+    if error:
+        return jsonify({'error': error}), 400
+    monthly_fee, opening, payments = year_ledger(s, year, status)
+    etag = compute_etag(year, monthly_fee, opening, sorted((p.id, p.month_index, p.amount, p.paid_on) for p in payments))
+    return conditional_response(etag, lambda: jsonify(build_months_map(monthly_fee, payments, opening)))
 
 @app.route('/api/students/<int:student_id>/payments', methods=['POST'])
 def set_payment(student_id):
     Student.query.get_or_404(student_id)
     data = request.json or {}
-    try:
-        month_index = int(data.get('month_index'))
-        amount = int(data.get('amount'))
-    except (TypeError, ValueError):
-        return jsonify({'error': 'month_index and amount must be integers'}), 400
-    if month_index < 0 or month_index > 11:
-        return jsonify({'error': 'month_index must be between 0 and 11'}), 400
-    if amount < 0:
-        return jsonify({'error': 'amount must be >= 0'}), 400
+    month_index, amount, error = parse_payment_fields(data)
+    if error:
+        return jsonify({'error': error}), 400
+    year, status, error = parse_year(data.get('year'))
+    if error:
+        return jsonify({'error': error}), 400
+    if status != 'open':
+        return jsonify({'error': f'academic year {year} is {status}'}), 409
 
-    p = Payment.query.filter_by(student_id=student_id, month_index=month_index).first()
-    if not p:
-        p = Payment(student_id=student_id, month_index=month_index, amount=amount)
-        db.session.add(p)
+    upsert_payments([{'student_id': student_id, 'year': year, 'month_index': month_index, 'amount': amount}])
+    db.session.commit()
+    p = Payment.query.filter_by(student_id=student_id, year=year, month_index=month_index).first()
+    return jsonify({'status': 'ok', 'payment_id': p.id, 'year': year})
+
+@app.route('/api/payments/bulk', methods=['POST'])
+def bulk_set_payments():
+    data = request.json or {}
+    year, status, error = parse_year(data.get('year'))
+    if error:
+        return jsonify({'error': error}), 400
+    if status != 'open':
+        return jsonify({'error': f'academic year {year} is {status}'}), 409
+    rows = []
+    for i, item in enumerate(data.get('payments') or []):
+        month_index, amount, error = parse_payment_fields(item)
+        if error:
+            return jsonify({'error': f'payments[{i}]: {error}'}), 400
+        try:
+            student_id = int(item.get('student_id'))
+        except (TypeError, ValueError):
+            return jsonify({'error': f'payments[{i}]: student_id must be an integer'}), 400
+        rows.append({'student_id': student_id, 'year': year, 'month_index': month_index, 'amount': amount})
+
+    class_name = data.get('class_name')
+    if class_name:
+        # Whole-class "mark month paid": amount defaults to each student's monthly fee.
+        try:
+            class_month = int(data.get('month_index'))
+            class_amount = int(data['amount']) if data.get('amount') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'month_index and amount must be integers'}), 400
+        if class_month < 0 or class_month > 11:
+            return jsonify({'error': 'month_index must be between 0 and 11'}), 400
+        if class_amount is not None and class_amount < 0:
+            return jsonify({'error': 'amount must be >= 0'}), 400
+    elif not rows:
+        return jsonify({'error': 'payments or class_name is required'}), 400
+
+    student_ids = {r['student_id'] for r in rows}
+    if student_ids:
+        known = {sid for (sid,) in db.session.query(Student.id).filter(Student.id.in_(student_ids))}
+        missing = sorted(student_ids - known)
+        if missing:
+            return jsonify({'error': 'unknown student_id', 'student_ids': missing}), 404
+
+    upsert_payments(rows)
+    updated = len(rows)
+    if class_name:
+        result = db.session.execute(db.text(
+            "INSERT INTO payment (student_id, year, month_index, amount, paid_on) "
+            "SELECT id, :year, :month_index, COALESCE(:amount, monthly_fee), :paid_on FROM student "
+            "WHERE class_name = :class_name "
+            "ON CONFLICT (student_id, year, month_index) DO UPDATE SET amount = excluded.amount, paid_on = excluded.paid_on"
+        ).bindparams(db.bindparam('paid_on', type_=db.DateTime)), {'year': year, 'month_index': class_month, 'amount': class_amount, 'paid_on': datetime.utcnow(), 'class_name': class_name})
+        updated += result.rowcount
+    db.session.commit()
+    return jsonify({'status': 'ok', 'updated': updated})
+
+IMPORT_CHUNK_SIZE = 500
+MAX_IMPORT_ERRORS = 1000
+
+def import_rows(validate, write_chunk):
+    """Validate an uploaded CSV/XLSX file row by row and write it in chunked transactions.
+
+    The file is the multipart field `file` or the raw request body. `write_chunk(rows)`
+    gets lists of (row_number, values) and returns [(row_number, error)] for rows it
+    rejected; each chunk is committed on its own, so a large file never holds the
+    write lock for long. With `?dry_run=1` nothing is written.
+    """
+    upload = request.files.get('file')
+    if upload:
+        stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
     else:
-        p.amount = amount
-        p.paid_on = datetime.utcnow()
+        stream, filename, content_type = request.stream, None, request.mimetype
+    dry_run = is_truthy(request.args.get('dry_run'))
+    report = {'dry_run': dry_run, 'rows': 0, 'imported': 0, 'rejected': 0, 'errors': []}
+
+    def reject(row_number, errors):
+        report['rejected'] += 1
+        if len(report['errors']) < MAX_IMPORT_ERRORS:
+            report['errors'].append({'row': row_number, 'errors': errors})
+
+    def flush(chunk):
+        rejected = dict(write_chunk(chunk, dry_run))
+        for row_number, error in rejected.items():
+            reject(row_number, [error])
+        report['imported'] += len(chunk) - len(rejected)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+
+    chunk = []
+    try:
+        for row_number, row in bulk_io.iter_rows(stream, filename, content_type):
+            report['rows'] += 1
+            values, errors = validate(row)
+            if errors:
+                reject(row_number, errors)
+                continue
+            chunk.append((row_number, values))
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    except bulk_io.ImportFormatError as e:
+        # Chunks before the bad spot are already committed; the report says how far it got.
+        db.session.rollback()
+        return jsonify(dict(report, error=str(e))), 400
+    report['errors'].sort(key=lambda e: e['row'])
+    report['errors_truncated'] = report['rejected'] > len(report['errors'])
+    return jsonify(report)
+
+def insert_student_chunk(chunk, dry_run):
+    if not dry_run:
+        db.session.execute(db.insert(Student), [values for _, values in chunk])
+    return []
+
+def upsert_payment_chunk(chunk, dry_run):
+    student_ids = {values['student_id'] for _, values in chunk}
+    known = {sid for (sid,) in db.session.query(Student.id).filter(Student.id.in_(student_ids))}
+    conn = raw_connection()
+    open_year = current_year()
+    statuses = {year: years.year_status(conn, year) for year in {values['year'] for _, values in chunk} if year}
+    rejected = []
+    for n, values in chunk:
+        if values['student_id'] not in known:
+            rejected.append((n, f"unknown student_id {values['student_id']}"))
+        elif values['year'] and values['year'] != open_year:
+            rejected.append((n, f"academic year {values['year']} is {statuses[values['year']] or 'unknown'}"))
+    if not dry_run:
+        rejected_rows = {n for n, _ in rejected}
+        upsert_payments([values for n, values in chunk if n not in rejected_rows])
+    return rejected
+
+@app.route('/api/import/students', methods=['POST'])
+def import_students():
+    return import_rows(bulk_io.validate_student, insert_student_chunk)
+
+@app.route('/api/import/payments', methods=['POST'])
+def import_payments():
+    return import_rows(bulk_io.validate_payment, upsert_payment_chunk)
+
+def csv_download(filename, header, stmt):
+    # yield_per streams rows from the cursor instead of fetching the whole result first.
+    rows = db.session.execute(stmt.execution_options(yield_per=IMPORT_CHUNK_SIZE))
+    response = app.response_class(stream_with_context(bulk_io.csv_chunks(header, rows)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route('/api/export/students', methods=['GET'])
+def export_students():
+    stmt = db.select(*[getattr(Student, f) for f in STUDENT_FIELDS]).order_by(Student.id)
+    if request.args.get('class'):
+        stmt = stmt.where(Student.class_name == request.args['class'])
+    return csv_download('students.csv', STUDENT_FIELDS, stmt)
+
+@app.route('/api/export/payments', methods=['GET'])
+def export_payments():
+    month_name = db.case({i: name for i, name in enumerate(MONTHS)}, value=Payment.month_index)
+    stmt = (
+        db.select(Payment.student_id, Student.class_name, Student.student_name, Payment.year, Payment.month_index,
+                  month_name, Payment.amount, Payment.paid_on)
+        .join(Student, Student.id == Payment.student_id)
+        .order_by(Payment.student_id, Payment.year, Payment.month_index)
+    )
+    if request.args.get('class'):
+        stmt = stmt.where(Student.class_name == request.args['class'])
+    if request.args.get('year'):
+        stmt = stmt.where(Payment.year == request.args.get('year', type=int))
+    header = ('student_id', 'class_name', 'student_name', 'year', 'month_index', 'month', 'amount', 'paid_on')
+    return csv_download('payments.csv', header, stmt)
+
+# Sends happen on the dispatcher's worker threads; requests only write to the outbox.
+# Workers start with the server (create_app) and drain rows left queued or leased by
+# an earlier run; the notify endpoints also start them under the development server.
+dispatcher = notifications.Dispatcher(
+    DB_PATH, notifications.provider_from_env(), workers=int(os.environ.get('NOTIFY_WORKERS', 4))
+)
+
+DEFAULT_REMINDER = (
+    "Dear parent, the fee for {student_name} (Class {class_name}) has Rs {due} outstanding. "
+    "Please clear the dues at your earliest convenience."
+)
+
+def queue_notifications(messages, batch=None):
+    # The outbox is written through the dispatcher's own connection. A POST's session
+    # transaction holds the write lock (see begin_transaction), so end it first.
     db.session.commit()
-    return jsonify({'status': 'ok', 'payment_id': p.id})
+    dispatcher.start()
+    return dispatcher.enqueue(messages, batch)
 
 @app.route('/api/notify/<int:student_id>', methods=['POST'])
 def notify_parent(student_id):
-    s = Student.query.get_or_404(student_id)
-    data = request.json or {}
+    s = db.get_or_404(Student, student_id)
+    data = request.get_json(silent=True) or {}
     message = data.get('message') or f"Fee update for {s.student_name} (Class {s.class_name})."
-    success = bool(s.parent_phone)
-    return jsonify({'status': 'sent' if success else 'no_phone', 'to': s.parent_phone, 'message': message})
+    if not s.parent_phone:
+        return jsonify({'status': 'no_phone', 'to': s.parent_phone, 'message': message})
+    # A client retrying the same request sends the same key and is not queued twice.
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key') or f'manual:{uuid.uuid4().hex}'
+    queued, _ = queue_notifications([
+        {'idempotency_key': key, 'student_id': s.id, 'to': s.parent_phone, 'message': message}
+    ])
+    return jsonify({'status': 'queued' if queued else 'duplicate', 'to': s.parent_phone, 'message': message}), 202
+
+@app.route('/api/notify/class/<path:class_name>', methods=['POST'])
+def notify_class(class_name):
+    """Queue a dues reminder for every student in the class who owes money."""
+    data = request.get_json(silent=True) or {}
+    template = data.get('message') or DEFAULT_REMINDER
+    # Re-sending the same campaign only queues students not reminded yet.
+    campaign = data.get('campaign') or f'dues-{date.today():%Y-%m}'
+    try:
+        template.format_map({'student_name': '', 'father_name': '', 'class_name': '', 'due': 0})
+    except (KeyError, ValueError, IndexError, AttributeError) as e:
+        return jsonify({'error': f'invalid message template: {e}'}), 400
+    year = current_year()
+    due = dues_to_date(year, 'open').label('due')
+    rows = db.session.execute(
+        db.select(Student.id, Student.student_name, Student.father_name, Student.parent_phone, due)
+        .join(StudentBalance, db.and_(StudentBalance.student_id == Student.id, StudentBalance.year == year))
+        .where(Student.class_name == class_name, due > 0)
+    )
+    messages, no_phone = [], 0
+    for row in rows:
+        if not row.parent_phone:
+            no_phone += 1
+            continue
+        messages.append({
+            'idempotency_key': f'{campaign}:{row.id}',
+            'student_id': row.id,
+            'to': row.parent_phone,
+            'message': template.format_map({
+                'student_name': row.student_name, 'father_name': row.father_name or '',
+                'class_name': class_name, 'due': row.due,
+            }),
+        })
+    batch = f'{campaign}:{class_name}'
+    queued, duplicates = queue_notifications(messages, batch)
+    return jsonify({
+        'batch': batch,
+        'queued': queued,
+        'already_queued': duplicates,
+        'skipped_no_phone': no_phone,
+    }), 202
+
+@app.route('/api/years', methods=['GET'])
+def list_years():
+    return jsonify(years.list_years(raw_connection(), ARCHIVE_PATH))
+
+@app.route('/api/years/close', methods=['POST'])
+def close_year():
+    """Close the open academic year and open the next, carrying every student's dues forward.
+
+    The body must name the year being closed, so a repeated request cannot close the next one too.
+    """
+    data = request.get_json(silent=True) or {}
+    year = current_year()
+    if data.get('year') != year:
+        return jsonify({'error': f'send {{"year": {year}}} to close the open year', 'open_year': year}), 409
+    closed, opened = years.close_year(raw_connection())
+    db.session.commit()
+    return jsonify({'status': 'ok', 'closed_year': closed, 'open_year': opened})
+
+@app.route('/api/years/<int:year>/archive', methods=['POST'])
+def archive_year(year):
+    """Move a closed year's payments and balances out of the live database into ARCHIVE_PATH."""
+    db.session.close()  # ATTACH needs a connection outside any transaction
+    raw = db.engine.raw_connection()
+    try:
+        moved = years.archive_year(metrics.TimedConnection(raw.driver_connection), year, ARCHIVE_PATH)
+    except years.YearError as e:
+        return jsonify({'error': str(e)}), 409
+    finally:
+        raw.close()
+    return jsonify({'status': 'ok', 'year': year, 'archived_payments': moved, 'archive': os.path.basename(ARCHIVE_PATH)})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return app.response_class(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route('/api/notify/status', methods=['GET'])
+def notify_status():
+    dispatcher.start()
+    return jsonify(dispatcher.status(request.args.get('batch')))
 
 @app.route('/templates/<path:path>')
 def send_template(path):
-    return send_from_directory('templates', path)
+    # Only the plain pages; the rest of templates/ is Jinja source rendered by the views.
+    page = asset_index.pages.get(path)
+    if page is None:
+        abort(404)
+    return asset_response(page, 'no-cache')
 
 @app.route('/static/<path:path>')
 def send_static(path):
-    return send_from_directory('static', path)
+    asset, fingerprinted = asset_index.lookup(path)
+    if asset is None:
+        abort(404)
+    # A fingerprinted name never changes content; a plain name must be revalidated.
+    return asset_response(asset, IMMUTABLE if fingerprinted else 'no-cache')
+
+def shutdown():
+    """Stop the notification workers and fold the WAL back into the database file."""
+    dispatcher.stop(timeout=30)
+    with app.app_context():
+        db.session.remove()
+        raw = db.engine.raw_connection()
+        try:
+            raw.driver_connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            raw.close()
+        db.engine.dispose()
+
+def create_app():
+    """The app for a WSGI server, e.g. `gunicorn -w 4 --threads 8 'app:create_app()'`.
+
+    Starts loading the analytics for the open year and the notification workers, which
+    send what an earlier run left queued, and cleans up when the process exits.
+    """
+    with app.app_context():
+        ledgers.warm(current_year())
+    dispatcher.start()
+    atexit.register(shutdown)
+    return app
+
+def make_server(host, port, threads):
+    """A waitress server when it is installed, otherwise Werkzeug's threaded server."""
+    try:
+        import waitress
+    except ImportError:
+        from werkzeug.serving import make_server as werkzeug_server
+        server = werkzeug_server(host, port, app, threaded=True)
+        server.daemon_threads = False  # server_close() then waits for requests in flight
+        return server, server.serve_forever, server.server_close
+    server = waitress.create_server(app, host=host, port=port, threads=threads)
+
+    def close():
+        server.close()
+        server.task_dispatcher.shutdown(cancel_pending=False, timeout=30)
+    return server, server.run, close
+
+def main(argv=None):
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(description='Serve the school fee app.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--threads', type=int, default=8, help='request threads (waitress only)')
+    parser.add_argument('--debug', action='store_true', help='run the Flask development server with the debugger')
+    args = parser.parse_args(argv)
+
+    if args.debug:
+        app.run(host=args.host, port=args.port, debug=True)
+        return
+    create_app()
+    server, serve_forever, close = make_server(args.host, args.port, args.threads)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f'School fee app on {DB_PATH} listening on {args.host}:{args.port}')
+    try:
+        serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Stop accepting connections and let requests in flight finish; atexit runs shutdown().
+        close()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    main()
 
 
@@ -0,0 +1,130 @@
+"""Fingerprinted, precompressed static assets served from memory.
+
+`AssetIndex.build()` reads every file under `static/` and names it after its
+content (app.js -> app.1a2b3c4d5e.js). Each file is kept in memory as is,
+gzip-compressed, and brotli-compressed when the `brotli` package is installed
+(optional; `pip install brotli`). A fingerprinted URL always names the same
+bytes, so browsers may keep it for a year without asking again.
+
+The HTML pages served as plain files (index.html, print.html) are kept the
+same way, with their /static/ references rewritten to the fingerprinted
+names. Pages keep their URLs and are revalidated on every load, so a new
+build reaches the browser on the next page load while the assets it still
+holds are served from its cache.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HASH_LENGTH = 10
+MIN_COMPRESS_SIZE = 256  # smaller files gain nothing worth the extra header
+STATIC_REF = re.compile(r'''(["'])/static/([^"'?#]+)\1''')
+
+
+class Asset:
+    def __init__(self, name, body, mimetype):
+        self.name = name
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(body).hexdigest()
+        root, ext = os.path.splitext(name)
+        self.hashed_name = f'{root}.{self.digest[:HASH_LENGTH]}{ext}'
+        self.variants = {'identity': body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            compressed = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(body, quality=11)
+            self.variants.update((enc, data) for enc, data in compressed.items() if len(data) < len(body))
+
+    def negotiate(self, accept_encodings):
+        """(encoding, body) of the smallest variant allowed by a werkzeug `Accept-Encoding` header."""
+        best = 'identity'
+        for encoding, body in self.variants.items():
+            if (encoding != 'identity' and accept_encodings.quality(encoding)
+                    and len(body) < len(self.variants[best])):
+                best = encoding
+        return best, self.variants[best]
+
+    def etag(self, encoding):
+        tag = self.digest[:2 * HASH_LENGTH]
+        return tag if encoding == 'identity' else f'{tag}-{encoding}'
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _mimetype(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+class AssetIndex:
+    """In-memory index of the files under `static_dir` and of the HTML `pages` in `pages_dir`."""
+
+    def __init__(self, static_dir, pages_dir, pages, url_prefix='/static/'):
+        self.static_dir = static_dir
+        self.pages_dir = pages_dir
+        self.page_names = tuple(pages)
+        self.url_prefix = url_prefix
+        self.assets = {}  # plain name -> Asset
+        self.by_hashed_name = {}
+        self.pages = {}  # page file name -> Asset
+        self._mtimes = None
+
+    def _sources(self):
+        for dirpath, _, files in os.walk(self.static_dir):
+            for f in files:
+                yield os.path.join(dirpath, f)
+        for page in self.page_names:
+            yield os.path.join(self.pages_dir, page)
+
+    def _snapshot(self):
+        return {path: os.stat(path).st_mtime_ns for path in self._sources()}
+
+    def build(self):
+        mtimes = self._snapshot()
+        assets = {}
+        for path in mtimes:
+            if not path.startswith(self.static_dir + os.sep):
+                continue
+            name = os.path.relpath(path, self.static_dir).replace(os.sep, '/')
+            assets[name] = Asset(name, _read(path), _mimetype(name))
+        by_hashed_name = {asset.hashed_name: asset for asset in assets.values()}
+        self.assets, self.by_hashed_name = assets, by_hashed_name
+        self.pages = {
+            page: Asset(page, self.rewrite(_read(os.path.join(self.pages_dir, page)).decode('utf-8')).encode('utf-8'),
+                        'text/html')
+            for page in self.page_names
+        }
+        self._mtimes = mtimes
+        return self
+
+    def refresh(self):
+        """Rebuild when a file was added, removed or changed since the last build (for development)."""
+        if self._snapshot() != self._mtimes:
+            self.build()
+
+    def url(self, name):
+        """The fingerprinted URL of static file `name`, or its plain URL when there is no such file."""
+        asset = self.assets.get(name)
+        return self.url_prefix + (asset.hashed_name if asset else name)
+
+    def rewrite(self, html):
+        return STATIC_REF.sub(lambda m: f'{m.group(1)}{self.url(m.group(2))}{m.group(1)}', html)
+
+    def lookup(self, name):
+        """(asset, fingerprinted) for a name under the URL prefix; (None, False) when unknown.
+
+        Plain names still resolve, for pages and bookmarks from before a build.
+        """
+        asset = self.by_hashed_name.get(name)
+        if asset is not None:
+            return asset, True
+        return self.assets.get(name), False
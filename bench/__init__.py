@@ -0,0 +1,5 @@
+"""Benchmarks for the Flask API and the Kivy data layer.
+
+Run `python -m bench --help`. Data is generated into a temporary SQLite file;
+the repository's school_fee.db is never touched.
+"""
@@ -0,0 +1,86 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bench import datagen
+from bench.runner import QueryCounter, compare, print_report, run_benchmark, save_baseline
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description=(
+        'Generate a synthetic school into a temporary database and time the Flask API '
+        'and the Kivy data layer against it.'))
+    parser.add_argument('--students', type=int, default=50000)
+    parser.add_argument('--payments', type=int, default=600000)
+    parser.add_argument('--classes', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=30, help='timed calls per benchmark')
+    parser.add_argument('--suite', choices=['all', 'api', 'storage'], default='all')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--db', help='reuse (a copy of) a database generated earlier instead of generating one')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, metavar='PATH',
+                        help=f'write the results as the new baseline (default {DEFAULT_BASELINE})')
+    parser.add_argument('--check', nargs='?', const=DEFAULT_BASELINE, metavar='PATH',
+                        help='compare against a baseline and exit with status 1 on a regression')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='allowed p95 slowdown factor before --check fails (default %(default)s)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='ignore p95 increases smaller than this (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='school-fee-bench-')
+    db_path = os.path.join(workdir, 'school_fee.db')
+    try:
+        if args.db:
+            shutil.copyfile(args.db, db_path)
+            dataset = {'source': os.path.basename(args.db)}
+        else:
+            start = time.perf_counter()
+            students, payments = datagen.generate(
+                db_path, args.students, args.payments, args.classes, args.seed)
+            print(f'generated {students} students and {payments} payments '
+                  f'in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+            dataset = {'students': students, 'payments': payments, 'classes': args.classes, 'seed': args.seed}
+
+        # app.py reads its database path at import time.
+        os.environ['SCHOOL_FEE_DB'] = db_path
+        from bench import suites
+
+        results = {}
+        groups = []
+        if args.suite in ('all', 'api'):
+            counter = QueryCounter()
+            groups.append((suites.api_benchmarks(db_path, counter), counter))
+        if args.suite in ('all', 'storage'):
+            counter = QueryCounter()
+            groups.append((suites.storage_benchmarks(db_path, counter), counter))
+        for benchmarks, counter in groups:
+            for bench in benchmarks:
+                if args.filter in bench.name:
+                    results[bench.name] = run_benchmark(bench, counter, args.iterations)
+                    print(f'  {bench.name}: p95 {results[bench.name]["p95_ms"]:.3f} ms', file=sys.stderr)
+
+        print_report(results)
+        if args.save_baseline:
+            save_baseline(args.save_baseline, results, dataset)
+            print(f'baseline saved to {args.save_baseline}')
+        if args.check:
+            regressions = compare(args.check, results, dataset, args.threshold, args.min_delta_ms)
+            if regressions:
+                print('regressions:')
+                for line in regressions:
+                    print(f'  {line}')
+                return 1
+            print('no regressions')
+        return 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Generate a realistic school database for benchmarking."""
+import random
+import sqlite3
+
+import migrations
+
+FIRST_NAMES = [
+    'Ahmed', 'Ali', 'Ayesha', 'Bilal', 'Fatima', 'Hamza', 'Hassan', 'Hira', 'Imran', 'Iqra',
+    'Kashif', 'Maryam', 'Noor', 'Omar', 'Rabia', 'Saad', 'Sana', 'Usman', 'Zainab', 'Zara',
+]
+LAST_NAMES = [
+    'Khan', 'Malik', 'Qureshi', 'Butt', 'Chaudhry', 'Sheikh', 'Raza', 'Siddiqui', 'Mirza', 'Javed',
+]
+SECTIONS = ['A', 'B', 'C', 'D']
+
+
+def class_names(count):
+    grades = ['Nursery', 'Prep'] + [f'Class {n}' for n in range(1, 11)]
+    names = [f'{grade} {section}' for section in SECTIONS for grade in grades]
+    while len(names) < count:
+        names.append(f'Class {len(names) + 1}')
+    return names[:count]
+
+
+def generate(path, students=50000, payments=600000, classes=40, seed=1, batch=5000):
+    """Create a migrated database at `path` and fill it with students and payments.
+
+    Each student pays the first N months of the year, N chosen so the total
+    comes to about `payments` (at most 12 per student). Rows go through the
+    normal triggers, so balances and change tracking are populated as in
+    real use. Returns (students, payments) actually written.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")  # throwaway data; the benchmark measures reads and writes afterwards
+    migrations.migrate(conn)
+    names = class_names(classes)
+    fees = {name: 1000 + 250 * (i % 12) for i, name in enumerate(names)}
+
+    student_rows = []
+    for i in range(students):
+        class_name = names[i % len(names)]
+        student_rows.append((
+            class_name,
+            f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            f'03{rng.randrange(10**9):09d}' if rng.random() > 0.05 else '',
+            fees[class_name],
+        ))
+    with conn:
+        for start in range(0, len(student_rows), batch):
+            conn.executemany(
+                "INSERT INTO student (class_name, student_name, father_name, parent_phone, monthly_fee) "
+                "VALUES (?, ?, ?, ?, ?)", student_rows[start:start + batch]
+            )
+
+    per_student, extra = divmod(min(payments, students * 12), students) if students else (0, 0)
+    extra_ids = set(rng.sample(range(students), extra)) if extra else set()
+    written = 0
+    rows = []
+    with conn:
+        for index, (student_id, fee) in enumerate(conn.execute("SELECT id, monthly_fee FROM student ORDER BY id").fetchall()):
+            months = per_student + (1 if index in extra_ids else 0)
+            for month in range(months):
+                # Most parents pay in full; some pay part of the fee.
+                amount = fee if rng.random() > 0.1 else fee // 2
+                rows.append((student_id, month, amount, f'2025-{month + 1:02d}-{rng.randint(1, 28):02d} 10:00:00'))
+            if len(rows) >= batch:
+                conn.executemany("INSERT INTO payment (student_id, month_index, amount, paid_on) VALUES (?, ?, ?, ?)", rows)
+                written += len(rows)
+                rows = []
+        if rows:
+            conn.executemany("INSERT INTO payment (student_id, month_index, amount, paid_on) VALUES (?, ?, ?, ?)", rows)
+            written += len(rows)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("ANALYZE")
+    conn.close()
+    return students, written
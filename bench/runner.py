@@ -0,0 +1,110 @@
+"""Timing, reporting and baseline comparison."""
+import json
+import platform
+import sqlite3
+import time
+import tracemalloc
+
+
+class Benchmark:
+    """One timed operation. `setup()` runs untimed before every call and its result is passed to `call`."""
+
+    def __init__(self, name, call, setup=None):
+        self.name = name
+        self.call = call
+        self.setup = setup
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def run_benchmark(bench, counter, iterations=30, warmup=3):
+    """Time `bench` and return its summary.
+
+    That is p50/p95/p99 in milliseconds, SQL statements per call (as counted by
+    `counter`, trigger bodies included) and the peak Python heap of one call.
+    """
+    timings, queries = [], []
+    for i in range(warmup + iterations):
+        arg = bench.setup() if bench.setup else None
+        counter.count = 0
+        start = time.perf_counter()
+        bench.call(arg)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            queries.append(counter.count)
+    # Memory is traced in a separate call: tracemalloc itself would distort the timings.
+    arg = bench.setup() if bench.setup else None
+    tracemalloc.start()
+    try:
+        bench.call(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'calls': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': round(sum(queries) / len(queries), 2),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def print_report(results):
+    width = max(len(name) for name in results) if results else 10
+    print(f"{'benchmark':<{width}}  {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'peak KiB':>9}")
+    for name, r in results.items():
+        print(f"{name:<{width}}  {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['p99_ms']:>9.3f} "
+              f"{r['queries']:>8g} {r['peak_kib']:>9.1f}")
+
+
+def environment(dataset):
+    return {
+        'dataset': dataset,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+    }
+
+
+def save_baseline(path, results, dataset):
+    with open(path, 'w') as f:
+        json.dump({'environment': environment(dataset), 'results': results}, f, indent=2, sort_keys=True)
+
+
+def compare(path, results, dataset, threshold=1.5, min_delta_ms=1.0):
+    """Compare `results` with the baseline at `path`; returns a list of regression messages.
+
+    A benchmark regresses when its p95 exceeds the baseline's by more than
+    `threshold` times and by at least `min_delta_ms` (so sub-millisecond
+    jitter is ignored), or when it issues more queries per call than before.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline['environment']['dataset'] != dataset:
+        print(f"warning: baseline was recorded with dataset {baseline['environment']['dataset']}, "
+              f"this run used {dataset}")
+    regressions = []
+    for name, current in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        if current['p95_ms'] > before['p95_ms'] * threshold and current['p95_ms'] - before['p95_ms'] >= min_delta_ms:
+            regressions.append(f"{name}: p95 {before['p95_ms']:.3f} ms -> {current['p95_ms']:.3f} ms")
+        if current['queries'] > before['queries']:
+            regressions.append(f"{name}: queries per call {before['queries']:g} -> {current['queries']:g}")
+    return regressions
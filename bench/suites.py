@@ -0,0 +1,132 @@
+"""Benchmark definitions for the Flask API (via the test client) and the Kivy data layer."""
+import itertools
+import sqlite3
+
+from sqlalchemy import event
+
+from bench.runner import Benchmark
+
+_seq = itertools.count()
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f'{response.request.method} {response.request.path} -> {response.status_code}: '
+                           f'{response.get_data(as_text=True)[:200]}')
+    response.get_data()  # drain streamed bodies so their queries are counted
+    return response
+
+
+def _trace(conn, counter):
+    """Count every SQL statement SQLite runs on `conn`, including those inside triggers."""
+    conn.set_trace_callback(lambda statement: None if statement.startswith('--') else counter())
+
+
+def _sample(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        class_name = conn.execute(
+            "SELECT class_name FROM student GROUP BY class_name ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        student_id = conn.execute(
+            "SELECT student_id FROM payment GROUP BY student_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+    finally:
+        conn.close()
+    return class_name, student_id
+
+
+def _make_class(db_path, size=40):
+    """Untimed setup for destructive benchmarks: a throwaway class with a year of payments."""
+    class_name = f'bench-{next(_seq)}'
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys=ON")
+    with conn:
+        conn.executemany(
+            "INSERT INTO student (class_name, student_name, father_name, parent_phone, monthly_fee) "
+            "VALUES (?, ?, 'Father', '03000000000', 1000)", [(class_name, f'Student {i}') for i in range(size)]
+        )
+        conn.execute(
+            "INSERT INTO payment (student_id, month_index, amount, paid_on) "
+            "SELECT s.id, m.value, 1000, '2025-01-01 10:00:00' FROM student s, "
+            "json_each('[0,1,2,3,4,5,6,7,8,9,10,11]') m WHERE s.class_name = ?", (class_name,)
+        )
+    conn.close()
+    return class_name
+
+
+def api_benchmarks(db_path, counter):
+    """Benchmarks for app.py. SCHOOL_FEE_DB must already point at `db_path`."""
+    import app as app_module
+
+    with app_module.app.app_context():
+        event.listen(app_module.db.engine, 'connect', lambda conn, record: _trace(conn, counter))
+        app_module.db.engine.dispose()  # reconnect so every pooled connection is traced
+    client = app_module.app.test_client()
+    class_name, student_id = _sample(db_path)
+    cold = app_module.response_cache.clear  # reads are timed without the response cache unless marked
+
+    def get(url):
+        return lambda _: _check(client.get(url))
+
+    def setup_student():
+        return client.post('/api/students', json={
+            'class_name': 'bench-new', 'student_name': 'New', 'father_name': 'Father'}).get_json()['id']
+
+    amounts = itertools.count()
+    return [
+        Benchmark('api.list_classes', get('/api/classes'), cold),
+        Benchmark('api.list_classes[cached]', get('/api/classes')),
+        Benchmark('api.list_students[class]', get(f'/api/students?class={class_name}'), cold),
+        Benchmark('api.list_students[class,cached]', get(f'/api/students?class={class_name}')),
+        Benchmark('api.list_students[page=500]', get('/api/students?limit=500&sort=student_name'), cold),
+        Benchmark('api.list_students[name search]', get('/api/students?name=Ali&limit=100'), cold),
+        Benchmark('api.list_students[ndjson,all]', get('/api/students?format=ndjson')),
+        Benchmark('api.search[name]', get('/api/search?q=Ali')),
+        Benchmark('api.search[phone]', get('/api/search?q=0300%2012')),
+        Benchmark('api.get_student[payments]', get(f'/api/students/{student_id}?include=payments'), cold),
+        Benchmark('api.get_payments', get(f'/api/students/{student_id}/payments'), cold),
+        Benchmark('api.class_dues', get(f'/api/classes/{class_name}/dues'), cold),
+        Benchmark('api.dues_summary', get('/api/dues/summary'), cold),
+        Benchmark('api.analytics', get('/api/analytics?month=11'), cold),  # ledger arrays stay loaded
+        Benchmark('api.print_class', get(f'/print/class/{class_name}?month=5')),
+        Benchmark('api.export_students', get('/api/export/students')),
+        Benchmark('api.set_payment', lambda _: _check(client.post(
+            f'/api/students/{student_id}/payments', json={'month_index': 3, 'amount': 1000 + next(amounts) % 7}))),
+        Benchmark('api.bulk_payments[class]', lambda _: _check(client.post(
+            '/api/payments/bulk', json={'class_name': class_name, 'month_index': 11}))),
+        Benchmark('api.create_student', lambda _: _check(client.post('/api/students', json={
+            'class_name': 'bench-new', 'student_name': 'New', 'father_name': 'Father', 'monthly_fee': 1000}))),
+        Benchmark('api.update_student', lambda _: _check(client.put(
+            f'/api/students/{student_id}', json={'parent_phone': f'0300{next(amounts):07d}'}))),
+        Benchmark('api.delete_student', lambda sid: _check(client.delete(f'/api/students/{sid}')), setup_student),
+        Benchmark('api.delete_class', lambda name: _check(client.delete(f'/api/classes/{name}')),
+                  lambda: _make_class(db_path)),
+    ]
+
+
+def storage_benchmarks(db_path, counter):
+    """Benchmarks for the storage functions behind main.py."""
+    import storage
+
+    storage.pool.set_path(db_path)
+    _trace(storage.pool.connection(), counter)
+    class_name, student_id = _sample(db_path)
+    amounts = itertools.count()
+
+    def new_student():
+        return storage.add_student('bench-new', 'New', 'Father', '03000000000', 1000)
+
+    return [
+        Benchmark('storage.get_classes', lambda _: storage.get_classes()),
+        Benchmark('storage.get_students[class]', lambda _: storage.get_students(class_name)),
+        Benchmark('storage.get_students[all]', lambda _: storage.get_students()),
+        Benchmark('storage.get_student', lambda _: storage.get_student(student_id)),
+        Benchmark('storage.search[name]', lambda _: storage.search('Ali')),
+        Benchmark('storage.get_payments', lambda _: storage.get_payments(student_id)),
+        Benchmark('storage.set_payments[12 months]', lambda _: storage.set_payments(
+            student_id, {m: 1000 + next(amounts) % 7 for m in range(12)})),
+        Benchmark('storage.add_student', lambda _: new_student()),
+        Benchmark('storage.update_student', lambda _: storage.update_student(
+            student_id, class_name, 'Name', 'Father', f'0300{next(amounts):07d}', 1000)),
+        Benchmark('storage.delete_student', lambda sid: storage.delete_student(sid), new_student),
+    ]
+
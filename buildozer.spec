@@ -23,6 +23,7 @@ source.include_exts = py,png,jpg,kv,atlas
 
 # (list) List of directory to exclude (let empty to not exclude anything)
 #source.exclude_dirs = tests, bin, venv
+source.exclude_dirs = bench, snapshots
 
 # (list) List of exclusions using pattern matching
 # Do not prefix with './'
@@ -0,0 +1,195 @@
+"""Row readers, validation and CSV writing for bulk student/payment import and export.
+
+Uploads are read as streams: CSV through `csv.reader` over the request body,
+XLSX through openpyxl's read-only mode (optional; `pip install openpyxl`),
+so a file with thousands of rows is never held in memory at once. An XLSX
+file is a zip archive that must be read out of order, so a body that cannot
+seek (a raw request stream) is spooled to a temporary file first.
+"""
+import calendar
+import csv
+import io
+import shutil
+import tempfile
+
+MONTH_NAMES = [name.lower() for name in calendar.month_name[1:]]
+SPOOL_MAX_MEMORY = 4 * 1024 * 1024  # larger uploads spill to disk while spooled
+
+# (column, max length); lengths match the model columns in app.py.
+STUDENT_TEXT_FIELDS = (('class_name', 50), ('student_name', 100), ('father_name', 100), ('parent_phone', 20))
+STUDENT_REQUIRED = ('class_name', 'student_name', 'father_name')
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def _header_key(value):
+    return str(value or '').strip().lower().replace(' ', '_')
+
+
+def is_xlsx(filename=None, content_type=None):
+    return (filename or '').lower().endswith('.xlsx') or content_type == \
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def iter_rows(stream, filename=None, content_type=None):
+    """Yield (row_number, {column: value}) for every non-blank data row of an upload.
+
+    Column names are matched case-insensitively, with spaces read as underscores.
+    Row numbers count the header as row 1, as a spreadsheet shows them.
+    """
+    if is_xlsx(filename, content_type):
+        return _iter_xlsx(stream)
+    return _iter_csv(stream)
+
+
+def _iter_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    try:
+        header = next(reader, None)
+        if header is None:
+            raise ImportFormatError('file is empty')
+        keys = [_header_key(h) for h in header]
+        for row in reader:
+            if any(cell.strip() for cell in row):
+                yield reader.line_num, dict(zip(keys, row))
+    except UnicodeDecodeError:
+        raise ImportFormatError('CSV files must be UTF-8 encoded')
+    except csv.Error as e:
+        raise ImportFormatError(f'line {reader.line_num}: {e}')
+    finally:
+        text.detach()
+
+
+def _seekable(stream):
+    """`stream` itself when it can seek, otherwise a spooled copy of it (the caller closes it)."""
+    try:
+        if stream.seekable():
+            return stream
+    except AttributeError:
+        pass
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    shutil.copyfileobj(stream, spool, 64 * 1024)
+    spool.seek(0)
+    return spool
+
+
+def _iter_xlsx(stream):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportFormatError('XLSX import needs openpyxl (pip install openpyxl); upload a CSV file instead')
+    source = _seekable(stream)
+    try:
+        try:
+            workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        except Exception as e:
+            raise ImportFormatError(f'could not read XLSX file: {e}')
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                raise ImportFormatError('file is empty')
+            keys = [_header_key(h) for h in header]
+            for number, row in enumerate(rows, start=2):
+                if any(cell not in (None, '') for cell in row):
+                    yield number, dict(zip(keys, row))
+        finally:
+            workbook.close()
+    finally:
+        if source is not stream:
+            source.close()
+
+
+def _text(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # e.g. a phone number typed into a spreadsheet
+    return '' if value is None else str(value).strip()
+
+
+def _integer(value):
+    """Parse an integer cell; spreadsheets hand back whole numbers as floats like 1500.0."""
+    if isinstance(value, int):
+        return value
+    text = _text(value)
+    if text.endswith('.0'):
+        text = text[:-2]
+    return int(text)
+
+
+def validate_student(row):
+    """Return ({column: value}, []) for a valid student row, or (None, [errors])."""
+    values, errors = {}, []
+    for field, max_length in STUDENT_TEXT_FIELDS:
+        value = _text(row.get(field))
+        if not value and field in STUDENT_REQUIRED:
+            errors.append(f'{field} is required')
+        elif len(value) > max_length:
+            errors.append(f'{field} is longer than {max_length} characters')
+        values[field] = value
+    try:
+        values['monthly_fee'] = _integer(row.get('monthly_fee')) if _text(row.get('monthly_fee')) else 0
+        if values['monthly_fee'] < 0:
+            errors.append('monthly_fee must be >= 0')
+    except ValueError:
+        errors.append('monthly_fee must be an integer')
+    return (None, errors) if errors else (values, [])
+
+
+def parse_month(value):
+    """Accept a month index 0-11 or an English month name (at least three letters)."""
+    text = _text(value).lower()
+    if len(text) >= 3:
+        for month_index, name in enumerate(MONTH_NAMES):
+            if name.startswith(text):
+                return month_index
+    month_index = _integer(value)
+    if month_index < 0 or month_index > 11:
+        raise ValueError('month out of range')
+    return month_index
+
+
+def validate_payment(row):
+    """Return ({student_id, year, month_index, amount}, []) for a valid payment row, or (None, [errors]).
+
+    `year` is None when the row has no year column; such rows go into the open academic year.
+    """
+    values, errors = {}, []
+    try:
+        values['student_id'] = _integer(row.get('student_id'))
+    except ValueError:
+        errors.append('student_id must be an integer')
+    values['year'] = None
+    if _text(row.get('year')):
+        try:
+            values['year'] = _integer(row.get('year'))
+        except ValueError:
+            errors.append('year must be an integer')
+    month = row.get('month_index', row.get('month'))
+    try:
+        values['month_index'] = parse_month(month)
+    except ValueError:
+        errors.append('month_index must be 0-11 or a month name')
+    try:
+        values['amount'] = _integer(row.get('amount'))
+        if values['amount'] < 0:
+            errors.append('amount must be >= 0')
+    except ValueError:
+        errors.append('amount must be an integer')
+    return (None, errors) if errors else (values, [])
+
+
+def csv_chunks(header, rows, rows_per_chunk=500):
+    """Encode `rows` (any iterable, e.g. a database cursor) as CSV text, a chunk at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -1,158 +1,38 @@
+import startup  # first: starts the cold-start clock
 from kivymd.app import MDApp
 from kivy.lang import Builder
-from kivy.uix.screenmanager import ScreenManager, Screen
+from kivy.uix.screenmanager import Screen
 from kivymd.uix.list import OneLineListItem, ThreeLineListItem
-from kivymd.uix.datatables import MDDataTable
-from kivymd.uix.boxlayout import MDBoxLayout
-from kivymd.uix.button import MDRaisedButton, MDIconButton
-from kivymd.uix.textfield import MDTextField
-from kivymd.uix.label import MDLabel
-from kivymd.uix.dialog import MDDialog
-from kivymd.uix.button import MDFlatButton
-from kivy.metrics import dp
-import sqlite3
-import os
+from kivy.clock import Clock
+from kivy.properties import BooleanProperty, NumericProperty, StringProperty
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import urllib.request
-
-# Database setup
-DB_PATH = 'school_fee.db'
-
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS student (
-        id INTEGER PRIMARY KEY,
-        class_name TEXT NOT NULL,
-        student_name TEXT NOT NULL,
-        father_name TEXT,
-        parent_phone TEXT,
-        monthly_fee INTEGER NOT NULL
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS payment (
-        id INTEGER PRIMARY KEY,
-        student_id INTEGER NOT NULL,
-        month_index INTEGER NOT NULL,
-        amount INTEGER NOT NULL,
-        paid_on TEXT,
-        FOREIGN KEY (student_id) REFERENCES student (id)
-    )''')
-    conn.commit()
-    conn.close()
-
-# Models
-class Student:
-    def __init__(self, id, class_name, student_name, father_name, parent_phone, monthly_fee):
-        self.id = id
-        self.class_name = class_name
-        self.student_name = student_name
-        self.father_name = father_name
-        self.parent_phone = parent_phone
-        self.monthly_fee = monthly_fee
-
-class Payment:
-    def __init__(self, id, student_id, month_index, amount, paid_on):
-        self.id = id
-        self.student_id = student_id
-        self.month_index = month_index
-        self.amount = amount
-        self.paid_on = paid_on
-
-# DB functions
-def get_students(class_filter=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if class_filter:
-        c.execute("SELECT * FROM student WHERE class_name = ?", (class_filter,))
-    else:
-        c.execute("SELECT * FROM student")
-    rows = c.fetchall()
-    conn.close()
-    return [Student(*row) for row in rows]
-
-def add_student(class_name, student_name, father_name, parent_phone, monthly_fee):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO student (class_name, student_name, father_name, parent_phone, monthly_fee) VALUES (?, ?, ?, ?, ?)",
-              (class_name, student_name, father_name, parent_phone, monthly_fee))
-    conn.commit()
-    id = c.lastrowid
-    conn.close()
-    return id
-
-def update_student(id, class_name, student_name, father_name, parent_phone, monthly_fee):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE student SET class_name=?, student_name=?, father_name=?, parent_phone=?, monthly_fee=? WHERE id=?",
-              (class_name, student_name, father_name, parent_phone, monthly_fee, id))
-    conn.commit()
-    conn.close()
-
-def delete_student(id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM payment WHERE student_id=?", (id,))
-    c.execute("DELETE FROM student WHERE id=?", (id,))
-    conn.commit()
-    conn.close()
-
-def get_payments(student_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM payment WHERE student_id=?", (student_id,))
-    rows = c.fetchall()
-    conn.close()
-    payments = {}
-    for row in rows:
-        p = Payment(*row)
-        payments[p.month_index] = p
-    return payments
-
-def set_payment(student_id, month_index, amount):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id FROM payment WHERE student_id=? AND month_index=?", (student_id, month_index))
-    row = c.fetchone()
-    if row:
-        c.execute("UPDATE payment SET amount=?, paid_on=datetime('now') WHERE id=?", (amount, row[0]))
-    else:
-        c.execute("INSERT INTO payment (student_id, month_index, amount, paid_on) VALUES (?, ?, ?, datetime('now'))",
-                  (student_id, month_index, amount))
-    conn.commit()
-    conn.close()
-
-def get_classes():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT class_name FROM student ORDER BY class_name")
-    rows = c.fetchall()
-    conn.close()
-    return [row[0] for row in rows]
-
-class SyncHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/db':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/octet-stream')
-            self.end_headers()
-            with open(DB_PATH, 'rb') as f:
-                self.wfile.write(f.read())
-
-    def do_POST(self):
-        if self.path == '/db':
-            content_length = int(self.headers['Content-Length'])
-            data = self.rfile.read(content_length)
-            with open(DB_PATH, 'wb') as f:
-                f.write(data)
-            self.send_response(200)
-            self.end_headers()
+from storage import (
+    init_db, get_student, get_students, add_student, update_student, delete_student,
+    get_payments, set_payments, get_classes, search
+)
+from tasks import TaskExecutor
+
+# Dialog widgets and the sync and snapshot modules are imported when first used;
+# widgets named in KV below are resolved through the Factory as the KV is built.
+startup.mark('imports')
+
+SEARCH_DELAY = 0.25  # seconds of no typing before the search runs
+SEARCH_LIMIT = 50
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June',
+          'July', 'August', 'September', 'October', 'November', 'December']
 
 # Kivy App
 KV = '''
 ScreenManager:
     MainScreen:
 
+<ClassRow>:
+    on_release: app.filter_class(self.class_name)
+
+<StudentRow>:
+    on_release: app.show_student_actions(self.student_id)
+
 <MainScreen>:
     name: 'main'
     BoxLayout:
@@ -160,12 +40,40 @@ ScreenManager:
         MDTopAppBar:
             title: 'School Fee Manager'
             right_action_items: [["sync", lambda x: app.show_sync()]]
+        MDBoxLayout:
+            size_hint_y: None
+            height: dp(36) if app.busy or app.status_text else 0
+            opacity: 1 if app.busy or app.status_text else 0
+            padding: dp(8), 0
+            spacing: dp(8)
+            MDSpinner:
+                size_hint: None, None
+                size: dp(20), dp(20)
+                pos_hint: {'center_y': .5}
+                active: app.busy
+                opacity: 1 if app.busy else 0
+            MDLabel:
+                text: app.status_text
+            MDProgressBar:
+                value: app.progress
+                opacity: 1 if app.progress else 0
+            MDFlatButton:
+                text: 'Cancel'
+                disabled: not app.cancellable
+                opacity: 1 if app.cancellable else 0
+                on_release: app.cancel_sync()
         BoxLayout:
             orientation: 'horizontal'
-            ScrollView:
+            RecycleView:
+                id: class_list
                 size_hint_x: 0.3
-                MDList:
-                    id: class_list
+                viewclass: 'ClassRow'
+                RecycleBoxLayout:
+                    orientation: 'vertical'
+                    default_size: None, dp(48)
+                    default_size_hint: 1, None
+                    size_hint_y: None
+                    height: self.minimum_height
             BoxLayout:
                 orientation: 'vertical'
                 size_hint_x: 0.7
@@ -195,55 +103,202 @@ ScreenManager:
                     MDRaisedButton:
                         text: 'Reset'
                         on_release: app.reset_form()
-                ScrollView:
+                MDTextField:
+                    id: search
+                    hint_text: 'Search name, father or phone'
+                    size_hint_y: None
+                    height: dp(48)
+                    on_text: app.search_students(self.text)
+                RecycleView:
+                    id: student_list
                     size_hint_y: 0.5
-                    MDList:
-                        id: student_list
+                    viewclass: 'StudentRow'
+                    RecycleBoxLayout:
+                        orientation: 'vertical'
+                        default_size: None, dp(88)
+                        default_size_hint: 1, None
+                        size_hint_y: None
+                        height: self.minimum_height
 '''
 
 class MainScreen(Screen):
     pass
 
+# Row views are recycled by the RecycleViews: only the rows on screen have widgets,
+# and scrolling or an update re-binds them to other entries of the `data` list.
+class ClassRow(OneLineListItem):
+    class_name = StringProperty('')
+
+class StudentRow(ThreeLineListItem):
+    student_id = NumericProperty(0)
+
+def student_row(s):
+    return {
+        'student_id': s.id,
+        'text': s.student_name,
+        'secondary_text': f"Class: {s.class_name}, Fee: {s.monthly_fee}",
+        'tertiary_text': f"Father: {s.father_name or '-'}, Phone: {s.parent_phone or '-'}",
+    }
+
+def search_text(s):
+    return f"{s.student_name}\n{s.father_name or ''}\n{s.parent_phone or ''}".lower()
+
+def update_view(rv, rows, key):
+    """Point a RecycleView at `rows`, redrawing as little as possible.
+
+    When the same entries are shown in the same order (an edit), only the
+    changed items are replaced, so just their views refresh. Otherwise the
+    data is swapped; the view still only rebuilds the rows that are visible.
+    """
+    if [row[key] for row in rv.data] == [row[key] for row in rows]:
+        for i, row in enumerate(rows):
+            if rv.data[i] != row:
+                rv.data[i] = row
+    else:
+        rv.data = rows
+
 class SchoolFeeApp(MDApp):
+    busy = BooleanProperty(False)
+    status_text = StringProperty('')
+    progress = NumericProperty(0)
+    cancellable = BooleanProperty(False)
+
     def build(self):
-        init_db()
-        self.sm = ScreenManager()
-        self.sm.add_widget(MainScreen())
-        return Builder.load_string(KV)
+        # Database work runs on one thread so edits apply in the order they were made;
+        # sync gets its own so a slow network never holds up a save.
+        self.db_tasks = TaskExecutor(1, 'db', on_busy=self.update_busy, on_error=self.task_failed)
+        self.net_tasks = TaskExecutor(1, 'net', on_busy=self.update_busy, on_error=self.task_failed)
+        self.sync_task = None
+        self.students_request = 0
+        self.action_dialog = self.payment_dialog = self.sync_dialog = None
+        self.ready = False  # until the first student list is shown
+        root = Builder.load_string(KV)
+        startup.mark('build')
+        return root
+
+    def update_busy(self, pending):
+        self.busy = bool(self.db_tasks.pending or self.net_tasks.pending)
+
+    def show_status(self, text, clear_after=None):
+        self.status_text = text
+        Clock.unschedule(self.clear_status)
+        if clear_after:
+            Clock.schedule_once(self.clear_status, clear_after)
+
+    def clear_status(self, *args):
+        self.status_text = ''
+
+    def task_failed(self, error):
+        print(error)
+        self.show_status(f'Error: {error}', clear_after=8)
 
     def on_start(self):
+        self.current_class = ''
+        self.search_query = ''
+        self.search_request = 0
+        self.students = {}  # id -> Student for the selected class, in list order
+        self.student_rows = {}  # id -> RecycleView data dict
+        self.search_index = {}  # id -> lowercased text the search box matches against
+        from kivy.core.window import Window
+        Window.bind(on_flip=self.first_frame)
+
+    def first_frame(self, window):
+        # The screen is drawn before the database is touched. init_db (and any
+        # migration) runs on the db thread, ahead of the loads queued behind it.
+        window.unbind(on_flip=self.first_frame)
+        startup.mark('first frame')
+        self.db_tasks.submit(init_db, on_done=lambda _: startup.mark('database'))
         self.load_classes()
         self.load_students()
 
     def load_classes(self):
-        classes = get_classes()
-        class_list = self.root.get_screen('main').ids.class_list
-        class_list.clear_widgets()
-        # Add All
-        item = OneLineListItem(text='All')
-        item.bind(on_release=lambda x: self.filter_class(''))
-        class_list.add_widget(item)
-        for c in classes:
-            item = OneLineListItem(text=c)
-            item.bind(on_release=lambda x, c=c: self.filter_class(c))
-            class_list.add_widget(item)
+        self.db_tasks.submit(get_classes, on_done=self.show_classes)
+
+    def show_classes(self, classes):
+        rows = [{'text': 'All', 'class_name': ''}]
+        rows += [{'text': c, 'class_name': c} for c in classes]
+        update_view(self.root.get_screen('main').ids.class_list, rows, 'class_name')
 
     def filter_class(self, class_name):
         self.current_class = class_name
         self.load_students()
 
     def load_students(self):
-        students = get_students(self.current_class if hasattr(self, 'current_class') else None)
-        student_list = self.root.get_screen('main').ids.student_list
-        student_list.clear_widgets()
+        # Only the latest request is shown, e.g. when classes are tapped in quick succession.
+        self.students_request += 1
+        request = self.students_request
+
+        def loaded(students):
+            if request == self.students_request:
+                self.show_students(students)
+
+        self.db_tasks.submit(get_students, self.current_class or None, on_done=loaded)
+
+    def show_students(self, students):
+        if not self.ready:
+            self.ready = True
+            startup.finish()
+            # Build the heaviest dialog while the user is still reading the list.
+            Clock.schedule_once(lambda dt: self.payments_dialog(), 1)
+        self.students = {}
+        self.student_rows = {}
+        self.search_index = {}
         for s in students:
-            item = ThreeLineListItem(
-                text=s.student_name,
-                secondary_text=f"Class: {s.class_name}, Fee: {s.monthly_fee}",
-                tertiary_text=f"Father: {s.father_name or '-'}, Phone: {s.parent_phone or '-'}"
-            )
-            item.bind(on_release=lambda x, s=s: self.show_student_actions(s))
-            student_list.add_widget(item)
+            self.cache_student(s)
+        self.refresh_student_list()
+
+    def cache_student(self, s):
+        self.students[s.id] = s
+        self.student_rows[s.id] = student_row(s)
+        self.search_index[s.id] = search_text(s)
+
+    def uncache_student(self, student_id):
+        self.students.pop(student_id, None)
+        self.student_rows.pop(student_id, None)
+        self.search_index.pop(student_id, None)
+
+    def reload_student(self, student_id):
+        """Re-read one student after a local edit instead of reloading the whole list."""
+        self.db_tasks.submit(get_student, student_id, on_done=lambda s: self.show_student(student_id, s))
+
+    def show_student(self, student_id, s):
+        if s is None or (self.current_class and s.class_name != self.current_class):
+            self.uncache_student(student_id)
+        else:
+            self.cache_student(s)
+        self.refresh_student_list()
+
+    def search_students(self, text):
+        self.search_query = text.strip()
+        Clock.unschedule(self.run_search)
+        if self.search_query and not self.current_class:
+            # Across all classes the indexed search runs once typing pauses.
+            Clock.schedule_once(self.run_search, SEARCH_DELAY)
+        else:
+            self.refresh_student_list()
+
+    def run_search(self, *args):
+        """Ranked search over every class through the index (see student_search.py)."""
+        self.search_request += 1
+        request = self.search_request
+
+        def found(students):
+            if request == self.search_request and self.search_query and not self.current_class:
+                for s in students:
+                    self.cache_student(s)
+                rows = [self.student_rows[s.id] for s in students]
+                update_view(self.root.get_screen('main').ids.student_list, rows, 'student_id')
+
+        self.db_tasks.submit(search, self.search_query, None, SEARCH_LIMIT, on_done=found)
+
+    def refresh_student_list(self):
+        if self.search_query and not self.current_class:
+            self.run_search()  # the whole roster is too long to filter per keystroke; an edit re-runs the query
+            return
+        # Within a class, searching filters the cached rows; it never goes back to SQLite.
+        query = self.search_query.lower()
+        rows = [row for sid, row in self.student_rows.items() if not query or query in self.search_index[sid]]
+        update_view(self.root.get_screen('main').ids.student_list, rows, 'student_id')
 
     def save_student(self):
         screen = self.root.get_screen('main')
@@ -252,13 +307,19 @@ class SchoolFeeApp(MDApp):
         father_name = screen.ids.father_name.text
         parent_phone = screen.ids.parent_phone.text
         monthly_fee = int(screen.ids.monthly_fee.text or 0)
-        if hasattr(self, 'editing_student'):
-            update_student(self.editing_student.id, class_name, student_name, father_name, parent_phone, monthly_fee)
-            del self.editing_student
-        else:
-            add_student(class_name, student_name, father_name, parent_phone, monthly_fee)
+        editing = getattr(self, 'editing_student', None)
+
+        def save():
+            if editing:
+                update_student(editing.id, class_name, student_name, father_name, parent_phone, monthly_fee)
+                return editing.id
+            return add_student(class_name, student_name, father_name, parent_phone, monthly_fee)
+
         self.reset_form()
-        self.load_students()
+        self.db_tasks.submit(save, on_done=self.student_saved)
+
+    def student_saved(self, student_id):
+        self.reload_student(student_id)
         self.load_classes()
 
     def reset_form(self):
@@ -281,77 +342,106 @@ class SchoolFeeApp(MDApp):
         self.editing_student = s
 
     def delete_student(self, s):
-        delete_student(s.id)
-        self.load_students()
+        self.db_tasks.submit(delete_student, s.id, on_done=lambda _: self.student_deleted(s.id))
+
+    def student_deleted(self, student_id):
+        self.uncache_student(student_id)
+        self.refresh_student_list()
         self.load_classes()
 
-    def show_student_actions(self, s):
-        content = MDBoxLayout(orientation='vertical')
-        content.add_widget(MDLabel(text=f"Actions for {s.student_name}"))
-        buttons = MDBoxLayout(orientation='horizontal')
-        edit_btn = MDRaisedButton(text='Edit')
-        edit_btn.bind(on_release=lambda x: self.edit_student(s))
-        delete_btn = MDRaisedButton(text='Delete')
-        delete_btn.bind(on_release=lambda x: self.delete_student(s))
-        pay_btn = MDRaisedButton(text='Payments')
-        pay_btn.bind(on_release=lambda x: self.show_payments(s))
-        buttons.add_widget(edit_btn)
-        buttons.add_widget(delete_btn)
-        buttons.add_widget(pay_btn)
-        content.add_widget(buttons)
-        self.action_dialog = MDDialog(
-            title="Student Actions",
-            type="custom",
-            content_cls=content,
-            buttons=[MDFlatButton(text="Close", on_release=lambda x: self.action_dialog.dismiss())]
-        )
-        self.action_dialog.open()
+    def student_actions_dialog(self):
+        # Dialogs are built on first use and reopened with new data afterwards.
+        if self.action_dialog is None:
+            from kivymd.uix.boxlayout import MDBoxLayout
+            from kivymd.uix.button import MDFlatButton, MDRaisedButton
+            from kivymd.uix.dialog import MDDialog
+            from kivymd.uix.label import MDLabel
+            content = MDBoxLayout(orientation='vertical')
+            self.action_label = MDLabel()
+            content.add_widget(self.action_label)
+            buttons = MDBoxLayout(orientation='horizontal')
+            for text, action in (('Edit', self.edit_student), ('Delete', self.delete_student),
+                                 ('Payments', self.show_payments)):
+                buttons.add_widget(MDRaisedButton(text=text, on_release=lambda x, action=action: action(self.action_student)))
+            content.add_widget(buttons)
+            self.action_dialog = MDDialog(
+                title="Student Actions",
+                type="custom",
+                content_cls=content,
+                buttons=[MDFlatButton(text="Close", on_release=lambda x: self.action_dialog.dismiss())]
+            )
+        return self.action_dialog
+
+    def show_student_actions(self, student_id):
+        dialog = self.student_actions_dialog()
+        self.action_student = self.students[student_id]
+        self.action_label.text = f"Actions for {self.action_student.student_name}"
+        dialog.open()
 
     def show_payments(self, s):
-        months = ['January','February','March','April','May','June','July','August','September','October','November','December']
-        payments = get_payments(s.id)
-        content = MDBoxLayout(orientation='vertical')
-        self.payment_inputs = {}
-        for i, m in enumerate(months):
-            box = MDBoxLayout(orientation='horizontal')
-            box.add_widget(MDLabel(text=m))
-            input = MDTextField(text=str(payments.get(i, Payment(None, None, None, 0, None)).amount), input_filter='int')
-            self.payment_inputs[i] = input
-            box.add_widget(input)
-            content.add_widget(box)
-        self.payment_dialog = MDDialog(
-            title=f"Payments for {s.student_name}",
-            type="custom",
-            content_cls=content,
-            buttons=[
-                MDFlatButton(text="Cancel", on_release=lambda x: self.payment_dialog.dismiss()),
-                MDFlatButton(text="Save", on_release=lambda x, s=s: self.save_payments(s))
-            ]
-        )
-        self.payment_dialog.open()
+        self.db_tasks.submit(get_payments, s.id, on_done=lambda payments: self.open_payments(s, payments))
+
+    def payments_dialog(self):
+        if self.payment_dialog is None:
+            from kivymd.uix.boxlayout import MDBoxLayout
+            from kivymd.uix.button import MDFlatButton
+            from kivymd.uix.dialog import MDDialog
+            from kivymd.uix.label import MDLabel
+            from kivymd.uix.textfield import MDTextField
+            content = MDBoxLayout(orientation='vertical')
+            self.payment_inputs = {}
+            for i, m in enumerate(MONTHS):
+                box = MDBoxLayout(orientation='horizontal')
+                box.add_widget(MDLabel(text=m))
+                self.payment_inputs[i] = MDTextField(input_filter='int')
+                box.add_widget(self.payment_inputs[i])
+                content.add_widget(box)
+            self.payment_dialog = MDDialog(
+                title="Payments",
+                type="custom",
+                content_cls=content,
+                buttons=[
+                    MDFlatButton(text="Cancel", on_release=lambda x: self.payment_dialog.dismiss()),
+                    MDFlatButton(text="Save", on_release=lambda x: self.save_payments(self.payment_student))
+                ]
+            )
+        return self.payment_dialog
 
-    def save_payments(self, s):
+    def open_payments(self, s, payments):
+        dialog = self.payments_dialog()
+        self.payment_student = s
+        dialog.title = f"Payments for {s.student_name}"
         for i, input in self.payment_inputs.items():
-            amount = int(input.text or 0)
-            set_payment(s.id, i, amount)
+            input.text = str(payments[i].amount if i in payments else 0)
+        dialog.open()
+
+    def save_payments(self, s):
+        amounts = {i: int(input.text or 0) for i, input in self.payment_inputs.items()}
         self.payment_dialog.dismiss()
-        self.load_students()
+        self.db_tasks.submit(set_payments, s.id, amounts,
+                             on_done=lambda _: self.show_status('Payments saved', clear_after=3))
 
     def show_sync(self):
-        content = MDBoxLayout(orientation='vertical')
-        self.sync_mode = MDTextField(hint_text='Mode: server or client')
-        self.sync_ip = MDTextField(hint_text='Server IP')
-        content.add_widget(self.sync_mode)
-        content.add_widget(self.sync_ip)
-        self.sync_dialog = MDDialog(
-            title="Sync",
-            type="custom",
-            content_cls=content,
-            buttons=[
-                MDFlatButton(text="Cancel", on_release=lambda x: self.sync_dialog.dismiss()),
-                MDFlatButton(text="Start", on_release=self.start_sync)
-            ]
-        )
+        # Reopening keeps the mode and server IP typed last time.
+        if self.sync_dialog is None:
+            from kivymd.uix.boxlayout import MDBoxLayout
+            from kivymd.uix.button import MDFlatButton
+            from kivymd.uix.dialog import MDDialog
+            from kivymd.uix.textfield import MDTextField
+            content = MDBoxLayout(orientation='vertical')
+            self.sync_mode = MDTextField(hint_text='Mode: server, client or full')
+            self.sync_ip = MDTextField(hint_text='Server IP')
+            content.add_widget(self.sync_mode)
+            content.add_widget(self.sync_ip)
+            self.sync_dialog = MDDialog(
+                title="Sync",
+                type="custom",
+                content_cls=content,
+                buttons=[
+                    MDFlatButton(text="Cancel", on_release=lambda x: self.sync_dialog.dismiss()),
+                    MDFlatButton(text="Start", on_release=self.start_sync)
+                ]
+            )
         self.sync_dialog.open()
 
     def start_sync(self, *args):
@@ -361,28 +451,75 @@ class SchoolFeeApp(MDApp):
             self.start_server()
         elif mode == 'client':
             self.start_client(ip)
+        elif mode == 'full':
+            self.start_full_download(ip)
         self.sync_dialog.dismiss()
 
     def start_server(self):
+        from sync import serve, SYNC_PORT
+
         def run_server():
-            server = HTTPServer(('0.0.0.0', 8080), SyncHandler)
+            server = serve('0.0.0.0', SYNC_PORT)
             server.serve_forever()
         threading.Thread(target=run_server, daemon=True).start()
 
     def start_client(self, ip):
-        try:
-            with urllib.request.urlopen(f'http://{ip}:8080/db') as response:
-                data = response.read()
-            with open(DB_PATH, 'wb') as f:
-                f.write(data)
-            # Then post back
-            with open(DB_PATH, 'rb') as f:
-                data = f.read()
-            req = urllib.request.Request(f'http://{ip}:8080/db', data=data, method='POST')
-            with urllib.request.urlopen(req) as response:
-                pass
-        except Exception as e:
-            print(e)
+        from sync import sync_with
+
+        def sync(task):
+            return sync_with(ip, progress=task.progress)
+        self.run_sync(sync, f'Syncing with {ip}...',
+                      lambda r: f"Synced with {ip}: sent {r['pushed']}, applied {r['pulled']}")
+
+    def start_full_download(self, ip):
+        from snapshot import download_snapshot
+        from sync import SYNC_PORT
+
+        def download(task):
+            return download_snapshot(ip, SYNC_PORT, progress=task.progress)
+        self.run_sync(download, f'Downloading from {ip}...',
+                      lambda version: f'Installed full copy from {ip} at version {version}')
+
+    def run_sync(self, fn, status, done_message):
+        if self.sync_task is not None:
+            self.show_status('A sync is already running')
+            return
+        self.show_status(status)
+        self.progress = 0
+        self.cancellable = True
+
+        def finished(message):
+            self.sync_task = None
+            self.cancellable = False
+            self.progress = 0
+            self.show_status(message, clear_after=5)
+            self.load_classes()
+            self.load_students()
+
+        def failed(error):
+            finished(f'Sync failed: {error}')
+            print(error)
+
+        self.sync_task = self.net_tasks.submit(
+            fn, with_task=True, on_progress=self.sync_progress,
+            on_done=lambda result: finished(done_message(result)), on_error=failed
+        )
+
+    def sync_progress(self, *args):
+        if len(args) == 2:  # snapshot download: (bytes received, total bytes)
+            received, total = args
+            self.progress = 100 * received / total if total else 0
+        else:
+            self.show_status(f'Sync: {args[0]}...')
+
+    def cancel_sync(self):
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+            # A cancelled task reports nothing back, so reset here.
+            self.sync_task = None
+            self.cancellable = False
+            self.progress = 0
+            self.show_status('Sync cancelled', clear_after=3)
 
 if __name__ == '__main__':
     SchoolFeeApp().run()
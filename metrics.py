@@ -0,0 +1,216 @@
+"""Request and SQL instrumentation for the Flask app.
+
+Per route it records a latency histogram, response status counts, and the
+number and total time of SQL statements. Every response carries a
+`Server-Timing` header. Requests slower than the threshold are logged with
+their slowest statements. `render()` produces the Prometheus text format
+served at `/metrics`.
+"""
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500, 1000)
+SLOW_LOG_STATEMENTS = 5
+MAX_RECORDED_STATEMENTS = 200  # per request, for the slow log; counts and times are never capped
+
+slow_log = logging.getLogger('school_fee.slow_requests')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_statements = 0
+        self.db_seconds = 0.0
+        self.statements = []  # (seconds, sql), capped at MAX_RECORDED_STATEMENTS
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # (method, route, status) -> count
+        self.latency = {}  # (method, route) -> Histogram of seconds
+        self.statements = {}  # (method, route) -> Histogram of statements per request
+        self.db_seconds = {}  # (method, route) -> total seconds spent in SQL
+        self.slow = {}  # (method, route) -> count
+        self.collectors = []
+
+    def record(self, method, route, status, seconds, stats, slow):
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.statements.setdefault(key, Histogram(STATEMENT_BUCKETS)).observe(stats.db_statements)
+            self.db_seconds[key] = self.db_seconds.get(key, 0.0) + stats.db_seconds
+            if slow:
+                self.slow[key] = self.slow.get(key, 0) + 1
+
+    def add_collector(self, collect):
+        """Register `collect()`, returning (name, type, help, {label: value}, value) tuples for `render()`."""
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, help_text, histograms):
+            header(name, 'histogram', help_text)
+            for (method, route), h in sorted(histograms.items()):
+                labels = {'method': method, 'route': route}
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {h.count}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(h.sum)}')
+                lines.append(f'{name}_count{_labels(labels)} {h.count}')
+
+        with self._lock:
+            header('school_fee_http_requests_total', 'counter', 'HTTP requests by route and status.')
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'school_fee_http_requests_total'
+                             f'{_labels({"method": method, "route": route, "status": str(status)})} {count}')
+            histogram('school_fee_http_request_duration_seconds', 'Request latency, including streamed bodies.',
+                      self.latency)
+            histogram('school_fee_db_statements_per_request', 'SQL statements issued per request.',
+                      self.statements)
+            header('school_fee_db_seconds_total', 'counter', 'Time spent executing SQL.')
+            for (method, route), seconds in sorted(self.db_seconds.items()):
+                lines.append(f'school_fee_db_seconds_total{_labels({"method": method, "route": route})} '
+                             f'{_number(seconds)}')
+            header('school_fee_slow_requests_total', 'counter', 'Requests over the slow-request threshold.')
+            for (method, route), count in sorted(self.slow.items()):
+                lines.append(f'school_fee_slow_requests_total{_labels({"method": method, "route": route})} {count}')
+        for collect in self.collectors:
+            seen = set()
+            for name, kind, help_text, labels, value in collect():
+                if name not in seen:
+                    header(name, kind, help_text)
+                    seen.add(name)
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def record_statement(statement, elapsed):
+    """Count one SQL statement that took `elapsed` seconds against the current request, if any."""
+    stats = g.get('request_stats') if has_request_context() else None
+    if stats is None:
+        return
+    stats.db_statements += 1
+    stats.db_seconds += elapsed
+    if len(stats.statements) < MAX_RECORDED_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_statement(statement, time.perf_counter() - conn.info['query_start'].pop())
+
+
+class TimedConnection:
+    """A sqlite3 connection whose `execute` calls are recorded like the engine's statements.
+
+    For code that runs SQL on the driver connection (`years`, `student_search`),
+    which the SQLAlchemy cursor events do not see.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, statement, *args):
+        start = time.perf_counter()
+        try:
+            return self._conn.execute(statement, *args)
+        finally:
+            record_statement(statement, time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def init_app(app, engine, slow_ms=500):
+    """Instrument `app` and the SQLAlchemy `engine`; requests over `slow_ms` are logged."""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_stats = RequestStats()
+
+    @app.after_request
+    def finish_request_metrics(response):
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+        # Unmatched URLs share one label so random paths cannot blow up the series count.
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        method = request.method
+        elapsed = time.perf_counter() - stats.start
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, '
+            f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.db_statements} SQL"'
+        )
+        path, status = request.full_path.rstrip('?'), response.status_code
+
+        def record():
+            # Runs once the body is sent, so streamed responses are timed in full.
+            total = time.perf_counter() - stats.start
+            slow = total * 1000 >= slow_ms
+            registry.record(method, route, status, total, stats, slow)
+            if slow:
+                worst = sorted(stats.statements, key=lambda s: s[0], reverse=True)[:SLOW_LOG_STATEMENTS]
+                slow_log.warning(
+                    'slow request %s %s -> %s: %.0f ms, %d SQL statements in %.0f ms; slowest:\n%s',
+                    method, path, status, total * 1000, stats.db_statements, stats.db_seconds * 1000,
+                    '\n'.join(f'  {seconds * 1000:8.1f} ms  {" ".join(sql.split())[:300]}' for seconds, sql in worst)
+                )
+
+        if response.is_streamed:
+            response.call_on_close(record)
+        else:
+            record()
+        return response
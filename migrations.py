@@ -0,0 +1,560 @@
+"""Versioned schema migrations shared by the Flask app and the Kivy app.
+
+Both entry points call `migrate()` once at startup with a plain sqlite3
+connection. Each migration runs in its own transaction and is recorded in
+`schema_version`, so it is applied exactly once per database file. The
+migrations are also written to be idempotent, because databases created by
+older releases already contain some of these objects without a version row.
+"""
+import sqlite3
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info('{table}')")]
+
+
+def _payment_cascades(conn):
+    return any(
+        row[2] == 'student' and row[6].upper() == 'CASCADE'
+        for row in conn.execute("PRAGMA foreign_key_list('payment')")
+    )
+
+
+PAYMENT_DDL = '''CREATE TABLE {name} (
+    id INTEGER PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES student (id) ON DELETE CASCADE,
+    month_index INTEGER NOT NULL,
+    amount INTEGER NOT NULL DEFAULT 0,
+    paid_on DATETIME
+)'''
+
+
+def create_base_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS student (
+        id INTEGER PRIMARY KEY,
+        class_name VARCHAR(50) NOT NULL,
+        student_name VARCHAR(100) NOT NULL,
+        father_name VARCHAR(100),
+        parent_phone VARCHAR(20),
+        monthly_fee INTEGER NOT NULL DEFAULT 0
+    )''')
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='payment'").fetchone():
+        conn.execute(PAYMENT_DDL.format(name='payment'))
+
+
+def add_student_father_name(conn):
+    if 'father_name' not in _columns(conn, 'student'):
+        conn.execute("ALTER TABLE student ADD COLUMN father_name VARCHAR(100)")
+
+
+def add_payment_month_unique(conn):
+    # Older databases may hold several rows per month; keep the latest one.
+    conn.execute(
+        "DELETE FROM payment WHERE id NOT IN "
+        "(SELECT MAX(id) FROM payment GROUP BY student_id, month_index)"
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_payment_student_month "
+        "ON payment (student_id, month_index)"
+    )
+
+
+def cascade_payment_deletes(conn):
+    """Rebuild `payment` so its foreign key deletes payments with their student.
+
+    SQLite cannot alter a foreign key in place. Orphaned payments, which the
+    old schema allowed, are dropped during the copy.
+    """
+    if _payment_cascades(conn):
+        return
+    conn.execute("DROP TABLE IF EXISTS payment_new")
+    conn.execute(PAYMENT_DDL.format(name='payment_new'))
+    conn.execute(
+        "INSERT INTO payment_new (id, student_id, month_index, amount, paid_on) "
+        "SELECT id, student_id, month_index, amount, paid_on FROM payment "
+        "WHERE student_id IN (SELECT id FROM student)"
+    )
+    conn.execute("DROP TABLE payment")
+    conn.execute("ALTER TABLE payment_new RENAME TO payment")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_payment_student_month "
+        "ON payment (student_id, month_index)"
+    )
+
+
+def add_lookup_indexes(conn):
+    # uq_payment_student_month already serves lookups by student_id alone
+    # (leftmost column), so only the class filter needs a new index.
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_student_class_name ON student (class_name)")
+
+
+def add_student_name_index(conn):
+    # Serves keyset pagination sorted by name; SQLite appends the rowid to every index.
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_student_student_name ON student (student_name)")
+
+
+def add_student_balances(conn):
+    """Materialize per-student balances, maintained by triggers on every write path.
+
+    Because the triggers live in the database, writes from the Flask app, the
+    Kivy app and sync all keep `student_balance` current in the same
+    transaction. carry_forward_due matches the December figure of the
+    month-by-month carry-forward: MAX(0, 12 * monthly_fee - total_paid).
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS student_balance (
+        student_id INTEGER PRIMARY KEY,
+        total_expected INTEGER NOT NULL DEFAULT 0,
+        total_paid INTEGER NOT NULL DEFAULT 0,
+        carry_forward_due INTEGER NOT NULL DEFAULT 0,
+        last_paid_month INTEGER
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_student_balance_due ON student_balance (carry_forward_due)")
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_balance_student_insert AFTER INSERT ON student BEGIN
+        INSERT OR REPLACE INTO student_balance (student_id, total_expected, total_paid, carry_forward_due)
+        VALUES (NEW.id, 12 * NEW.monthly_fee, 0, 12 * NEW.monthly_fee);
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_balance_student_fee AFTER UPDATE OF monthly_fee ON student BEGIN
+        UPDATE student_balance
+        SET total_expected = 12 * NEW.monthly_fee,
+            carry_forward_due = MAX(0, 12 * NEW.monthly_fee - total_paid)
+        WHERE student_id = NEW.id;
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_balance_student_delete AFTER DELETE ON student BEGIN
+        DELETE FROM student_balance WHERE student_id = OLD.id;
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_balance_payment_insert AFTER INSERT ON payment BEGIN
+        UPDATE student_balance
+        SET total_paid = total_paid + NEW.amount,
+            carry_forward_due = MAX(0, total_expected - (total_paid + NEW.amount)),
+            last_paid_month = CASE WHEN NEW.amount > 0
+                THEN MAX(COALESCE(last_paid_month, -1), NEW.month_index) ELSE last_paid_month END
+        WHERE student_id = NEW.student_id;
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_balance_payment_update
+    AFTER UPDATE OF student_id, month_index, amount ON payment BEGIN
+        UPDATE student_balance
+        SET total_paid = total_paid - OLD.amount,
+            carry_forward_due = MAX(0, total_expected - (total_paid - OLD.amount))
+        WHERE student_id = OLD.student_id;
+        UPDATE student_balance
+        SET total_paid = total_paid + NEW.amount,
+            carry_forward_due = MAX(0, total_expected - (total_paid + NEW.amount))
+        WHERE student_id = NEW.student_id;
+        UPDATE student_balance
+        SET last_paid_month = (SELECT MAX(month_index) FROM payment
+                               WHERE student_id = student_balance.student_id AND amount > 0)
+        WHERE student_id IN (OLD.student_id, NEW.student_id);
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_balance_payment_delete AFTER DELETE ON payment BEGIN
+        UPDATE student_balance
+        SET total_paid = total_paid - OLD.amount,
+            carry_forward_due = MAX(0, total_expected - (total_paid - OLD.amount)),
+            last_paid_month = (SELECT MAX(month_index) FROM payment WHERE student_id = OLD.student_id AND amount > 0)
+        WHERE student_id = OLD.student_id;
+    END''')
+    conn.execute('''INSERT OR REPLACE INTO student_balance
+        (student_id, total_expected, total_paid, carry_forward_due, last_paid_month)
+        SELECT s.id, 12 * s.monthly_fee, COALESCE(SUM(p.amount), 0),
+               MAX(0, 12 * s.monthly_fee - COALESCE(SUM(p.amount), 0)),
+               MAX(CASE WHEN p.amount > 0 THEN p.month_index END)
+        FROM student s LEFT JOIN payment p ON p.student_id = s.id
+        GROUP BY s.id''')
+
+
+NOW_MS = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+CLOCK = "(SELECT value FROM sync_meta WHERE key = 'clock')"
+DEVICE_ID = "(SELECT value FROM sync_meta WHERE key = 'device_id')"
+BUMP_CLOCK = "UPDATE sync_meta SET value = value + 1 WHERE key = 'clock';"
+
+
+def add_change_tracking(conn):
+    """Stamp every student and payment write for delta sync.
+
+    `version` is a per-database counter (sync_meta 'clock') that orders local
+    changes for `GET /changes?since=`. `updated_at` (ms since epoch) plus
+    `origin` (device id) order concurrent edits across devices for
+    last-writer-wins. Triggers stamp local writes with the current time and
+    this device. A write that sets `updated_at`/`origin` itself keeps the
+    stamps it supplied, which is how sync applies remote rows. Deletes leave tombstones.
+
+    Students get a global `uid`. Rows that exist before this migration use
+    '<device id>-<id>': devices set up separately each have a student 1, and
+    a shared uid would merge two different children. Devices that were
+    copies of one file under the old whole-file sync should bootstrap from a
+    snapshot of the hub (which carries its uids) before their first delta
+    sync, or their students arrive on the hub a second time.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_meta (key TEXT PRIMARY KEY, value)")
+    conn.execute("INSERT OR IGNORE INTO sync_meta (key, value) VALUES ('clock', 0)")
+    conn.execute("INSERT OR IGNORE INTO sync_meta (key, value) VALUES ('device_id', lower(hex(randomblob(8))))")
+    conn.execute('''CREATE TABLE IF NOT EXISTS sync_tombstone (
+        entity TEXT NOT NULL,
+        uid TEXT NOT NULL,
+        month_index INTEGER NOT NULL DEFAULT -1,
+        version INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL,
+        origin TEXT NOT NULL,
+        PRIMARY KEY (entity, uid, month_index)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sync_peer (
+        peer TEXT PRIMARY KEY,
+        peer_device_id TEXT,
+        pulled_version INTEGER NOT NULL DEFAULT 0,
+        pushed_version INTEGER NOT NULL DEFAULT 0
+    )''')
+
+    for table in ('student', 'payment'):
+        existing = _columns(conn, table)
+        if table == 'student' and 'uid' not in existing:
+            conn.execute("ALTER TABLE student ADD COLUMN uid TEXT")
+        if 'version' not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if 'updated_at' not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN updated_at INTEGER")
+        if 'origin' not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN origin TEXT")
+    conn.execute(f"UPDATE student SET uid = {DEVICE_ID} || '-' || id WHERE uid IS NULL")
+    for table in ('student', 'payment'):
+        conn.execute(f"UPDATE {table} SET updated_at = 0, origin = '' WHERE updated_at IS NULL")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_version ON {table} (version)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_student_uid ON student (uid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_sync_tombstone_version ON sync_tombstone (version)")
+
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sync_student_insert AFTER INSERT ON student BEGIN
+        {BUMP_CLOCK}
+        UPDATE student SET
+            uid = COALESCE(NEW.uid, lower(hex(randomblob(16)))),
+            version = {CLOCK},
+            updated_at = COALESCE(NEW.updated_at, {NOW_MS}),
+            origin = CASE WHEN NEW.updated_at IS NULL THEN {DEVICE_ID} ELSE NEW.origin END
+        WHERE id = NEW.id;
+    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sync_student_update
+    AFTER UPDATE OF class_name, student_name, father_name, parent_phone, monthly_fee ON student BEGIN
+        {BUMP_CLOCK}
+        UPDATE student SET
+            version = {CLOCK},
+            updated_at = CASE WHEN NEW.updated_at IS OLD.updated_at AND NEW.origin IS OLD.origin THEN {NOW_MS} ELSE NEW.updated_at END,
+            origin = CASE WHEN NEW.updated_at IS OLD.updated_at AND NEW.origin IS OLD.origin THEN {DEVICE_ID} ELSE NEW.origin END
+        WHERE id = NEW.id;
+    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sync_student_delete AFTER DELETE ON student BEGIN
+        {BUMP_CLOCK}
+        INSERT OR REPLACE INTO sync_tombstone (entity, uid, month_index, version, updated_at, origin)
+        VALUES ('student', OLD.uid, -1, {CLOCK}, {NOW_MS}, {DEVICE_ID});
+    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sync_payment_insert AFTER INSERT ON payment BEGIN
+        {BUMP_CLOCK}
+        UPDATE payment SET
+            version = {CLOCK},
+            updated_at = COALESCE(NEW.updated_at, {NOW_MS}),
+            origin = CASE WHEN NEW.updated_at IS NULL THEN {DEVICE_ID} ELSE NEW.origin END
+        WHERE id = NEW.id;
+    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sync_payment_update
+    AFTER UPDATE OF student_id, month_index, amount, paid_on ON payment BEGIN
+        {BUMP_CLOCK}
+        UPDATE payment SET
+            version = {CLOCK},
+            updated_at = CASE WHEN NEW.updated_at IS OLD.updated_at AND NEW.origin IS OLD.origin THEN {NOW_MS} ELSE NEW.updated_at END,
+            origin = CASE WHEN NEW.updated_at IS OLD.updated_at AND NEW.origin IS OLD.origin THEN {DEVICE_ID} ELSE NEW.origin END
+        WHERE id = NEW.id;
+    END''')
+    # Payments removed by the student cascade are covered by the student's tombstone.
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sync_payment_delete AFTER DELETE ON payment
+    WHEN EXISTS (SELECT 1 FROM student WHERE id = OLD.student_id) BEGIN
+        {BUMP_CLOCK}
+        INSERT OR REPLACE INTO sync_tombstone (entity, uid, month_index, version, updated_at, origin)
+        VALUES ('payment', (SELECT uid FROM student WHERE id = OLD.student_id), OLD.month_index,
+                {CLOCK}, {NOW_MS}, {DEVICE_ID});
+    END''')
+
+
+def add_notification_outbox(conn):
+    """Persistent queue for parent notifications, drained by `notifications.Dispatcher`.
+
+    `idempotency_key` is unique so a repeated broadcast cannot queue the same
+    reminder twice; it is also passed to the provider so a retried send is not
+    delivered twice.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        batch TEXT,
+        student_id INTEGER REFERENCES student (id) ON DELETE SET NULL,
+        to_phone TEXT NOT NULL,
+        message TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        provider TEXT,
+        provider_message_id TEXT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        sent_at TEXT
+    )''')
+    # Workers poll for due rows; the partial index stays as small as the backlog.
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_due ON notification_outbox (next_attempt_at) "
+                 "WHERE status IN ('queued', 'sending')")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_batch ON notification_outbox (batch, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_student ON notification_outbox (student_id)")
+
+
+CURRENT_YEAR = "(SELECT MAX(year) FROM academic_year WHERE closed_at IS NULL)"
+
+
+def _archived(year):
+    return f"EXISTS (SELECT 1 FROM academic_year WHERE year = {year} AND archived_at IS NOT NULL)"
+
+
+def add_academic_years(conn):
+    """Give payments an academic year and keep balances per (student, year).
+
+    `academic_year` lists the years; the one without `closed_at` is open and
+    receives new payments (see `years.close_year`). Existing payments become
+    the year in progress, which is also the column default for rows written
+    by older code. `student_balance` is rebuilt keyed by (student_id, year).
+    Its `opening_balance` holds the dues brought forward from the year before,
+    so carry_forward_due = MAX(0, opening_balance + total_expected - total_paid).
+    Payment tombstones now carry the year as part of the payment's sync identity.
+
+    Payments of an archived year are moved to the archive file by
+    `years.archive_year`. Those deletes are skipped by the balance and
+    tombstone triggers, so archiving changes nothing that is synced.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS academic_year (
+        year INTEGER PRIMARY KEY,
+        opened_at TEXT NOT NULL DEFAULT (datetime('now')),
+        closed_at TEXT,
+        archived_at TEXT
+    )''')
+    conn.execute("INSERT INTO academic_year (year) SELECT CAST(strftime('%Y', 'now') AS INTEGER) "
+                 "WHERE NOT EXISTS (SELECT 1 FROM academic_year)")
+    year = conn.execute(f"SELECT {CURRENT_YEAR}").fetchone()[0]
+    if 'year' not in _columns(conn, 'payment'):
+        conn.execute(f"ALTER TABLE payment ADD COLUMN year INTEGER NOT NULL DEFAULT {int(year)}")
+    # Also serves every lookup by student_id alone and by (student_id, year).
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_payment_student_year_month "
+                 "ON payment (student_id, year, month_index)")
+    conn.execute("DROP INDEX IF EXISTS uq_payment_student_month")
+
+    # Triggers that write to the rebuilt tables are recreated below; a rename
+    # would otherwise repoint them at the old table.
+    for trigger in ('trg_balance_student_insert', 'trg_balance_student_fee', 'trg_balance_student_delete',
+                    'trg_balance_payment_insert', 'trg_balance_payment_update', 'trg_balance_payment_delete',
+                    'trg_sync_student_delete', 'trg_sync_payment_delete'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    conn.execute("ALTER TABLE sync_tombstone RENAME TO sync_tombstone_old")
+    conn.execute('''CREATE TABLE sync_tombstone (
+        entity TEXT NOT NULL,
+        uid TEXT NOT NULL,
+        year INTEGER NOT NULL DEFAULT -1,
+        month_index INTEGER NOT NULL DEFAULT -1,
+        version INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL,
+        origin TEXT NOT NULL,
+        PRIMARY KEY (entity, uid, year, month_index)
+    )''')
+    conn.execute(
+        "INSERT INTO sync_tombstone (entity, uid, year, month_index, version, updated_at, origin) "
+        "SELECT entity, uid, CASE WHEN entity = 'payment' THEN ? ELSE -1 END, month_index, version, updated_at, origin "
+        "FROM sync_tombstone_old", (year,)
+    )
+    conn.execute("DROP TABLE sync_tombstone_old")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_sync_tombstone_version ON sync_tombstone (version)")
+
+    # Balances are derived data: rebuild them for the open year from the payments.
+    conn.execute("DROP TABLE IF EXISTS student_balance")
+    conn.execute('''CREATE TABLE student_balance (
+        student_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        opening_balance INTEGER NOT NULL DEFAULT 0,
+        total_expected INTEGER NOT NULL DEFAULT 0,
+        total_paid INTEGER NOT NULL DEFAULT 0,
+        carry_forward_due INTEGER NOT NULL DEFAULT 0,
+        last_paid_month INTEGER,
+        PRIMARY KEY (student_id, year)
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_student_balance_due ON student_balance (year, carry_forward_due)")
+    conn.execute('''INSERT INTO student_balance
+        (student_id, year, total_expected, total_paid, carry_forward_due, last_paid_month)
+        SELECT s.id, ?, 12 * s.monthly_fee, COALESCE(SUM(p.amount), 0),
+               MAX(0, 12 * s.monthly_fee - COALESCE(SUM(p.amount), 0)),
+               MAX(CASE WHEN p.amount > 0 THEN p.month_index END)
+        FROM student s LEFT JOIN payment p ON p.student_id = s.id
+        GROUP BY s.id''', (year,))
+
+    # A payment for a year the student has no balance row for yet (paid in
+    # advance, or entered late) starts that year's row. NOT EXISTS rather than
+    # OR IGNORE: an upsert's conflict handling overrides the one inside a trigger.
+    balance_row = ('INSERT INTO student_balance (student_id, year, total_expected, carry_forward_due) '
+                   'SELECT id, NEW.year, 12 * monthly_fee, 12 * monthly_fee FROM student WHERE id = NEW.student_id '
+                   'AND NOT EXISTS (SELECT 1 FROM student_balance WHERE student_id = NEW.student_id AND year = NEW.year);')
+    conn.execute(f'''CREATE TRIGGER trg_balance_student_insert AFTER INSERT ON student BEGIN
+        INSERT OR REPLACE INTO student_balance (student_id, year, total_expected, total_paid, carry_forward_due)
+        VALUES (NEW.id, {CURRENT_YEAR}, 12 * NEW.monthly_fee, 0, 12 * NEW.monthly_fee);
+    END''')
+    # A fee change applies to the open year; closed years keep the fee they were charged.
+    conn.execute(f'''CREATE TRIGGER trg_balance_student_fee AFTER UPDATE OF monthly_fee ON student BEGIN
+        UPDATE student_balance
+        SET total_expected = 12 * NEW.monthly_fee,
+            carry_forward_due = MAX(0, opening_balance + 12 * NEW.monthly_fee - total_paid)
+        WHERE student_id = NEW.id AND year = {CURRENT_YEAR};
+    END''')
+    conn.execute('''CREATE TRIGGER trg_balance_student_delete AFTER DELETE ON student BEGIN
+        DELETE FROM student_balance WHERE student_id = OLD.id;
+    END''')
+    conn.execute(f'''CREATE TRIGGER trg_balance_payment_insert AFTER INSERT ON payment BEGIN
+        {balance_row}
+        UPDATE student_balance
+        SET total_paid = total_paid + NEW.amount,
+            carry_forward_due = MAX(0, opening_balance + total_expected - (total_paid + NEW.amount)),
+            last_paid_month = CASE WHEN NEW.amount > 0
+                THEN MAX(COALESCE(last_paid_month, -1), NEW.month_index) ELSE last_paid_month END
+        WHERE student_id = NEW.student_id AND year = NEW.year;
+    END''')
+    conn.execute(f'''CREATE TRIGGER trg_balance_payment_update
+    AFTER UPDATE OF student_id, year, month_index, amount ON payment BEGIN
+        UPDATE student_balance
+        SET total_paid = total_paid - OLD.amount,
+            carry_forward_due = MAX(0, opening_balance + total_expected - (total_paid - OLD.amount))
+        WHERE student_id = OLD.student_id AND year = OLD.year;
+        {balance_row}
+        UPDATE student_balance
+        SET total_paid = total_paid + NEW.amount,
+            carry_forward_due = MAX(0, opening_balance + total_expected - (total_paid + NEW.amount))
+        WHERE student_id = NEW.student_id AND year = NEW.year;
+        UPDATE student_balance
+        SET last_paid_month = (SELECT MAX(month_index) FROM payment
+                               WHERE student_id = student_balance.student_id AND year = student_balance.year
+                                 AND amount > 0)
+        WHERE (student_id = OLD.student_id AND year = OLD.year) OR (student_id = NEW.student_id AND year = NEW.year);
+    END''')
+    conn.execute(f'''CREATE TRIGGER trg_balance_payment_delete AFTER DELETE ON payment
+    WHEN NOT {_archived('OLD.year')} BEGIN
+        UPDATE student_balance
+        SET total_paid = total_paid - OLD.amount,
+            carry_forward_due = MAX(0, opening_balance + total_expected - (total_paid - OLD.amount)),
+            last_paid_month = (SELECT MAX(month_index) FROM payment
+                               WHERE student_id = OLD.student_id AND year = OLD.year AND amount > 0)
+        WHERE student_id = OLD.student_id AND year = OLD.year;
+    END''')
+
+    conn.execute(f'''CREATE TRIGGER trg_sync_student_delete AFTER DELETE ON student BEGIN
+        {BUMP_CLOCK}
+        INSERT OR REPLACE INTO sync_tombstone (entity, uid, year, month_index, version, updated_at, origin)
+        VALUES ('student', OLD.uid, -1, -1, {CLOCK}, {NOW_MS}, {DEVICE_ID});
+    END''')
+    conn.execute(f'''CREATE TRIGGER trg_sync_payment_delete AFTER DELETE ON payment
+    WHEN EXISTS (SELECT 1 FROM student WHERE id = OLD.student_id) AND NOT {_archived('OLD.year')} BEGIN
+        {BUMP_CLOCK}
+        INSERT OR REPLACE INTO sync_tombstone (entity, uid, year, month_index, version, updated_at, origin)
+        VALUES ('payment', (SELECT uid FROM student WHERE id = OLD.student_id), OLD.year, OLD.month_index,
+                {CLOCK}, {NOW_MS}, {DEVICE_ID});
+    END''')
+
+
+# Parent phones are indexed as digits only, so "0300 123" and "0300-123" find the same number.
+PHONE_DIGITS = "replace(replace(replace(replace(replace({}, ' ', ''), '-', ''), '+', ''), '(', ''), ')', '')"
+
+
+def add_student_search(conn):
+    """Full-text index over student and father names and parent phone numbers (see student_search.py).
+
+    The trigram tokenizer (SQLite 3.34+) matches any part of three or more
+    characters; without it FTS5's word tokenizer gives prefix matching. When
+    SQLite lacks FTS5 entirely no index is built and searches scan `student`.
+    Triggers keep the index current for every write path, sync included.
+    """
+    for tokenize in ('trigram', 'unicode61'):
+        try:
+            conn.execute(f"CREATE VIRTUAL TABLE student_search USING fts5("
+                         f"student_name, father_name, parent_phone, tokenize='{tokenize}')")
+            break
+        except sqlite3.OperationalError:  # no such tokenizer, or no such module: fts5
+            continue
+    else:
+        return
+    phone = PHONE_DIGITS.format('new.parent_phone')
+    conn.execute(f'''CREATE TRIGGER trg_search_student_insert AFTER INSERT ON student BEGIN
+        INSERT INTO student_search (rowid, student_name, father_name, parent_phone)
+        VALUES (new.id, new.student_name, new.father_name, {phone});
+    END''')
+    conn.execute(f'''CREATE TRIGGER trg_search_student_update
+    AFTER UPDATE OF student_name, father_name, parent_phone ON student BEGIN
+        UPDATE student_search SET student_name = new.student_name, father_name = new.father_name,
+            parent_phone = {phone}
+        WHERE rowid = new.id;
+    END''')
+    conn.execute('''CREATE TRIGGER trg_search_student_delete AFTER DELETE ON student BEGIN
+        DELETE FROM student_search WHERE rowid = old.id;
+    END''')
+    conn.execute(f"INSERT INTO student_search (rowid, student_name, father_name, parent_phone) "
+                 f"SELECT id, student_name, father_name, {PHONE_DIGITS.format('parent_phone')} FROM student")
+
+
+# (version, name, function, needs foreign_keys=OFF). Append only; never renumber.
+MIGRATIONS = [
+    (1, 'base tables', create_base_tables, False),
+    (2, 'student.father_name', add_student_father_name, False),
+    (3, 'unique payment per student and month', add_payment_month_unique, False),
+    (4, 'cascade payment deletes', cascade_payment_deletes, True),
+    (5, 'lookup indexes', add_lookup_indexes, False),
+    (6, 'student name index', add_student_name_index, False),
+    (7, 'materialized student balances', add_student_balances, False),
+    (8, 'change tracking for delta sync', add_change_tracking, False),
+    (9, 'notification outbox', add_notification_outbox, False),
+    (10, 'academic years', add_academic_years, False),
+    (11, 'student search index', add_student_search, False),
+]
+
+
+def current_version(conn):
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """Bring the database behind `conn` up to the latest schema version.
+
+    Returns the list of versions that were applied.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # explicit BEGIN/COMMIT below
+    applied = []
+    try:
+        conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_on TEXT NOT NULL DEFAULT (datetime('now'))
+        )''')
+        for version, name, func, needs_fk_off in MIGRATIONS:
+            if version <= current_version(conn):
+                continue
+            fk_enabled = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+            if needs_fk_off and fk_enabled:
+                # Table rebuilds must not trigger cascades; the pragma is a no-op inside a transaction.
+                conn.execute("PRAGMA foreign_keys=OFF")
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Another process may have migrated while we waited for the write lock.
+                    if version <= current_version(conn):
+                        conn.execute("ROLLBACK")
+                        continue
+                    func(conn)
+                    if needs_fk_off and conn.execute("PRAGMA foreign_key_check").fetchone():
+                        raise sqlite3.IntegrityError(f"migration {version} left dangling foreign keys")
+                    conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            finally:
+                if needs_fk_off and fk_enabled:
+                    conn.execute("PRAGMA foreign_keys=ON")
+            applied.append(version)
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
@@ -0,0 +1,304 @@
+"""Background delivery of parent notifications.
+
+Messages are queued in the `notification_outbox` table and sent by a pool of
+worker threads, so a broadcast to a whole school returns as soon as the rows
+are written. Each provider has its own rate limit, failed sends are retried
+with exponential backoff, and every message carries an idempotency key: the
+same reminder cannot be queued twice, and providers that support it use the
+key to drop a resend.
+
+A worker claims a row by leasing it (status 'sending' with a deadline), so
+rows held by a crashed worker or process are picked up again once the lease
+runs out, and several processes can drain the same outbox safely.
+"""
+import abc
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+LEASE_SECONDS = 300
+
+
+class SendError(Exception):
+    """A send failed; `retry` tells the dispatcher whether trying again can help."""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+class Provider(abc.ABC):
+    """Interface for notification back ends.
+
+    `send` delivers one message and returns the provider's message id, or
+    raises SendError. The dispatcher calls it from several threads, at most
+    `rate_per_second` times a second with bursts of up to `burst`.
+    """
+    name = 'provider'
+    rate_per_second = 1.0
+    burst = 1
+
+    @abc.abstractmethod
+    def send(self, to, message, idempotency_key):
+        """Deliver one message; returns the provider's message id or raises SendError."""
+
+
+class FakeProvider(Provider):
+    """Keeps messages in memory instead of sending them, for development and testing.
+
+    `latency` simulates a slow remote call and `failure_rate` makes that
+    fraction of sends fail with a retryable error.
+    """
+    name = 'fake'
+
+    def __init__(self, rate_per_second=50.0, burst=10, latency=0.0, failure_rate=0.0):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = {}  # idempotency_key -> (to, message, provider message id)
+        self._lock = threading.Lock()
+
+    def send(self, to, message, idempotency_key):
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise SendError('simulated provider failure')
+        with self._lock:
+            # Like a real idempotent API, a repeated key returns the first message id.
+            self.sent.setdefault(idempotency_key, (to, message, f'fake-{uuid.uuid4().hex[:12]}'))
+            return self.sent[idempotency_key][2]
+
+
+class WhatsAppCloudProvider(Provider):
+    """Meta WhatsApp Cloud API text messages."""
+    name = 'whatsapp_cloud'
+
+    def __init__(self, phone_number_id, access_token, rate_per_second=20.0, burst=20, timeout=15):
+        self.url = f'https://graph.facebook.com/v19.0/{phone_number_id}/messages'
+        self.access_token = access_token
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.timeout = timeout
+
+    def send(self, to, message, idempotency_key):
+        body = json.dumps({
+            'messaging_product': 'whatsapp',
+            'to': to,
+            'type': 'text',
+            'text': {'body': message},
+        }).encode('utf-8')
+        req = urllib.request.Request(self.url, data=body, headers={
+            'Authorization': f'Bearer {self.access_token}',
+            'Content-Type': 'application/json',
+        })
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return json.loads(response.read())['messages'][0]['id']
+        except urllib.error.HTTPError as e:
+            detail = e.read(500).decode('utf-8', 'replace')
+            # Throttling and server errors pass; a bad number or token will not.
+            raise SendError(f'HTTP {e.code}: {detail}', retry=e.code == 429 or e.code >= 500)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            raise SendError(str(e))
+
+
+def provider_from_env():
+    """Pick the provider named by NOTIFY_PROVIDER ('fake' by default)."""
+    name = os.environ.get('NOTIFY_PROVIDER', 'fake')
+    if name == 'fake':
+        return FakeProvider()
+    if name == 'whatsapp_cloud':
+        return WhatsAppCloudProvider(os.environ['WHATSAPP_PHONE_NUMBER_ID'], os.environ['WHATSAPP_ACCESS_TOKEN'])
+    raise ValueError(f'unknown NOTIFY_PROVIDER: {name}')
+
+
+class RateLimiter:
+    """Token bucket shared by every worker sending through one provider."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop):
+        """Wait for a token; returns False instead if `stop` is set first."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if stop.wait(wait):
+                return False
+
+
+class Dispatcher:
+    """Drains `notification_outbox` through `provider` with a pool of worker threads."""
+
+    def __init__(self, db_path, provider, workers=4, max_attempts=5,
+                 backoff_base=30.0, backoff_max=3600.0, poll_interval=5.0):
+        self.db_path = db_path
+        self.provider = provider
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.limiter = RateLimiter(provider.rate_per_second, provider.burst)
+        self._local = threading.local()
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        """Start the workers; safe to call repeatedly."""
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'notify-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Ask the workers to finish their current send and exit."""
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        with self._start_lock:
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    def enqueue(self, messages, batch=None):
+        """Queue dicts with idempotency_key, to, message and optional student_id.
+
+        Returns (queued, duplicates); keys already in the outbox are skipped.
+        """
+        rows = [(m['idempotency_key'], batch, m.get('student_id'), m['to'], m['message']) for m in messages]
+        conn = self._connection()
+        before = conn.total_changes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO notification_outbox (idempotency_key, batch, student_id, to_phone, message) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        queued = conn.total_changes - before
+        with self._wake:
+            self._wake.notify_all()
+        return queued, len(rows) - queued
+
+    def status(self, batch=None):
+        conn = self._connection()
+        where, params = ("WHERE batch = ?", (batch,)) if batch else ("", ())
+        counts = {'queued': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+        for status, count in conn.execute(
+                f"SELECT status, COUNT(*) FROM notification_outbox {where} GROUP BY status", params):
+            counts[status] = count
+        failures = conn.execute(
+            f"SELECT id, student_id, to_phone, attempts, last_error FROM notification_outbox "
+            f"{where + ' AND' if where else 'WHERE'} status = 'failed' ORDER BY id DESC LIMIT 20", params
+        ).fetchall()
+        return {
+            'provider': self.provider.name,
+            'workers': len(self._threads),
+            'counts': counts,
+            'recent_failures': [
+                {'id': r[0], 'student_id': r[1], 'to': r[2], 'attempts': r[3], 'error': r[4]} for r in failures
+            ],
+        }
+
+    def _claim(self):
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, idempotency_key, to_phone, message, attempts FROM notification_outbox "
+                "WHERE status IN ('queued', 'sending') AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at, id LIMIT 1", (now,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE notification_outbox SET status = 'sending', attempts = attempts + 1, "
+                    "next_attempt_at = ? WHERE id = ?", (now + LEASE_SECONDS, row[0])
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                job = None  # e.g. the database is busy; try again after the poll interval
+            if job is None:
+                with self._wake:
+                    self._wake.wait(self.poll_interval)
+                continue
+            if not self.limiter.acquire(self._stop):
+                # Shutting down: hand the row back untouched.
+                self._connection().execute(
+                    "UPDATE notification_outbox SET status = 'queued', attempts = attempts - 1, "
+                    "next_attempt_at = 0 WHERE id = ?", (job[0],)
+                )
+                break
+            self._deliver(*job)
+
+    def _deliver(self, id, idempotency_key, to, message, attempts):
+        attempts += 1
+        try:
+            provider_message_id = self.provider.send(to, message, idempotency_key)
+        except SendError as e:
+            error, retry = str(e), e.retry
+        except Exception as e:
+            error, retry = f'{type(e).__name__}: {e}', True
+        else:
+            self._connection().execute(
+                "UPDATE notification_outbox SET status = 'sent', provider = ?, provider_message_id = ?, "
+                "last_error = NULL, sent_at = datetime('now') WHERE id = ?",
+                (self.provider.name, provider_message_id, id)
+            )
+            return
+        if retry and attempts < self.max_attempts:
+            # Exponential backoff with jitter so retries from one broadcast spread out.
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+            self._connection().execute(
+                "UPDATE notification_outbox SET status = 'queued', next_attempt_at = ?, last_error = ? "
+                "WHERE id = ?", (time.time() + delay, error, id)
+            )
+        else:
+            self._connection().execute(
+                "UPDATE notification_outbox SET status = 'failed', provider = ?, last_error = ? WHERE id = ?",
+                (self.provider.name, error, id)
+            )
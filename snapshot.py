@@ -0,0 +1,319 @@
+"""Full-database snapshots for the initial sync and for restores.
+
+A snapshot is a consistent copy taken with SQLite's online backup API,
+gzip-compressed in chunks and identified by the SHA-256 of the compressed
+bytes. Downloads can resume with HTTP Range requests. A received snapshot
+is verified (checksum, then `PRAGMA integrity_check`) before it atomically
+replaces the live database, so an interrupted or corrupt transfer never
+touches the existing file.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+import migrations
+from storage import pool
+
+CHUNK_SIZE = 64 * 1024
+KEEP_SNAPSHOTS = 2  # the previous snapshot stays available for clients resuming a download
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Snapshot:
+    def __init__(self, path, sha256, size, version):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.version = version
+
+
+_lock = threading.Lock()
+_snapshots = []  # newest last
+
+
+def _snapshot_dir():
+    path = os.path.join(os.path.dirname(os.path.abspath(pool.path)), 'snapshots')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _clock(conn):
+    row = conn.execute("SELECT value FROM sync_meta WHERE key = 'clock'").fetchone()
+    return row[0] if row else 0
+
+
+def _device_id():
+    row = pool.connection().execute("SELECT value FROM sync_meta WHERE key = 'device_id'").fetchone()
+    return row[0] if row else ''
+
+
+def compress_file(src_path, dest_path):
+    """gzip `src_path` into `dest_path` in chunks; returns (sha256 of the output, size)."""
+    digest = hashlib.sha256()
+    with open(dest_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz, open(src_path, 'rb') as src:
+            shutil.copyfileobj(src, gz, CHUNK_SIZE)
+    with open(dest_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest(), os.path.getsize(dest_path)
+
+
+def current_snapshot():
+    """Return a snapshot of the live database, reusing the cached one if nothing changed since."""
+    with _lock:
+        version = _clock(pool.connection())
+        if _snapshots and _snapshots[-1].version == version:
+            return _snapshots[-1]
+        directory = _snapshot_dir()
+        fd, raw_path = tempfile.mkstemp(suffix='.db', dir=directory)
+        os.close(fd)
+        try:
+            pool.backup_to(raw_path)
+            fd, gz_path = tempfile.mkstemp(suffix='.db.gz', dir=directory)
+            os.close(fd)
+            sha256, size = compress_file(raw_path, gz_path)
+        finally:
+            os.remove(raw_path)
+        final_path = os.path.join(directory, f'{sha256}.db.gz')
+        os.replace(gz_path, final_path)
+        _snapshots.append(Snapshot(final_path, sha256, size, version))
+        while len(_snapshots) > KEEP_SNAPSHOTS:
+            old = _snapshots.pop(0)
+            if old.path != final_path:
+                try:
+                    os.remove(old.path)
+                except FileNotFoundError:
+                    pass
+        return _snapshots[-1]
+
+
+def find_snapshot(sha256):
+    with _lock:
+        for snap in _snapshots:
+            if snap.sha256 == sha256:
+                return snap
+    return None
+
+
+def iter_file(path, start=0, end=None):
+    """Yield the bytes of `path` from `start` up to and including `end` in CHUNK_SIZE pieces."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def parse_range(header, size):
+    """Parse a single `bytes=start-[end]` Range header; returns (start, end) or None."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].partition('-')
+    try:
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start < 0 or start > end or start >= size:
+        return None
+    return start, min(end, size - 1)
+
+
+def verify_database(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        raise SnapshotError(f'received file is not a valid database: {e}')
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise SnapshotError(f'integrity check failed: {result}')
+
+
+def install_database(db_path):
+    """Verify an uncompressed database file and atomically make it the live database.
+
+    The file at `db_path` (same directory as the live database) is consumed.
+    Returns the installed database's clock version.
+    """
+    verify_database(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        # Files from older app versions are brought up to the current schema before going live.
+        migrations.migrate(conn)
+        # The copy came from another device: take a fresh device id so its rows
+        # are not mistaken for our own edits on the next delta sync.
+        with conn:
+            conn.execute("UPDATE sync_meta SET value = lower(hex(randomblob(8))) WHERE key = 'device_id'")
+            conn.execute("DELETE FROM sync_peer")
+        version = _clock(conn)
+    finally:
+        conn.close()
+    pool.install_file(db_path)
+    return version
+
+
+def _temp_database_path():
+    fd, path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(os.path.abspath(pool.path)))
+    os.close(fd)
+    return path
+
+
+def install_snapshot(gz_path, expected_sha256=None):
+    """Check, decompress and install a compressed snapshot; the file at `gz_path` is consumed."""
+    try:
+        digest = hashlib.sha256()
+        with open(gz_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        if expected_sha256 and digest.hexdigest() != expected_sha256:
+            raise SnapshotError('checksum mismatch')
+        db_tmp = _temp_database_path()
+        try:
+            with gzip.open(gz_path, 'rb') as src, open(db_tmp, 'wb') as dest:
+                shutil.copyfileobj(src, dest, CHUNK_SIZE)
+                dest.flush()
+                os.fsync(dest.fileno())
+            return install_database(db_tmp)
+        except (OSError, EOFError, gzip.BadGzipFile) as e:
+            raise SnapshotError(f'could not decompress snapshot: {e}')
+        finally:
+            if os.path.exists(db_tmp):
+                os.remove(db_tmp)
+    finally:
+        os.remove(gz_path)
+
+
+def _copy_body(stream, length, dest_path):
+    with open(dest_path, 'wb') as f:
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise SnapshotError('upload ended early')
+            f.write(chunk)
+            remaining -= len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def receive_database(stream, length):
+    """Install an uncompressed database body (the legacy `POST /db` upload)."""
+    db_tmp = _temp_database_path()
+    try:
+        _copy_body(stream, length, db_tmp)
+        return install_database(db_tmp)
+    finally:
+        if os.path.exists(db_tmp):
+            os.remove(db_tmp)
+
+
+def receive_snapshot(stream, length, expected_sha256):
+    """Copy `length` bytes of a compressed snapshot from `stream` to disk in chunks and install it."""
+    fd, gz_path = tempfile.mkstemp(suffix='.db.gz', dir=_snapshot_dir())
+    os.close(fd)
+    try:
+        _copy_body(stream, length, gz_path)
+    except BaseException:
+        os.remove(gz_path)
+        raise
+    return install_snapshot(gz_path, expected_sha256)
+
+
+def download_snapshot(host, port, timeout=30, attempts=5, progress=None):
+    """Fetch the peer's snapshot, resuming after dropped connections, and install it.
+
+    Partial downloads are kept next to the database with a small JSON sidecar
+    recording which snapshot they belong to, so a later call resumes too.
+    `progress(received, total)` is called after every chunk when given.
+    Returns the installed version.
+    """
+    base = f'http://{host}:{port}/snapshot'
+    part_path = os.path.join(_snapshot_dir(), f'download-{host}-{port}.part')
+    meta_path = part_path + '.json'
+    meta = {}
+    if os.path.exists(part_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    last_error = None
+    for _ in range(attempts):
+        offset = os.path.getsize(part_path) if meta and os.path.exists(part_path) else 0
+        if meta and offset >= meta['size']:
+            break  # a previous run finished the transfer but not the install
+        url = base + (f"?sha256={meta['sha256']}" if meta else '')
+        headers = {'X-Device-Id': _device_id()}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = f'"{meta["sha256"]}"'
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+                sha256 = response.headers['X-Snapshot-Sha256']
+                total = int(response.headers['X-Snapshot-Size'])
+                if response.status != 206:
+                    offset = 0  # the snapshot changed (or no resume); start over
+                meta = {'sha256': sha256, 'size': total, 'device_id': response.headers['X-Snapshot-Device']}
+                with open(meta_path, 'w') as f:
+                    json.dump(meta, f)
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    received = offset
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                        f.write(chunk)
+                        received += len(chunk)
+                        if progress:
+                            progress(received, total)
+            if os.path.getsize(part_path) >= meta['size']:
+                break
+            last_error = SnapshotError('download ended early')
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                meta = {}  # our partial file does not fit the snapshot; start over
+            last_error = e
+        except OSError as e:
+            last_error = e
+    else:
+        raise SnapshotError(f'download failed after {attempts} attempts: {last_error}')
+
+    os.remove(meta_path)
+    version = install_snapshot(part_path, meta['sha256'])
+    # The new file is exactly the peer's state at `version`: continue with delta sync from there.
+    with pool.transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO sync_peer (peer, peer_device_id, pulled_version, pushed_version) "
+            "VALUES (?, ?, ?, ?)", (f'{host}:{port}', meta.get('device_id'), version, _clock(conn))
+        )
+    return version
+
+
+def upload_snapshot(host, port, timeout=30):
+    """Send a snapshot of the local database to replace the peer's database."""
+    snap = current_snapshot()
+    with open(snap.path, 'rb') as f:
+        req = urllib.request.Request(
+            f'http://{host}:{port}/snapshot', data=f, method='POST',
+            headers={
+                'Content-Type': 'application/gzip',
+                'Content-Length': str(snap.size),
+                'X-Snapshot-Sha256': snap.sha256,
+                'X-Device-Id': _device_id(),
+            }
+        )
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read())
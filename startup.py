@@ -0,0 +1,42 @@
+"""Cold-start timing for the Kivy app.
+
+main.py imports this module first, so the clock starts before Kivy and
+KivyMD are imported. `mark()` logs the milliseconds since then at each
+milestone, and `finish()` logs the whole start once the first student list
+is on screen. With SCHOOL_FEE_PROFILE=<path> the start also runs under
+cProfile; the stats are written to <path> (read them with `python -m pstats`).
+"""
+import os
+import time
+
+started = time.perf_counter()
+marks = []
+_profile_path = os.environ.get('SCHOOL_FEE_PROFILE')
+_profiler = None
+if _profile_path:
+    import cProfile
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+
+
+def _log(message):
+    from kivy.logger import Logger
+    Logger.info(f'Startup: {message}')
+
+
+def mark(name):
+    elapsed = (time.perf_counter() - started) * 1000
+    marks.append((name, elapsed))
+    _log(f'{name} at {elapsed:.0f} ms')
+
+
+def finish():
+    """Log the cold-start summary and save the profile."""
+    global _profiler
+    mark('ready')
+    _log(', '.join(f'{name} {elapsed:.0f}' for name, elapsed in marks) + ' (ms)')
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profile_path)
+        _log(f'profile written to {_profile_path}')
+        _profiler = None
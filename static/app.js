@@ -27,11 +27,29 @@ async function loadClasses(){
 		li.innerHTML = `
 			<div style="display:flex; gap:8px; align-items:center;">
 				<button class="link ${currentClassFilter===c?'active':''}" data-class="${c}">${c}</button>
+				<button data-print-class="${c}">Print Slips</button>
+				<button data-remind-class="${c}">Remind Defaulters</button>
 				<button class="danger" data-delete-class="${c}">Delete</button>
 			</div>`;
 		ul.appendChild(li);
 	}
 	ul.onclick = async (e)=>{
+		const remindBtn = e.target.closest('button[data-remind-class]');
+		if(remindBtn){
+			const name = remindBtn.getAttribute('data-remind-class');
+			if(confirm(`Send a WhatsApp dues reminder to every parent in class "${name}" who owes fees?`)){
+				const r = await fetch(`/api/notify/class/${encodeURIComponent(name)}`, { method:'POST', headers: {'Content-Type':'application/json'}, body: '{}' });
+				const out = await r.json();
+				alert(`Queued ${out.queued} reminder(s); ${out.already_queued} already sent this month, ${out.skipped_no_phone} without a phone number.`);
+			}
+			return;
+		}
+		const printBtn = e.target.closest('button[data-print-class]');
+		if(printBtn){
+			const name = printBtn.getAttribute('data-print-class');
+			window.open(`/print/class/${encodeURIComponent(name)}?month=${$('#print-month').value}`, '_blank');
+			return;
+		}
 		const del = e.target.closest('button[data-delete-class]');
 		if(del){
 			const name = del.getAttribute('data-delete-class');
@@ -51,38 +69,84 @@ async function loadClasses(){
 	};
 }
 
+const STUDENT_PAGE_SIZE = 500;
+const SEARCH_DELAY_MS = 250;
+const SEARCH_LIMIT = 50;
+let studentsLoadToken = 0;
+let searchTimer = null;
+let searchController = null;
+
+function renderStudentRow(s){
+	const tr = document.createElement('tr');
+	const cells = [
+		String(s.id),
+		s.class_name,
+		s.student_name,
+		s.father_name || '-',
+		s.parent_phone || '-',
+		String(s.monthly_fee)
+	];
+	cells.forEach((val)=>{
+		const td = document.createElement('td');
+		td.textContent = val;
+		tr.appendChild(td);
+	});
+	const actions = document.createElement('td');
+	actions.innerHTML = `
+		<button data-edit="${s.id}">Edit</button>
+		<button data-delete="${s.id}">Delete</button>
+		<button data-pay="${s.id}">Payments</button>
+		<button data-quickpay="${s.id}">Quick Pay</button>
+		<button data-print="${s.id}">Print Slip</button>
+		<button data-notify="${s.id}">WhatsApp</button>`;
+	tr.appendChild(actions);
+	return tr;
+}
+
+async function searchStudents(q){
+	// Ranked matches from the search index; a newer query aborts the one in flight.
+	const token = ++studentsLoadToken;
+	if(searchController) searchController.abort();
+	searchController = new AbortController();
+	const params = new URLSearchParams({ q, limit: String(SEARCH_LIMIT) });
+	if(currentClassFilter) params.set('class', currentClassFilter);
+	let students;
+	try{
+		const res = await fetch('/api/search?'+params.toString(), { signal: searchController.signal });
+		students = await res.json();
+	}catch(err){
+		if(err.name === 'AbortError') return;
+		throw err;
+	}
+	if(token!==studentsLoadToken) return;
+	const tbody = $('#students-table tbody');
+	tbody.innerHTML = '';
+	const frag = document.createDocumentFragment();
+	for(const s of students){ frag.appendChild(renderStudentRow(s)); }
+	tbody.appendChild(frag);
+}
+
 async function loadStudents(){
-	const qs = currentClassFilter ? `?class=${encodeURIComponent(currentClassFilter)}` : '';
-	const res = await fetch('/api/students'+qs);
-	const students = await res.json();
+	const q = $('#student-search').value.trim();
+	if(q) return searchStudents(q);
+	// Pages are fetched by keyset (after_id) and appended as they arrive; a newer
+	// call (e.g. another class clicked) abandons an older one mid-way.
+	const token = ++studentsLoadToken;
 	const tbody = $('#students-table tbody');
 	tbody.innerHTML = '';
-	for(const s of students){
-		const tr = document.createElement('tr');
-		const cells = [
-			String(s.id),
-			s.class_name,
-			s.student_name,
-			s.father_name || '-',
-			s.parent_phone || '-',
-			String(s.monthly_fee)
-		];
-		cells.forEach((val)=>{
-			const td = document.createElement('td');
-			td.textContent = val;
-			tr.appendChild(td);
-		});
-		const actions = document.createElement('td');
-		actions.innerHTML = `
-			<button data-edit="${s.id}">Edit</button>
-			<button data-delete="${s.id}">Delete</button>
-			<button data-pay="${s.id}">Payments</button>
-			<button data-quickpay="${s.id}">Quick Pay</button>
-			<button data-print="${s.id}">Print Slip</button>
-			<button data-notify="${s.id}">WhatsApp</button>`;
-		tr.appendChild(actions);
-		tbody.appendChild(tr);
-	}
+	let afterId = null;
+	do{
+		const params = new URLSearchParams({ limit: String(STUDENT_PAGE_SIZE) });
+		if(currentClassFilter) params.set('class', currentClassFilter);
+		if(afterId!==null) params.set('after_id', afterId);
+		const res = await fetch('/api/students?'+params.toString());
+		const students = await res.json();
+		if(token!==studentsLoadToken) return;
+		const frag = document.createDocumentFragment();
+		for(const s of students){ frag.appendChild(renderStudentRow(s)); }
+		tbody.appendChild(frag);
+		afterId = res.headers.get('X-Next-After-Id');
+	}while(afterId);
 }
 
 function openPaymentsDialog(student){
@@ -143,10 +207,9 @@ function fillForm(s){
 }
 
 async function getStudent(id){
-	const qs = currentClassFilter ? `?class=${encodeURIComponent(currentClassFilter)}` : '';
-	const res = await fetch('/api/students'+qs);
-	const all = await res.json();
-	return all.find(x=>x.id===id);
+	const res = await fetch(`/api/students/${id}`);
+	if(!res.ok) return null;
+	return res.json();
 }
 
 function attachTableActions(){
@@ -222,6 +285,11 @@ function attachForm(){
 	});
 	$('#reset').addEventListener('click', (e)=>{ e.preventDefault(); resetForm(); });
 	$('#refresh').addEventListener('click', async ()=>{ await Promise.all([loadStudents(), loadClasses()]); });
+	$('#student-search').addEventListener('input', ()=>{
+		// Debounced: one request once typing pauses, not one per key.
+		clearTimeout(searchTimer);
+		searchTimer = setTimeout(loadStudents, SEARCH_DELAY_MS);
+	});
 }
 
 function openPrintDialog(studentId){
@@ -249,6 +317,8 @@ function openPrintDialog(studentId){
 }
 
 function setup(){
+	$('#print-month').innerHTML = months.map((m,i)=>`<option value="${i}">${m}</option>`).join('');
+	$('#print-month').value = String(new Date().getMonth());
 	attachForm();
 	attachTableActions();
 	Promise.all([loadStudents(), loadClasses()]);
@@ -0,0 +1,220 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import migrations
+import student_search
+
+# Database setup
+DB_PATH = 'school_fee.db'
+
+class ConnectionManager:
+    """Hands out one persistent sqlite3 connection per thread.
+
+    Connections are opened in WAL mode so the Kivy UI thread and the sync
+    server thread can read while the other writes, and `busy_timeout` makes a
+    writer wait for the lock instead of failing with "database is locked".
+    """
+
+    def __init__(self, path, busy_timeout_ms=5000, cached_statements=256):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # One writer at a time inside this process; readers never take it and
+        # keep reading their own WAL snapshot while a write is in progress.
+        self.write_lock = threading.RLock()
+        self._connections = []
+        self._generation = 0
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.generation != self._generation:
+            with self._lock:
+                conn = self._open()
+                self._connections.append(conn)
+                self._local.generation = self._generation
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Yield this thread's connection for writing; commit on success, roll back on error."""
+        conn = self.connection()
+        with self.write_lock, conn:
+            yield conn
+
+    @contextmanager
+    def write_transaction(self):
+        """Like `transaction()`, but takes the write lock up front with BEGIN IMMEDIATE.
+
+        Use it for read-then-write sequences so another writer cannot slip in
+        between the reads and the first write.
+        """
+        conn = self.connection()
+        with self.write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def checkpoint(self):
+        """Fold the WAL back into the main file so the file on disk is complete."""
+        self.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close_all(self):
+        """Close every pooled connection, e.g. before the database file is replaced.
+
+        Threads transparently reconnect on their next call to `connection()`.
+        """
+        with self._lock:
+            self._close_locked()
+
+    def _close_locked(self):
+        connections, self._connections = self._connections, []
+        self._generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+
+    def set_path(self, path):
+        """Point the manager at another database file (e.g. from a command-line option)."""
+        with self._lock:
+            self._close_locked()
+            self.path = path
+
+    def backup_to(self, path):
+        """Write a transactionally consistent copy of the database to `path` (online backup API)."""
+        dest = sqlite3.connect(path)
+        try:
+            self.connection().backup(dest)
+        finally:
+            dest.close()
+
+    def install_file(self, path):
+        """Atomically replace the database file with the complete SQLite file at `path`.
+
+        `path` must be on the same filesystem. Open connections are closed and the
+        old WAL/shared-memory files removed first, otherwise SQLite would replay
+        stale WAL frames onto the new file.
+        """
+        # Hold both locks throughout so no thread writes to or reopens the old file mid-swap.
+        with self.write_lock, self._lock:
+            self._close_locked()
+            for suffix in ('-wal', '-shm'):
+                try:
+                    os.remove(self.path + suffix)
+                except FileNotFoundError:
+                    pass
+            os.replace(path, self.path)
+
+pool = ConnectionManager(DB_PATH)
+
+def init_db():
+    migrations.migrate(pool.connection())
+
+# Models
+class Student:
+    def __init__(self, id, class_name, student_name, father_name, parent_phone, monthly_fee):
+        self.id = id
+        self.class_name = class_name
+        self.student_name = student_name
+        self.father_name = father_name
+        self.parent_phone = parent_phone
+        self.monthly_fee = monthly_fee
+
+class Payment:
+    def __init__(self, id, student_id, month_index, amount, paid_on):
+        self.id = id
+        self.student_id = student_id
+        self.month_index = month_index
+        self.amount = amount
+        self.paid_on = paid_on
+
+STUDENT_COLUMNS = "id, class_name, student_name, father_name, parent_phone, monthly_fee"
+PAYMENT_COLUMNS = "id, student_id, month_index, amount, paid_on"
+
+# DB functions
+def get_students(class_filter=None):
+    conn = pool.connection()
+    if class_filter:
+        rows = conn.execute(f"SELECT {STUDENT_COLUMNS} FROM student WHERE class_name = ?", (class_filter,)).fetchall()
+    else:
+        rows = conn.execute(f"SELECT {STUDENT_COLUMNS} FROM student").fetchall()
+    return [Student(*row) for row in rows]
+
+def search(query, class_filter=None, limit=student_search.DEFAULT_LIMIT):
+    """Students matching `query` by name, father's name or phone, best match first."""
+    rows = student_search.search_students(pool.connection(), query, class_filter, limit)
+    return [Student(*row) for row in rows]
+
+def get_student(id):
+    row = pool.connection().execute(f"SELECT {STUDENT_COLUMNS} FROM student WHERE id = ?", (id,)).fetchone()
+    return Student(*row) if row else None
+
+def add_student(class_name, student_name, father_name, parent_phone, monthly_fee):
+    with pool.transaction() as conn:
+        c = conn.execute("INSERT INTO student (class_name, student_name, father_name, parent_phone, monthly_fee) VALUES (?, ?, ?, ?, ?)",
+                         (class_name, student_name, father_name, parent_phone, monthly_fee))
+    return c.lastrowid
+
+def update_student(id, class_name, student_name, father_name, parent_phone, monthly_fee):
+    with pool.transaction() as conn:
+        conn.execute("UPDATE student SET class_name=?, student_name=?, father_name=?, parent_phone=?, monthly_fee=? WHERE id=?",
+                     (class_name, student_name, father_name, parent_phone, monthly_fee, id))
+
+def delete_student(id):
+    # Payments go with the student through ON DELETE CASCADE.
+    with pool.transaction() as conn:
+        conn.execute("DELETE FROM student WHERE id=?", (id,))
+
+def get_payments(student_id):
+    """The open academic year's payments of one student, by month_index."""
+    rows = pool.connection().execute(
+        f"SELECT {PAYMENT_COLUMNS} FROM payment WHERE student_id=? AND year={migrations.CURRENT_YEAR}", (student_id,)
+    ).fetchall()
+    payments = {}
+    for row in rows:
+        p = Payment(*row)
+        payments[p.month_index] = p
+    return payments
+
+# Payments are booked into the open academic year.
+UPSERT_PAYMENT_SQL = (
+    f"INSERT INTO payment (student_id, year, month_index, amount, paid_on) "
+    f"VALUES (?, {migrations.CURRENT_YEAR}, ?, ?, datetime('now')) "
+    "ON CONFLICT (student_id, year, month_index) DO UPDATE SET amount=excluded.amount, paid_on=excluded.paid_on"
+)
+
+def set_payment(student_id, month_index, amount):
+    set_payments(student_id, {month_index: amount})
+
+def set_payments(student_id, amounts):
+    """Save a {month_index: amount} mapping for one student in a single transaction."""
+    with pool.transaction() as conn:
+        conn.executemany(UPSERT_PAYMENT_SQL, [(student_id, m, a) for m, a in amounts.items()])
+
+def get_classes():
+    rows = pool.connection().execute("SELECT DISTINCT class_name FROM student ORDER BY class_name").fetchall()
+    return [row[0] for row in rows]
@@ -0,0 +1,105 @@
+"""Ranked student lookup by name, father's name or parent phone number.
+
+Reads the `student_search` FTS5 index that triggers keep in step with
+`student` (see `migrations.add_student_search`). Every word of the query
+must match. With the trigram tokenizer a word matches anywhere inside a
+name, so "han" finds "Farhan"; with the word tokenizer it matches the start
+of a word. A query made only of digits and phone punctuation is looked up
+as one partial phone number, so "300 1234" finds "+92 300-1234567". Without
+trigrams, numbers are matched anywhere in the phone through LIKE, so the
+last digits of a number still find it.
+Words shorter than three characters cannot use trigrams; they match the
+start of a word through LIKE, as does everything when the database has no
+index.
+
+Results come best first: names starting with the query, then names with a
+word starting with it, then names containing it, then matches on the
+father's name or phone; ties go by name.
+
+These functions take a plain sqlite3 connection, like `years`.
+"""
+import re
+
+from migrations import PHONE_DIGITS
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+COLUMNS = "s.id, s.class_name, s.student_name, s.father_name, s.parent_phone, s.monthly_fee"
+PHONE_QUERY = re.compile(r'[\d\s()+-]*\d[\d\s()+-]*')
+
+
+def index_mode(conn):
+    """'trigram', 'words', or None when the database has no search index."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'student_search'").fetchone()
+    if row is None:
+        return None
+    return 'trigram' if 'trigram' in row[0] else 'words'
+
+
+def query_terms(query):
+    """Split `query` into search words; a phone-like query becomes a single run of digits."""
+    query = query.strip()
+    if PHONE_QUERY.fullmatch(query):
+        return [re.sub(r'\D', '', query)]
+    return [term for term in query.split() if any(ch.isalnum() for ch in term)]
+
+
+def _like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _word_prefix(column, i):
+    return f"({column} LIKE :p{i} ESCAPE '\\' OR {column} LIKE :w{i} ESCAPE '\\')"
+
+
+def search_students(conn, query, class_name=None, limit=DEFAULT_LIMIT):
+    """Student rows (id, class_name, student_name, father_name, parent_phone, monthly_fee) matching `query`."""
+    terms = query_terms(query)
+    if not terms:
+        return []
+    limit = max(1, min(limit, MAX_LIMIT))
+    mode = index_mode(conn)
+    if mode == 'trigram':
+        indexed = [t for t in terms if len(t) >= 3]
+        match = ' '.join(_phrase(t) for t in indexed)
+    elif mode == 'words':
+        # Word tokens only match a phone from its first digit; numbers are scanned instead.
+        indexed = [t for t in terms if not t.isdigit()]
+        match = ' '.join(_phrase(t) + '*' for t in indexed)
+    else:
+        indexed = []
+    scanned = [t for t in terms if t not in indexed]
+
+    conditions, params = [], {'limit': limit}
+    if indexed:
+        # Ranking reads names from `student`: cheaper than reading them back out of the index.
+        conditions.append("s.id IN (SELECT rowid FROM student_search WHERE student_search MATCH :match)")
+        params['match'] = match
+    phone = PHONE_DIGITS.format('s.parent_phone')
+    for i, term in enumerate(scanned):
+        params[f'p{i}'], params[f'w{i}'] = _like(term) + '%', '% ' + _like(term) + '%'
+        names = f"{_word_prefix('s.student_name', i)} OR {_word_prefix('s.father_name', i)}"
+        if term.isdigit():
+            # Short numbers under trigrams keep to the start of the phone; otherwise match anywhere.
+            params[f'd{i}'] = ('' if mode == 'trigram' else '%') + _like(term) + '%'
+            conditions.append(f"({names} OR {phone} LIKE :d{i} ESCAPE '\\')")
+        else:
+            conditions.append(f"({names})")
+    if class_name:
+        conditions.append("s.class_name = :class_name")
+        params['class_name'] = class_name
+    sql = f"SELECT {COLUMNS} FROM student s WHERE " + " AND ".join(conditions)
+    if indexed:
+        first = _like(indexed[0])
+        params.update(prefix=first + '%', word='% ' + first + '%', inside='%' + first + '%')
+        sql += (" ORDER BY CASE WHEN s.student_name LIKE :prefix ESCAPE '\\' THEN 0"
+                " WHEN s.student_name LIKE :word ESCAPE '\\' THEN 1"
+                " WHEN s.student_name LIKE :inside ESCAPE '\\' THEN 2 ELSE 3 END,")
+    else:
+        sql += " ORDER BY"  # name order alone lets SQLite walk the name index and stop at the limit
+    sql += " s.student_name, s.id LIMIT :limit"
+    return conn.execute(sql, params).fetchall()
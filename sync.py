@@ -0,0 +1,520 @@
+"""LAN sync between devices sharing the school fee database.
+
+Devices exchange only the rows that changed since the last sync. The
+change-tracking columns and tombstones come from migration 8 (see
+`migrations.add_change_tracking`). Concurrent edits of the same row are
+resolved by last-writer-wins on (updated_at, origin), which every device
+evaluates the same way.
+
+Protocol (JSON over HTTP):
+    GET  /changes?since=<version>[&exclude_origin=<device>]  -> change set
+    POST /changes  (body: change set)                         -> {"applied", "version"}
+    GET  /snapshot[?sha256=<id>]  -> gzip snapshot, resumable with Range/If-Range
+    POST /snapshot                -> replace this database (X-Snapshot-Sha256 header)
+    GET  /status                  -> hub version and per-client sync status
+
+Clients identify themselves with an `X-Device-Id` header.
+
+A change set is {"device_id", "version", "students", "payments", "tombstones",
+"closed_years"}. Students are addressed by `uid` and payments by
+(student_uid, year, month_index), because integer ids differ between
+devices. Payments from peers that predate academic years carry no year and
+are booked into the open year. A device that receives a closed year it still
+has open closes it too (see `years.close_year`).
+"""
+import gzip
+import json
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import snapshot
+import years
+from storage import pool
+
+SYNC_PORT = 8080
+STUDENT_SYNC_FIELDS = ('class_name', 'student_name', 'father_name', 'parent_phone', 'monthly_fee')
+
+
+def device_id(conn):
+    return conn.execute("SELECT value FROM sync_meta WHERE key = 'device_id'").fetchone()[0]
+
+
+def current_version(conn):
+    return conn.execute("SELECT value FROM sync_meta WHERE key = 'clock'").fetchone()[0]
+
+
+def changes_since(conn, since, exclude_origin=None):
+    """Collect rows and tombstones whose local version is greater than `since`.
+
+    Rows stamped with `exclude_origin` are left out, so a peer is not sent back
+    the edits it made itself.
+    """
+    # Versions are handed out in commit order, so an upper bound read first
+    # keeps the set consistent with the returned version without a read transaction.
+    upper = current_version(conn)
+    bounds = (since, upper, exclude_origin)
+    students = [
+        dict(zip(('uid',) + STUDENT_SYNC_FIELDS + ('updated_at', 'origin'), row))
+        for row in conn.execute(
+            "SELECT uid, class_name, student_name, father_name, parent_phone, monthly_fee, updated_at, origin "
+            "FROM student WHERE version > ? AND version <= ? AND origin IS NOT ?", bounds
+        )
+    ]
+    payments = [
+        dict(zip(('student_uid', 'year', 'month_index', 'amount', 'paid_on', 'updated_at', 'origin'), row))
+        for row in conn.execute(
+            "SELECT s.uid, p.year, p.month_index, p.amount, p.paid_on, p.updated_at, p.origin "
+            "FROM payment p JOIN student s ON s.id = p.student_id "
+            "WHERE p.version > ? AND p.version <= ? AND p.origin IS NOT ?", bounds
+        )
+    ]
+    tombstones = [
+        dict(zip(('entity', 'uid', 'year', 'month_index', 'updated_at', 'origin'), row))
+        for row in conn.execute(
+            "SELECT entity, uid, year, month_index, updated_at, origin FROM sync_tombstone "
+            "WHERE version > ? AND version <= ? AND origin IS NOT ?", bounds
+        )
+    ]
+    return {
+        'device_id': device_id(conn),
+        'version': upper,
+        'students': students,
+        'payments': payments,
+        'tombstones': tombstones,
+        'closed_years': years.closed_years(conn),
+    }
+
+
+def _newer(incoming, stamp):
+    """True when `incoming` wins last-writer-wins against a local (updated_at, origin)."""
+    return (incoming['updated_at'], incoming['origin'] or '') > (stamp[0] or 0, stamp[1] or '')
+
+
+def _tombstone(conn, entity, uid, year=-1, month_index=-1):
+    return conn.execute(
+        "SELECT updated_at, origin FROM sync_tombstone WHERE entity = ? AND uid = ? AND year = ? AND month_index = ?",
+        (entity, uid, year, month_index)
+    ).fetchone()
+
+
+def _payment_year(conn, change):
+    return change.get('year') or years.current_year(conn)
+
+
+def _apply_student(conn, s):
+    tomb = _tombstone(conn, 'student', s['uid'])
+    if tomb and not _newer(s, tomb):
+        return False
+    local = conn.execute("SELECT id, updated_at, origin FROM student WHERE uid = ?", (s['uid'],)).fetchone()
+    values = [s[f] for f in STUDENT_SYNC_FIELDS] + [s['updated_at'], s['origin']]
+    if local is None:
+        conn.execute(
+            "INSERT INTO student (uid, class_name, student_name, father_name, parent_phone, monthly_fee, updated_at, origin) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [s['uid']] + values
+        )
+    elif _newer(s, local[1:]):
+        conn.execute(
+            "UPDATE student SET class_name = ?, student_name = ?, father_name = ?, parent_phone = ?, "
+            "monthly_fee = ?, updated_at = ?, origin = ? WHERE id = ?", values + [local[0]]
+        )
+    else:
+        return False
+    if tomb:
+        conn.execute("DELETE FROM sync_tombstone WHERE entity = 'student' AND uid = ?", (s['uid'],))
+    return True
+
+
+def _apply_payment(conn, p, year):
+    if years.year_status(conn, year) == 'archived':
+        return False  # archived years are read-only here
+    tomb = _tombstone(conn, 'payment', p['student_uid'], year, p['month_index'])
+    if tomb and not _newer(p, tomb):
+        return False
+    student = conn.execute("SELECT id FROM student WHERE uid = ?", (p['student_uid'],)).fetchone()
+    if student is None:
+        return False  # the student was deleted here and that delete won
+    local = conn.execute(
+        "SELECT id, updated_at, origin FROM payment WHERE student_id = ? AND year = ? AND month_index = ?",
+        (student[0], year, p['month_index'])
+    ).fetchone()
+    values = [p['amount'], p['paid_on'], p['updated_at'], p['origin']]
+    if local is None:
+        conn.execute(
+            "INSERT INTO payment (student_id, year, month_index, amount, paid_on, updated_at, origin) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", [student[0], year, p['month_index']] + values
+        )
+    elif _newer(p, local[1:]):
+        conn.execute(
+            "UPDATE payment SET amount = ?, paid_on = ?, updated_at = ?, origin = ? WHERE id = ?",
+            values + [local[0]]
+        )
+    else:
+        return False
+    if tomb:
+        conn.execute(
+            "DELETE FROM sync_tombstone WHERE entity = 'payment' AND uid = ? AND year = ? AND month_index = ?",
+            (p['student_uid'], year, p['month_index'])
+        )
+    return True
+
+
+def _apply_tombstone(conn, t, year):
+    month_index = t.get('month_index', -1)
+    if year != -1 and years.year_status(conn, year) == 'archived':
+        return False
+    existing = _tombstone(conn, t['entity'], t['uid'], year, month_index)
+    if existing and not _newer(t, existing):
+        return False
+    if t['entity'] == 'student':
+        local = conn.execute("SELECT id, updated_at, origin FROM student WHERE uid = ?", (t['uid'],)).fetchone()
+        delete_sql = "DELETE FROM student WHERE id = ?"
+    else:
+        local = conn.execute(
+            "SELECT p.id, p.updated_at, p.origin FROM payment p JOIN student s ON s.id = p.student_id "
+            "WHERE s.uid = ? AND p.year = ? AND p.month_index = ?", (t['uid'], year, month_index)
+        ).fetchone()
+        delete_sql = "DELETE FROM payment WHERE id = ?"
+    if local is not None:
+        if not _newer(t, local[1:]):
+            return False  # edited here after it was deleted there
+        conn.execute(delete_sql, (local[0],))
+    # Keep the remote stamp (the delete trigger wrote a local one) and give the
+    # tombstone a fresh local version so it is forwarded to other peers.
+    conn.execute("UPDATE sync_meta SET value = value + 1 WHERE key = 'clock'")
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_tombstone (entity, uid, year, month_index, version, updated_at, origin) "
+        "VALUES (?, ?, ?, ?, (SELECT value FROM sync_meta WHERE key = 'clock'), ?, ?)",
+        (t['entity'], t['uid'], year, month_index, t['updated_at'], t['origin'])
+    )
+    return True
+
+
+def apply_changes(conn, changes):
+    """Merge a change set into the database behind `conn`.
+
+    The caller owns the transaction (use `pool.write_transaction()`).
+    Returns the number of rows and tombstones that won and were applied.
+    """
+    applied = 0
+    changed_years = set()
+    for s in changes.get('students', []):
+        applied += _apply_student(conn, s)
+    for p in changes.get('payments', []):
+        year = _payment_year(conn, p)
+        if _apply_payment(conn, p, year):
+            applied += 1
+            changed_years.add(year)
+    for t in changes.get('tombstones', []):
+        year = _payment_year(conn, t) if t['entity'] == 'payment' else -1
+        if _apply_tombstone(conn, t, year):
+            applied += 1
+            changed_years.add(year)
+    remote_closed = set(changes.get('closed_years', []))
+    while years.current_year(conn) in remote_closed:
+        years.close_year(conn)
+    # Late payments for a closed year change the balances brought forward from it.
+    closed = set(years.closed_years(conn)) & changed_years
+    if closed:
+        years.recarry_from(conn, min(closed))
+    return applied
+
+
+def has_changes(changes):
+    return bool(changes['students'] or changes['payments'] or changes['tombstones'])
+
+
+class ClientRegistry:
+    """Per-client sync status for `GET /status` on the hub.
+
+    Clients are keyed by the `X-Device-Id` header they send (their IP address
+    for older clients without it).
+    """
+
+    TOTALS = ('rows_received', 'rows_sent', 'bytes_sent')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def begin(self, client, address, action):
+        with self._lock:
+            entry = self._clients.setdefault(client, {
+                'client': client, 'requests': 0, 'in_flight': 0, 'errors': 0,
+                'rows_received': 0, 'rows_sent': 0, 'bytes_sent': 0, 'last_error': None,
+            })
+            entry.update(address=address, last_action=action, last_seen=time.time())
+            entry['in_flight'] += 1
+            entry['requests'] += 1
+
+    def finish(self, client, error=None, **counters):
+        with self._lock:
+            entry = self._clients[client]
+            entry['in_flight'] -= 1
+            entry['last_seen'] = time.time()
+            entry['last_status'] = 'error' if error else 'ok'
+            if error:
+                entry['errors'] += 1
+                entry['last_error'] = error
+            for key, value in counters.items():
+                if key in self.TOTALS:
+                    entry[key] += value
+                else:
+                    entry[key] = value
+
+    def status(self):
+        with self._lock:
+            return [dict(entry) for entry in self._clients.values()]
+
+
+clients = ClientRegistry()
+
+
+class SyncHandler(BaseHTTPRequestHandler):
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def do_GET(self):
+        self.dispatch({
+            '/changes': self.get_changes,
+            '/snapshot': self.get_snapshot,
+            '/db': self.get_db,
+            '/status': self.get_status,
+        })
+
+    def do_POST(self):
+        self.dispatch({
+            '/changes': self.post_changes,
+            '/snapshot': self.post_upload,
+            '/db': self.post_upload,
+        })
+
+    def dispatch(self, routes):
+        url = urllib.parse.urlsplit(self.path)
+        handler = routes.get(url.path)
+        if handler is None:
+            self.send_json({'error': 'not found'}, 404)
+            return
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == '/status':
+            handler(url.path, params)
+            return
+        client = self.headers.get('X-Device-Id') or self.client_address[0]
+        clients.begin(client, self.client_address[0], f'{self.command} {url.path}')
+        try:
+            counters = handler(url.path, params) or {}
+        except Exception as e:
+            clients.finish(client, error=f'{type(e).__name__}: {e}')
+            raise
+        clients.finish(client, error=counters.pop('error', None), **counters)
+
+    def get_status(self, path, params):
+        conn = pool.connection()
+        self.send_json({
+            'device_id': device_id(conn),
+            'version': current_version(conn),
+            'clients': clients.status(),
+        })
+
+    def get_changes(self, path, params):
+        try:
+            since = int(params.get('since', ['0'])[0])
+        except ValueError:
+            self.send_json({'error': 'since must be an integer'}, 400)
+            return {'error': 'bad since'}
+        exclude_origin = params.get('exclude_origin', [None])[0]
+        changes = changes_since(pool.connection(), since, exclude_origin)
+        sent = self.send_json(changes)
+        rows = len(changes['students']) + len(changes['payments']) + len(changes['tombstones'])
+        return {'rows_sent': rows, 'bytes_sent': sent, 'pulled_version': changes['version']}
+
+    def post_changes(self, path, params):
+        content_length = int(self.headers['Content-Length'])
+        try:
+            changes = json.loads(self.rfile.read(content_length))
+        except ValueError:
+            self.send_json({'error': 'invalid JSON'}, 400)
+            return {'error': 'invalid JSON'}
+        with pool.write_transaction() as conn:
+            applied = apply_changes(conn, changes)
+        self.send_json({'applied': applied, 'version': current_version(pool.connection())})
+        return {'rows_received': applied}
+
+    def get_snapshot(self, path, params):
+        # Serve the snapshot a resuming client asks for while it is still cached.
+        sha256 = params.get('sha256', [None])[0]
+        snap = (sha256 and snapshot.find_snapshot(sha256)) or snapshot.current_snapshot()
+        etag = f'"{snap.sha256}"'
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        byte_range = None
+        if range_header and (not if_range or if_range == etag):
+            byte_range = snapshot.parse_range(range_header, snap.size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{snap.size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return {'error': 'unsatisfiable range'}
+        start, end = byte_range or (0, snap.size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Content-Type', 'application/gzip')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('X-Snapshot-Sha256', snap.sha256)
+        self.send_header('X-Snapshot-Size', str(snap.size))
+        self.send_header('X-Snapshot-Version', str(snap.version))
+        self.send_header('X-Snapshot-Device', device_id(pool.connection()))
+        if byte_range:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{snap.size}')
+        self.end_headers()
+        for chunk in snapshot.iter_file(snap.path, start, end):
+            self.wfile.write(chunk)
+        return {'bytes_sent': end - start + 1, 'pulled_version': snap.version}
+
+    def get_db(self, path, params):
+        # Legacy full download for older clients: the same consistent copy, uncompressed.
+        snap = snapshot.current_snapshot()
+        self.send_response(200)
+        self.send_header('Content-type', 'application/octet-stream')
+        self.end_headers()
+        sent = 0
+        with gzip.open(snap.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(snapshot.CHUNK_SIZE), b''):
+                self.wfile.write(chunk)
+                sent += len(chunk)
+        return {'bytes_sent': sent}
+
+    def post_upload(self, path, params):
+        content_length = int(self.headers['Content-Length'])
+        try:
+            if path == '/snapshot':
+                version = snapshot.receive_snapshot(
+                    self.rfile, content_length, self.headers.get('X-Snapshot-Sha256'))
+            else:
+                version = snapshot.receive_database(self.rfile, content_length)
+        except (snapshot.SnapshotError, sqlite3.DatabaseError) as e:
+            self.send_json({'error': str(e)}, 400)
+            return {'error': str(e)}
+        self.send_json({'status': 'ok', 'version': version})
+        return {}
+
+
+class SyncHub(ThreadingHTTPServer):
+    """Serves many devices at once, one thread per connection.
+
+    Reads run concurrently on per-thread WAL connections; every write goes
+    through `pool.write_lock`, so merges and snapshot installs never interleave.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(host='0.0.0.0', port=SYNC_PORT):
+    """Create a sync hub bound to host:port; call `serve_forever()` on the result."""
+    return SyncHub((host, port), SyncHandler)
+
+
+def _request_json(url, payload=None, timeout=30):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    headers = {'Content-Type': 'application/json', 'X-Device-Id': device_id(pool.connection())}
+    req = urllib.request.Request(url, data=data, headers=headers)
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def sync_with(host, port=SYNC_PORT, timeout=30, progress=None):
+    """Push local changes to the peer at host:port, then pull and merge its changes.
+
+    `progress(stage)` is called before the 'push', 'pull' and 'apply' stages;
+    raising from it abandons the sync before anything is merged locally.
+    Returns {'pushed': <rows sent>, 'pulled': <rows applied locally>}.
+    """
+    progress = progress or (lambda stage: None)
+    base = f'http://{host}:{port}'
+    peer = f'{host}:{port}'
+    conn = pool.connection()
+    me = device_id(conn)
+    row = conn.execute(
+        "SELECT peer_device_id, pulled_version, pushed_version FROM sync_peer WHERE peer = ?", (peer,)
+    ).fetchone()
+    peer_device, pulled, pushed = row or (None, 0, 0)
+
+    outgoing = changes_since(conn, pushed, exclude_origin=peer_device)
+    sent = len(outgoing['students']) + len(outgoing['payments']) + len(outgoing['tombstones'])
+    progress('push')
+    if has_changes(outgoing):
+        _request_json(f'{base}/changes', outgoing, timeout)
+    pushed = outgoing['version']
+
+    progress('pull')
+    query = urllib.parse.urlencode({'since': pulled, 'exclude_origin': me})
+    incoming = _request_json(f'{base}/changes?{query}', timeout=timeout)
+    if peer_device is not None and incoming['device_id'] != peer_device:
+        # A different database now answers at this address; its versions are unrelated to ours.
+        query = urllib.parse.urlencode({'since': 0, 'exclude_origin': me})
+        incoming = _request_json(f'{base}/changes?{query}', timeout=timeout)
+
+    progress('apply')
+    with pool.write_transaction() as conn:
+        before = current_version(conn)
+        applied = apply_changes(conn, incoming)
+        after = current_version(conn)
+        # Versions created by this merge are the peer's own rows; skip them on the
+        # next push unless local edits are already queued behind them.
+        if pushed == before:
+            pushed = after
+        conn.execute(
+            "INSERT OR REPLACE INTO sync_peer (peer, peer_device_id, pulled_version, pushed_version) "
+            "VALUES (?, ?, ?, ?)", (peer, incoming['device_id'], incoming['version'], pushed)
+        )
+    return {'pushed': sent, 'pulled': applied}
+
+
+def main(argv=None):
+    import argparse
+    import signal
+    from storage import init_db
+
+    parser = argparse.ArgumentParser(description='Run a headless LAN sync hub.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve_cmd = sub.add_parser('serve', help='serve the database to devices on the network')
+    serve_cmd.add_argument('--host', default='0.0.0.0')
+    serve_cmd.add_argument('--port', type=int, default=SYNC_PORT)
+    serve_cmd.add_argument('--db', default=pool.path, help='database file (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    pool.set_path(args.db)
+    init_db()
+    server = serve(args.host, args.port)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f'Sync hub for {args.db} listening on {args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Stop accepting connections; the write lock waits out an in-flight merge or
+        # install, then the checkpoint leaves a complete file behind.
+        server.server_close()
+        with pool.write_lock:
+            pool.checkpoint()
+            pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Background work for the Kivy app.
+
+Database and network calls run on worker threads so the UI thread keeps
+drawing; results come back to the UI thread through `Clock.schedule_once`,
+so callbacks may touch widgets freely.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.clock import Clock
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Task:
+    """Handle for one submitted call.
+
+    The UI thread calls `cancel()`; the worker calls `progress(...)` (or
+    `check()`), which raises Cancelled once cancellation was requested, so
+    long jobs stop at their next checkpoint.
+    """
+
+    def __init__(self, on_progress=None):
+        self._cancelled = threading.Event()
+        self._on_progress = on_progress
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise Cancelled()
+
+    def progress(self, *args):
+        self.check()
+        if self._on_progress is not None:
+            Clock.schedule_once(lambda dt: self._on_progress(*args))
+
+
+class TaskExecutor:
+    """Runs calls on `workers` threads, in submission order when there is one worker.
+
+    `submit` and all callbacks run on the UI thread. `on_busy(pending)` is
+    called whenever the number of unfinished tasks changes, for loading
+    indicators; `on_error(exception)` handles failures of tasks submitted
+    without their own.
+    """
+
+    def __init__(self, workers=1, name='task', on_busy=None, on_error=None):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.pending = 0
+        self.on_busy = on_busy
+        self.on_error = on_error
+
+    def submit(self, fn, *args, on_done=None, on_error=None, on_progress=None, with_task=False):
+        """Run `fn(*args)` in the background and return its Task.
+
+        With `with_task=True` the Task is passed as the keyword argument `task`.
+        `on_done(result)` or `on_error(exception)` follows on the UI thread; a
+        cancelled task calls neither.
+        """
+        task = Task(on_progress)
+        on_error = on_error or self.on_error
+
+        def run():
+            callback, value = None, None
+            try:
+                task.check()
+                result = fn(*args, task=task) if with_task else fn(*args)
+            except Cancelled:
+                pass
+            except Exception as e:
+                callback, value = on_error, e
+            else:
+                if not task.cancelled:
+                    callback, value = on_done, result
+            Clock.schedule_once(lambda dt: self._finish(callback, value))
+
+        self._set_pending(self.pending + 1)
+        self._pool.submit(run)
+        return task
+
+    def _finish(self, callback, value):
+        self._set_pending(self.pending - 1)
+        if callback is not None:
+            callback(value)
+
+    def _set_pending(self, pending):
+        self.pending = pending
+        if self.on_busy is not None:
+            self.on_busy(pending)
@@ -0,0 +1,46 @@
+import importlib
+import os
+import shutil
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The app module, serving a copy of school_fee.db so the real file is never written."""
+    db_path = tmp_path_factory.mktemp('db') / 'school_fee.db'
+    shutil.copy(os.path.join(ROOT, 'school_fee.db'), db_path)
+    os.environ['SCHOOL_FEE_DB'] = str(db_path)
+    os.environ.setdefault('NOTIFY_PROVIDER', 'fake')
+    module = importlib.import_module('app')
+    yield module
+    module.dispatcher.stop(timeout=5)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def add_student(client):
+    def add(class_name, student_name, monthly_fee=1000, parent_phone='+923001234567'):
+        response = client.post('/api/students', json={
+            'class_name': class_name, 'student_name': student_name, 'father_name': 'Father',
+            'parent_phone': parent_phone, 'monthly_fee': monthly_fee,
+        })
+        assert response.status_code == 201
+        return response.get_json()['id']
+    return add
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """Make copies of school_fee.db, which still has the schema from before migrations."""
+    def copy(name='baseline.db'):
+        path = tmp_path / name
+        shutil.copy(os.path.join(ROOT, 'school_fee.db'), path)
+        return path
+    return copy
@@ -0,0 +1,13 @@
+def test_template_pages_are_served_from_memory(client):
+    headers = {'Accept-Encoding': 'gzip'}
+    response = client.get('/templates/print.html', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    revalidated = client.get('/templates/print.html', headers=dict(headers, **{'If-None-Match': response.headers['ETag']}))
+    assert revalidated.status_code == 304
+
+
+def test_jinja_templates_are_not_served(client):
+    assert client.get('/templates/print_class.html').status_code == 404
+    assert client.get('/templates/../app.py').status_code == 404
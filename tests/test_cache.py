@@ -0,0 +1,26 @@
+import datetime
+
+
+def fixed_today(app_module, monkeypatch, day):
+    class FixedDate(datetime.date):
+        @classmethod
+        def today(cls):
+            return cls(day.year, day.month, day.day)
+    monkeypatch.setattr(app_module, 'date', FixedDate)
+
+
+def test_cached_dues_follow_the_month(app_module, client, add_student, monkeypatch):
+    add_student('Cache 1', 'Nadia')
+    year = client.get('/api/classes/Cache 1/dues').get_json()['year']
+
+    def dues():
+        class_dues = client.get('/api/classes/Cache 1/dues').get_json()['total_due']
+        summary = {row['class_name']: row for row in client.get('/api/dues/summary').get_json()}
+        return class_dues, summary['Cache 1']['total_due']
+
+    fixed_today(app_module, monkeypatch, datetime.date(year, 2, 27))
+    assert dues() == (2000, 2000)
+    assert client.get('/api/dues/summary').headers['X-Cache'] == 'HIT'
+    # No writes in between: only the new month outdates the cached responses.
+    fixed_today(app_module, monkeypatch, datetime.date(year, 3, 1))
+    assert dues() == (3000, 3000)
@@ -0,0 +1,24 @@
+def pay_through(client, student_id, month, amount=1000):
+    for month_index in range(month + 1):
+        response = client.post(f'/api/students/{student_id}/payments',
+                               json={'month_index': month_index, 'amount': amount})
+        assert response.status_code == 200
+
+
+def test_class_dues_count_only_months_so_far(app_module, client, add_student):
+    paid_up = add_student('Dues 1', 'Ahmed')
+    behind = add_student('Dues 1', 'Zara')
+    year = client.get('/api/classes/Dues 1/dues').get_json()['year']
+    month = app_module.elapsed_month(year)
+    pay_through(client, paid_up, month)
+
+    body = client.get('/api/classes/Dues 1/dues').get_json()
+    dues = {s['id']: s['due'] for s in body['students']}
+    assert dues == {paid_up: 0, behind: 1000 * (month + 1)}
+    assert body['total_due'] == 1000 * (month + 1)
+
+    defaulters = client.get('/api/classes/Dues 1/dues?defaulters=1').get_json()['students']
+    assert [s['id'] for s in defaulters] == [behind]
+
+    summary = {row['class_name']: row for row in client.get('/api/dues/summary').get_json()}
+    assert (summary['Dues 1']['total_due'], summary['Dues 1']['defaulters']) == (1000 * (month + 1), 1)
@@ -0,0 +1,48 @@
+import io
+
+import pytest
+
+import bulk_io
+
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class RequestBody(io.RawIOBase):
+    """A body that can only be read forward, like the WSGI input stream."""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._data.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_unseekable_body_is_spooled():
+    body = RequestBody(b'PK' + b'x' * (bulk_io.SPOOL_MAX_MEMORY + 1))
+    spooled = bulk_io._seekable(body)
+    assert spooled is not body and spooled.seekable()
+    assert spooled.read(2) == b'PK'
+
+
+def test_csv_raw_body_import(client):
+    body = b'class_name,student_name,father_name,monthly_fee\nImport 1,Asma,Tariq,900\nImport 1,,Tariq,900\n'
+    report = client.post('/api/import/students', data=body, content_type='text/csv').get_json()
+    assert (report['imported'], report['rejected'], report['errors'][0]['row']) == (1, 1, 3)
+
+
+def test_xlsx_raw_body_import(client):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['Class Name', 'Student Name', 'Father Name', 'Monthly Fee'])
+    sheet.append(['Import 2', 'Bushra', 'Naeem', 1100])
+    data = io.BytesIO()
+    workbook.save(data)
+    response = client.post('/api/import/students', data=data.getvalue(), content_type=XLSX)
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['imported'] == 1
@@ -0,0 +1,14 @@
+import re
+
+
+def sql_count(response):
+    return int(re.search(r'desc="(\d+) SQL"', response.headers['Server-Timing']).group(1))
+
+
+def test_raw_connection_statements_are_counted(client, add_student):
+    add_student('Metrics 1', 'Kamran')
+    # Beyond the session's BEGIN, both routes only run SQL on the sqlite3 connection.
+    search = client.get('/api/search?q=Kamran')
+    assert search.status_code == 200
+    assert sql_count(search) >= 3  # BEGIN, index lookup, search
+    assert sql_count(client.get('/api/years')) >= 2  # BEGIN, years
@@ -0,0 +1,48 @@
+import sqlite3
+from contextlib import closing
+
+import migrations
+
+
+def test_devices_set_up_separately_give_their_students_different_uids(baseline_db):
+    uids = []
+    for name in ('phone.db', 'hub.db'):
+        with closing(sqlite3.connect(baseline_db(name))) as conn:
+            migrations.migrate(conn)
+            device_id = conn.execute("SELECT value FROM sync_meta WHERE key = 'device_id'").fetchone()[0]
+            uid = conn.execute("SELECT uid FROM student WHERE id = 1").fetchone()[0]
+            assert uid == f'{device_id}-1'
+            uids.append(uid)
+    assert uids[0] != uids[1]
+
+
+def test_baseline_file_migrates_to_the_latest_schema_and_keeps_its_data(baseline_db):
+    path = baseline_db()
+    with closing(sqlite3.connect(path)) as conn:
+        students = conn.execute("SELECT id, class_name, student_name, monthly_fee FROM student ORDER BY id").fetchall()
+        payments = conn.execute("SELECT id, student_id, month_index, amount FROM payment ORDER BY id").fetchall()
+        assert 'year' not in {row[1] for row in conn.execute("PRAGMA table_info(payment)")}
+
+        conn.execute("PRAGMA foreign_keys=ON")
+        assert migrations.migrate(conn) == [version for version, *_ in migrations.MIGRATIONS]
+        assert migrations.current_version(conn) == len(migrations.MIGRATIONS)
+
+        assert conn.execute("SELECT id, class_name, student_name, monthly_fee FROM student ORDER BY id").fetchall() == students
+        assert conn.execute("SELECT id, student_id, month_index, amount FROM payment ORDER BY id").fetchall() == payments
+        year = conn.execute("SELECT year FROM academic_year WHERE closed_at IS NULL").fetchone()[0]
+        assert conn.execute("SELECT DISTINCT year FROM payment").fetchall() == [(year,)]
+        for student_id, _, _, fee in students:
+            paid = sum(amount for _, sid, _, amount in payments if sid == student_id)
+            assert conn.execute(
+                "SELECT opening_balance, total_expected, total_paid, carry_forward_due FROM student_balance "
+                "WHERE student_id = ? AND year = ?", (student_id, year)
+            ).fetchone() == (0, 12 * fee, paid, 12 * fee - paid)
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+        assert conn.execute("PRAGMA integrity_check").fetchone() == ('ok',)
+
+        conn.execute("DELETE FROM student WHERE id = 1")
+        assert conn.execute("SELECT COUNT(*) FROM payment WHERE student_id = 1").fetchone() == (0,)
+        conn.commit()
+
+    with closing(sqlite3.connect(path)) as conn:
+        assert migrations.migrate(conn) == []
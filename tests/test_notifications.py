@@ -0,0 +1,72 @@
+import sqlite3
+import time
+from contextlib import closing
+
+import pytest
+
+import notifications
+
+
+def test_notify_parent_is_queued(client, add_student):
+    student_id = add_student('Notify 1', 'Ali')
+    response = client.post(f'/api/notify/{student_id}', json={'message': 'Fee reminder'})
+    assert response.status_code == 202
+    assert response.get_json()['status'] == 'queued'
+
+
+def test_notify_parent_retry_is_not_queued_twice(client, add_student):
+    student_id = add_student('Notify 2', 'Sara')
+    headers = {'Idempotency-Key': f'test-retry-{student_id}'}
+    assert client.post(f'/api/notify/{student_id}', headers=headers).get_json()['status'] == 'queued'
+    response = client.post(f'/api/notify/{student_id}', headers=headers)
+    assert response.status_code == 202
+    assert response.get_json()['status'] == 'duplicate'
+
+
+def test_notify_class_queues_students_with_dues(client, add_student):
+    add_student('Notify 3', 'Bilal')
+    add_student('Notify 3', 'Hina', parent_phone='')
+    response = client.post('/api/notify/class/Notify 3', json={'campaign': 'test'})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert (body['queued'], body['skipped_no_phone']) == (1, 1)
+
+
+def test_notify_class_skips_students_paid_to_date(app_module, client, add_student):
+    paid_up = add_student('Notify 4', 'Usman')
+    behind = add_student('Notify 4', 'Ayesha')
+    with app_module.app.app_context():
+        month = app_module.elapsed_month(app_module.current_year())
+    for month_index in range(month + 1):
+        client.post(f'/api/students/{paid_up}/payments', json={'month_index': month_index, 'amount': 1000})
+
+    response = client.post('/api/notify/class/Notify 4', json={'campaign': 'test', 'message': '{student_name}: {due}'})
+    assert response.status_code == 202
+    assert response.get_json()['queued'] == 1
+    with closing(sqlite3.connect(app_module.DB_PATH)) as conn:
+        queued = conn.execute(
+            "SELECT student_id, message FROM notification_outbox WHERE batch = 'test:Notify 4'").fetchall()
+    assert queued == [(behind, f'Ayesha: {1000 * (month + 1)}')]
+
+
+def test_provider_without_send_cannot_be_created():
+    class Incomplete(notifications.Provider):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_create_app_sends_what_an_earlier_run_left(app_module):
+    app_module.dispatcher.stop(timeout=5)
+    with closing(sqlite3.connect(app_module.DB_PATH)) as conn, conn:
+        # One row never claimed, one leased by a worker that died.
+        conn.execute("INSERT INTO notification_outbox (idempotency_key, batch, to_phone, message) "
+                     "VALUES ('leftover-queued', 'leftover', '+923000000001', 'hello')")
+        conn.execute("INSERT INTO notification_outbox (idempotency_key, batch, to_phone, message, status, attempts) "
+                     "VALUES ('leftover-leased', 'leftover', '+923000000002', 'hello', 'sending', 1)")
+    app_module.create_app()
+    deadline = time.monotonic() + 10
+    while app_module.dispatcher.status('leftover')['counts']['sent'] < 2:
+        assert time.monotonic() < deadline, app_module.dispatcher.status('leftover')
+        time.sleep(0.05)
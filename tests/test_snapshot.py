@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import threading
+import urllib.request
+
+import pytest
+
+import migrations
+import snapshot
+import sync
+from storage import pool
+
+
+@pytest.fixture
+def hub_server(baseline_db):
+    """A sync hub serving a migrated baseline database on a free port."""
+    previous = pool.path
+    pool.set_path(str(baseline_db('hub.db')))
+    migrations.migrate(pool.connection())
+    server = sync.serve('127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+    pool.set_path(previous)
+
+
+def fetch(port, headers=None):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/snapshot', headers=headers or {})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status, response.headers, response.read()
+
+
+def test_snapshot_ranges(hub_server):
+    status, headers, body = fetch(hub_server)
+    assert status == 200 and int(headers['X-Snapshot-Size']) == len(body)
+    etag = headers['ETag']
+    status, headers, tail = fetch(hub_server, {'Range': 'bytes=100-', 'If-Range': etag})
+    assert status == 206 and tail == body[100:]
+    assert headers['Content-Range'] == f'bytes 100-{len(body) - 1}/{len(body)}'
+    # A partial copy of another snapshot gets the whole current one instead.
+    status, _, whole = fetch(hub_server, {'Range': 'bytes=100-', 'If-Range': '"other"'})
+    assert status == 200 and whole == body
+
+
+def test_snapshot_download_resumes_and_installs(hub_server):
+    _, headers, body = fetch(hub_server)
+    part_path = os.path.join(snapshot._snapshot_dir(), f'download-127.0.0.1-{hub_server}.part')
+    with open(part_path, 'wb') as f:
+        f.write(body[:100])
+    with open(part_path + '.json', 'w') as f:
+        json.dump({'sha256': headers['X-Snapshot-Sha256'], 'size': len(body),
+                   'device_id': headers['X-Snapshot-Device']}, f)
+    before = {c['client']: c['bytes_sent'] for c in sync.clients.status()}
+    me = snapshot._device_id()
+
+    version = snapshot.download_snapshot('127.0.0.1', hub_server)
+
+    sent = {c['client']: c['bytes_sent'] for c in sync.clients.status()}
+    assert sent[me] - before.get(me, 0) == len(body) - 100  # only the missing bytes
+    assert version == int(headers['X-Snapshot-Version'])
+    assert snapshot._device_id() != headers['X-Snapshot-Device']  # the copy takes its own id
+    assert not os.path.exists(part_path)
+
+
+def test_snapshot_with_wrong_checksum_is_not_installed(hub_server, tmp_path):
+    snap = snapshot.current_snapshot()
+    device = snapshot._device_id()
+    copy = tmp_path / 'download.db.gz'
+    shutil.copy(snap.path, copy)
+    with pytest.raises(snapshot.SnapshotError, match='checksum'):
+        snapshot.install_snapshot(str(copy), 'not-' + snap.sha256)
+    assert snapshot._device_id() == device
+    assert not copy.exists()
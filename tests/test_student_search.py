@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+import migrations
+import student_search
+
+STUDENTS = [
+    ('Class 1', 'Farhan Ali', 'Ali Raza', '+92 300-1234567'),
+    ('Class 1', 'Hina Khan', 'Imran Khan', '0321 7654321'),
+    ('Class 2', 'Ali Hamza', 'Hamza Sr', '0333-5550000'),
+]
+
+
+def _drop_index(conn):
+    for trigger in ('trg_search_student_insert', 'trg_search_student_update', 'trg_search_student_delete'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS student_search")
+
+
+@pytest.fixture(params=['trigram', 'words', None])
+def conn(request, tmp_path):
+    conn = sqlite3.connect(tmp_path / 'search.db')
+    migrations.migrate(conn)
+    conn.executemany("INSERT INTO student (class_name, student_name, father_name, parent_phone) VALUES (?, ?, ?, ?)",
+                     STUDENTS)
+    if request.param != student_search.index_mode(conn):
+        _drop_index(conn)
+        if request.param == 'words':
+            conn.execute("CREATE VIRTUAL TABLE student_search USING fts5("
+                         "student_name, father_name, parent_phone, tokenize='unicode61')")
+            conn.execute(f"INSERT INTO student_search (rowid, student_name, father_name, parent_phone) "
+                         f"SELECT id, student_name, father_name, {migrations.PHONE_DIGITS.format('parent_phone')} "
+                         f"FROM student")
+        elif request.param == 'trigram':
+            pytest.skip('SQLite has no trigram tokenizer')
+    assert student_search.index_mode(conn) == request.param
+    yield conn
+    conn.close()
+
+
+def names(rows):
+    return [row[2] for row in rows]
+
+
+@pytest.mark.parametrize('query', ['300 1234', '1234567', '4567'])
+def test_partial_phone_numbers_match(conn, query):
+    assert names(student_search.search_students(conn, query)) == ['Farhan Ali']
+
+
+def test_name_matches_rank_name_prefix_first(conn):
+    assert names(student_search.search_students(conn, 'ali')) == ['Ali Hamza', 'Farhan Ali']
+
+
+def test_class_narrows_results(conn):
+    assert names(student_search.search_students(conn, 'ali', class_name='Class 1')) == ['Farhan Ali']
+
+
+def test_punctuation_only_query_finds_nothing(conn):
+    assert student_search.search_students(conn, '--') == []
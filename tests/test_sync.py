@@ -0,0 +1,91 @@
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+
+import pytest
+
+import migrations
+import sync
+
+
+def connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def merge(conn, changes):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        applied = sync.apply_changes(conn, changes)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return applied
+
+
+def state(conn):
+    students = conn.execute(
+        "SELECT uid, class_name, student_name, monthly_fee FROM student ORDER BY uid").fetchall()
+    payments = conn.execute(
+        "SELECT s.uid, p.year, p.month_index, p.amount FROM payment p JOIN student s ON s.id = p.student_id "
+        "ORDER BY 1, 2, 3").fetchall()
+    balances = conn.execute(
+        "SELECT s.uid, b.year, b.total_paid, b.carry_forward_due FROM student_balance b "
+        "JOIN student s ON s.id = b.student_id ORDER BY 1, 2").fetchall()
+    return students, payments, balances
+
+
+def payment(conn, month_index):
+    return conn.execute("SELECT amount FROM payment WHERE student_id = 1 AND month_index = ?",
+                        (month_index,)).fetchone()
+
+
+@pytest.fixture
+def hub_and_phone(baseline_db, tmp_path):
+    """A migrated hub and a phone set up from a copy of it, as after a snapshot install."""
+    hub_path = baseline_db('hub.db')
+    with closing(connect(hub_path)) as hub:
+        migrations.migrate(hub)
+    phone_path = tmp_path / 'phone.db'
+    shutil.copy(hub_path, phone_path)
+    hub, phone = connect(hub_path), connect(phone_path)
+    phone.execute("UPDATE sync_meta SET value = 'phone' WHERE key = 'device_id'")
+    yield hub, phone
+    hub.close()
+    phone.close()
+
+
+def test_push_and_pull_resolve_conflicts_by_last_writer(hub_and_phone):
+    hub, phone = hub_and_phone
+    pushed = pulled = sync.current_version(hub)
+    assert payment(hub, 0) and payment(hub, 2)
+
+    # The phone edits first; the hub edits the same rows later.
+    phone.execute("UPDATE student SET monthly_fee = 1300 WHERE id = 1")
+    phone.execute("DELETE FROM payment WHERE student_id = 1 AND month_index IN (0, 2)")
+    time.sleep(0.01)
+    hub.execute("UPDATE student SET monthly_fee = 1400 WHERE id = 1")
+    hub.execute("UPDATE payment SET amount = 1250 WHERE student_id = 1 AND month_index = 2")
+
+    # Push, then pull, the way sync.sync_with does over HTTP.
+    merge(hub, sync.changes_since(phone, pushed))
+    merge(phone, sync.changes_since(hub, pulled, exclude_origin=sync.device_id(phone)))
+
+    assert state(hub) == state(phone)
+    for conn in (hub, phone):
+        assert conn.execute("SELECT monthly_fee FROM student WHERE id = 1").fetchone() == (1400,)
+        assert payment(conn, 0) is None  # deleted on the phone, untouched on the hub
+        assert payment(conn, 2) == (1250,)  # edited on the hub after the phone deleted it
+    assert hub.execute("SELECT COUNT(*) FROM sync_tombstone WHERE entity = 'payment'").fetchone() == (1,)
+
+
+def test_stale_changes_are_not_applied_twice(hub_and_phone):
+    hub, phone = hub_and_phone
+    since = sync.current_version(phone)
+    phone.execute("UPDATE student SET student_name = 'Rauf Ahmed' WHERE id = 1")
+    changes = sync.changes_since(phone, since)
+    assert merge(hub, changes) == 1
+    assert merge(hub, changes) == 0
@@ -0,0 +1,75 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import migrations
+import years
+
+
+@pytest.fixture
+def conn(baseline_db):
+    with closing(sqlite3.connect(baseline_db(), isolation_level=None)) as conn:
+        conn.execute("PRAGMA foreign_keys=ON")
+        migrations.migrate(conn)
+        yield conn
+
+
+def write(conn, func, *args):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = func(conn, *args)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return result
+
+
+def balance(conn, student_id, year):
+    return conn.execute(
+        "SELECT opening_balance, total_expected, total_paid, carry_forward_due FROM student_balance "
+        "WHERE student_id = ? AND year = ?", (student_id, year)).fetchone()
+
+
+def pay(conn, student_id, year, month_index, amount):
+    conn.execute("INSERT INTO payment (student_id, year, month_index, amount) VALUES (?, ?, ?, ?)",
+                 (student_id, year, month_index, amount))
+
+
+def test_close_and_archive_a_year_with_an_advance_payment(conn, tmp_path):
+    year = years.current_year(conn)
+    student = conn.execute("INSERT INTO student (class_name, student_name, father_name, monthly_fee) "
+                           "VALUES ('Years 1', 'Sana', 'Javed', 1000)").lastrowid
+    for month_index in range(6):
+        pay(conn, student, year, month_index, 1000)
+    pay(conn, student, year + 1, 0, 1000)  # paid in advance for next year's January
+    assert balance(conn, student, year + 1) == (0, 12000, 1000, 11000)
+
+    assert write(conn, years.close_year) == (year, year + 1)
+    assert (years.year_status(conn, year), years.current_year(conn)) == ('closed', year + 1)
+    # Half a year unpaid comes forward; the advance payment stays booked.
+    assert balance(conn, student, year + 1) == (6000, 12000, 1000, 17000)
+
+    # A late payment for the closed year arriving afterwards (e.g. through sync).
+    pay(conn, student, year, 6, 1000)
+    write(conn, years.recarry_from, year)
+    assert balance(conn, student, year + 1) == (5000, 12000, 1000, 16000)
+
+    archive = str(tmp_path / 'archive.db')
+    with pytest.raises(years.YearError):
+        years.archive_year(conn, year + 1, archive)
+    payments = conn.execute("SELECT COUNT(*) FROM payment WHERE year = ?", (year,)).fetchone()[0]
+    assert years.archive_year(conn, year, archive) == payments
+
+    assert years.year_status(conn, year) == 'archived'
+    assert conn.execute("SELECT COUNT(*) FROM payment WHERE year = ?", (year,)).fetchone() == (0,)
+    assert balance(conn, student, year) is None
+    assert balance(conn, student, year + 1) == (5000, 12000, 1000, 16000)
+    assert [row[1:3] for row in years.archived_payments(archive, student, year)] == [(m, 1000) for m in range(7)]
+    assert years.archived_balance(archive, student, year)['carry_forward_due'] == 5000
+    # Archiving removed rows without leaving sync tombstones for other devices to apply.
+    assert conn.execute("SELECT COUNT(*) FROM sync_tombstone").fetchone() == (0,)
+    listed = {entry['year']: entry for entry in years.list_years(conn, archive)}
+    opening = conn.execute("SELECT SUM(opening_balance) FROM student_balance WHERE year = ?", (year + 1,)).fetchone()[0]
+    assert (listed[year]['status'], listed[year]['total_due']) == ('archived', opening)
@@ -0,0 +1,236 @@
+"""Academic years: closing a year into the next one and archiving closed years.
+
+Exactly one year is open at a time (see `migrations.add_academic_years`);
+new payments are booked into it. Closing it opens the next year and brings
+every student's outstanding dues forward as that year's opening balance.
+A closed year can then be archived: its payments and balances move into a
+separate SQLite file, attached for the copy, so the hot `payment` table only
+holds the years still in use. Archived years stay readable through
+`archived_payments` and `archived_balance`.
+
+These functions take a plain sqlite3 connection, like `migrations` and `sync`.
+"""
+import os
+import sqlite3
+
+from migrations import CURRENT_YEAR
+
+
+class YearError(ValueError):
+    pass
+
+
+def archive_path(db_path):
+    """Where the closed years of `db_path` are archived: school_fee.db -> school_fee_archive.db."""
+    root, ext = os.path.splitext(db_path)
+    return f'{root}_archive{ext or ".db"}'
+
+
+def current_year(conn):
+    return conn.execute(f"SELECT {CURRENT_YEAR}").fetchone()[0]
+
+
+def year_status(conn, year):
+    """'open', 'closed', 'archived' or None for a year that was never opened."""
+    row = conn.execute("SELECT closed_at, archived_at FROM academic_year WHERE year = ?", (year,)).fetchone()
+    if row is None:
+        return None
+    return 'archived' if row[1] else 'closed' if row[0] else 'open'
+
+
+def closed_years(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT year FROM academic_year WHERE closed_at IS NOT NULL ORDER BY year")]
+
+
+def list_years(conn, path=None):
+    """Every year with its status and totals; archived years report the totals kept in the archive at `path`."""
+    rows = conn.execute(
+        "SELECT y.year, y.opened_at, y.closed_at, y.archived_at, COUNT(b.student_id), "
+        "COALESCE(SUM(b.opening_balance), 0), COALESCE(SUM(b.total_expected), 0), "
+        "COALESCE(SUM(b.total_paid), 0), COALESCE(SUM(b.carry_forward_due), 0) "
+        "FROM academic_year y LEFT JOIN student_balance b ON b.year = y.year "
+        "GROUP BY y.year ORDER BY y.year"
+    ).fetchall()
+    keys = ('year', 'opened_at', 'closed_at', 'archived_at', 'students',
+            'opening_balance', 'total_expected', 'total_paid', 'total_due')
+    years = []
+    for row in rows:
+        entry = dict(zip(keys, row))
+        entry['status'] = 'archived' if entry['archived_at'] else 'closed' if entry['closed_at'] else 'open'
+        years.append(entry)
+    archived = [entry for entry in years if entry['status'] == 'archived']
+    archive = _archive(path) if archived and path else None
+    if archive is not None:
+        try:
+            for entry in archived:
+                entry.update(zip(keys[4:], archive.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(opening_balance), 0), COALESCE(SUM(total_expected), 0), "
+                    "COALESCE(SUM(total_paid), 0), COALESCE(SUM(carry_forward_due), 0) "
+                    "FROM student_balance WHERE year = ?", (entry['year'],)).fetchone()))
+        finally:
+            archive.close()
+    return years
+
+
+def bump_generation(conn):
+    # Balance changes made here bypass the row triggers; bumping the change clock
+    # invalidates anything cached against it (see app.data_generation), and
+    # 'ledger_epoch' tells analytics.Ledger that a row-by-row refresh is not enough.
+    conn.execute("UPDATE sync_meta SET value = value + 1 WHERE key = 'clock'")
+    conn.execute("INSERT INTO sync_meta (key, value) VALUES ('ledger_epoch', 1) "
+                 "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+
+
+def carry_forward(conn, year):
+    """Set the opening balance of `year + 1` for every student to their dues at the end of `year`.
+
+    Students who already have a row for the next year (paid in advance) keep
+    their payments; only the opening balance and dues change. Safe to repeat,
+    e.g. after a late payment for a closed year arrives through sync.
+    """
+    conn.execute(
+        "INSERT INTO student_balance (student_id, year, opening_balance, total_expected, total_paid, carry_forward_due) "
+        "SELECT s.id, :next, COALESCE(b.carry_forward_due, 0), 12 * s.monthly_fee, 0, "
+        "       COALESCE(b.carry_forward_due, 0) + 12 * s.monthly_fee "
+        "FROM student s LEFT JOIN student_balance b ON b.student_id = s.id AND b.year = :year "
+        "WHERE true "  # required so SQLite does not read ON CONFLICT as part of the join
+        "ON CONFLICT (student_id, year) DO UPDATE SET "
+        "    opening_balance = excluded.opening_balance, "
+        "    carry_forward_due = MAX(0, excluded.opening_balance + total_expected - total_paid)",
+        {'year': year, 'next': year + 1}
+    )
+
+
+def close_year(conn):
+    """Close the open year and open the next one; returns (closed_year, opened_year).
+
+    The caller owns the transaction (use `pool.write_transaction()`).
+    """
+    year = current_year(conn)
+    conn.execute("UPDATE academic_year SET closed_at = datetime('now') WHERE year = ?", (year,))
+    conn.execute("INSERT OR IGNORE INTO academic_year (year) VALUES (?)", (year + 1,))
+    carry_forward(conn, year)
+    bump_generation(conn)
+    return year, year + 1
+
+
+def recarry_from(conn, year):
+    """Re-run `carry_forward` from a closed `year` up to the open year, after `year` changed."""
+    for y in range(year, current_year(conn)):
+        carry_forward(conn, y)
+    bump_generation(conn)
+
+
+ARCHIVE_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS archive.payment (
+        id INTEGER,
+        student_id INTEGER NOT NULL,
+        student_uid TEXT,
+        year INTEGER NOT NULL,
+        month_index INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        paid_on DATETIME,
+        PRIMARY KEY (student_id, year, month_index)
+    )''',
+    # Students may be deleted from the live database later, so their details are kept here.
+    '''CREATE TABLE IF NOT EXISTS archive.student_balance (
+        student_id INTEGER NOT NULL,
+        student_uid TEXT,
+        class_name TEXT,
+        student_name TEXT,
+        father_name TEXT,
+        monthly_fee INTEGER,
+        year INTEGER NOT NULL,
+        opening_balance INTEGER NOT NULL,
+        total_expected INTEGER NOT NULL,
+        total_paid INTEGER NOT NULL,
+        carry_forward_due INTEGER NOT NULL,
+        last_paid_month INTEGER,
+        PRIMARY KEY (student_id, year)
+    )''',
+    "CREATE INDEX IF NOT EXISTS archive.ix_archive_balance_year ON student_balance (year, class_name)",
+)
+
+
+def archive_year(conn, year, path):
+    """Move the payments and balances of closed `year` into the archive database at `path`.
+
+    Manages its own transaction: ATTACH is not allowed inside one. SQLite does
+    not commit two WAL databases atomically, so the copy uses INSERT OR REPLACE
+    and a run interrupted after the archive committed can simply be repeated.
+    Returns the number of payments moved.
+    """
+    status = year_status(conn, year)
+    if status is None:
+        raise YearError(f'unknown academic year {year}')
+    if status == 'open':
+        raise YearError(f'{year} is the open year; close it before archiving')
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    try:
+        # Explicit, as the app's engine connections run with isolation_level=None.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in ARCHIVE_SCHEMA:
+                conn.execute(statement)
+            # Marking the year first makes the delete triggers skip its rows: no
+            # tombstones are synced and no balances are touched.
+            conn.execute("UPDATE academic_year SET archived_at = datetime('now') WHERE year = ?", (year,))
+            conn.execute(
+                "INSERT OR REPLACE INTO archive.payment "
+                "(id, student_id, student_uid, year, month_index, amount, paid_on) "
+                "SELECT p.id, p.student_id, s.uid, p.year, p.month_index, p.amount, p.paid_on "
+                "FROM payment p JOIN student s ON s.id = p.student_id WHERE p.year = ?", (year,)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO archive.student_balance "
+                "(student_id, student_uid, class_name, student_name, father_name, monthly_fee, year, "
+                " opening_balance, total_expected, total_paid, carry_forward_due, last_paid_month) "
+                "SELECT b.student_id, s.uid, s.class_name, s.student_name, s.father_name, s.monthly_fee, b.year, "
+                "       b.opening_balance, b.total_expected, b.total_paid, b.carry_forward_due, b.last_paid_month "
+                "FROM student_balance b JOIN student s ON s.id = b.student_id WHERE b.year = ?", (year,)
+            )
+            moved = conn.execute("DELETE FROM payment WHERE year = ?", (year,)).rowcount
+            conn.execute("DELETE FROM student_balance WHERE year = ?", (year,))
+            bump_generation(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.execute("DETACH DATABASE archive")
+    return moved
+
+
+def _archive(path):
+    if not os.path.exists(path):
+        return None
+    return sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+
+
+def archived_payments(path, student_id, year):
+    """(id, month_index, amount, paid_on) rows of an archived year, oldest month first."""
+    conn = _archive(path)
+    if conn is None:
+        return []
+    try:
+        return conn.execute(
+            "SELECT id, month_index, amount, paid_on FROM payment WHERE student_id = ? AND year = ? "
+            "ORDER BY month_index", (student_id, year)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def archived_balance(path, student_id, year):
+    """The archived balance row of one student and year as a dict, or None."""
+    conn = _archive(path)
+    if conn is None:
+        return None
+    try:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM student_balance WHERE student_id = ? AND year = ?",
+                           (student_id, year)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()